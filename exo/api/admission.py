@@ -0,0 +1,159 @@
+"""
+Admission control for API requests
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from typing import List, Optional, Tuple
+
+from exo.helpers import DEBUG
+
+PRIORITIES = ["high", "normal", "low"]
+
+
+class AdmissionRejected(Exception):
+  def __init__(self, reason: str, retry_after: int, status: int = 429):
+    super().__init__(reason)
+    self.reason = reason
+    self.retry_after = retry_after
+    self.status = status
+
+
+class Ticket:
+  def __init__(self, priority: str, tokens: int):
+    self.priority = priority
+    self.tokens = tokens
+    self.enqueued_at = time.perf_counter()
+    self.admitted_at: Optional[float] = None
+    self.future: Optional[asyncio.Future] = None
+
+
+class AdmissionController:
+  """
+  Bounded admission of requests into the ring.
+
+  Up to max_in_flight requests run at once. Others wait in a queue ordered by
+  priority class, then arrival, holding at most max_queued requests and
+  max_queued_tokens prompt tokens (0 for no limit). When the queue is full a new
+  request is rejected right away with a Retry-After estimate, unless rejecting
+  lower priority waiters, lowest first, makes room for it. A prompt over
+  max_queued_tokens on its own could never be queued and is rejected as too large.
+  """
+  def __init__(self, max_in_flight: int = 16, max_queued: int = 64, max_queued_tokens: int = 0):
+    self.max_in_flight = max(1, max_in_flight)
+    self.max_queued = max_queued
+    self.max_queued_tokens = max_queued_tokens
+    self.in_flight = 0
+    self.queue: List[Tuple[int, int, Ticket]] = []
+    self.queued_tokens = 0
+    self.counter = itertools.count()
+    # running estimate of how long a request holds its slot, in seconds
+    self.service_time = 10.0
+
+    # stats
+    self.admitted = 0
+    self.rejected = 0
+    self.total_wait = 0.0
+    self.max_wait = 0.0
+
+  async def acquire(self, tokens: int = 0, priority: str = "normal") -> Ticket:
+    """
+    Wait for a slot. Raises AdmissionRejected if the queue is full.
+    """
+    if priority not in PRIORITIES:
+      raise ValueError(f"Unknown priority {priority}, expected one of {PRIORITIES}")
+    ticket = Ticket(priority, tokens)
+    if self.in_flight < self.max_in_flight and not self.queue:
+      self._admit(ticket)
+      return ticket
+
+    self._make_room(ticket)
+    ticket.future = asyncio.get_running_loop().create_future()
+    heapq.heappush(self.queue, (PRIORITIES.index(priority), next(self.counter), ticket))
+    self.queued_tokens += tokens
+    try:
+      await ticket.future
+    except asyncio.CancelledError:
+      # client went away while queued, or admitted just as it was cancelled
+      if ticket.admitted_at is not None:
+        self.release(ticket)
+      else:
+        self._remove(ticket)
+      raise
+    return ticket
+
+  def release(self, ticket: Ticket) -> None:
+    if ticket.admitted_at is None: return
+    self.service_time = 0.9*self.service_time + 0.1*(time.perf_counter() - ticket.admitted_at)
+    ticket.admitted_at = None
+    self.in_flight -= 1
+    while self.queue and self.in_flight < self.max_in_flight:
+      _, _, waiter = heapq.heappop(self.queue)
+      self.queued_tokens -= waiter.tokens
+      self._admit(waiter)
+      waiter.future.set_result(None)
+
+  def _admit(self, ticket: Ticket) -> None:
+    ticket.admitted_at = time.perf_counter()
+    wait = ticket.admitted_at - ticket.enqueued_at
+    self.in_flight += 1
+    self.admitted += 1
+    self.total_wait += wait
+    self.max_wait = max(self.max_wait, wait)
+
+  def _is_full(self, tokens: int, queued: int, queued_tokens: int) -> bool:
+    if queued >= self.max_queued: return True
+    return self.max_queued_tokens > 0 and queued_tokens + tokens > self.max_queued_tokens
+
+  def _make_room(self, ticket: Ticket) -> None:
+    if self.max_queued_tokens > 0 and ticket.tokens > self.max_queued_tokens:
+      self.rejected += 1
+      raise AdmissionRejected(f"Prompt of {ticket.tokens} tokens is over the queue limit of {self.max_queued_tokens} tokens", 0, status=413)
+
+    # waiters it outranks, lowest priority and latest arrival first, taken
+    # only as far as needed and only if that is enough to fit the ticket
+    rank = PRIORITIES.index(ticket.priority)
+    outranked = sorted((entry for entry in self.queue if entry[0] > rank), key=lambda entry: (entry[0], entry[1]), reverse=True)
+    preempted = []
+    queued, queued_tokens = len(self.queue), self.queued_tokens
+    for entry in outranked:
+      if not self._is_full(ticket.tokens, queued, queued_tokens): break
+      preempted.append(entry[2])
+      queued -= 1
+      queued_tokens -= entry[2].tokens
+    if self._is_full(ticket.tokens, queued, queued_tokens):
+      self.rejected += 1
+      raise AdmissionRejected("Too many requests queued", self.retry_after())
+
+    for waiter in preempted:
+      self._remove(waiter)
+      self.rejected += 1
+      waiter.future.set_exception(AdmissionRejected(f"Preempted by a {ticket.priority} priority request", self.retry_after()))
+
+  def _remove(self, ticket: Ticket) -> None:
+    for i, (_, _, queued) in enumerate(self.queue):
+      if queued is ticket:
+        self.queue.pop(i)
+        heapq.heapify(self.queue)
+        self.queued_tokens -= ticket.tokens
+        return
+
+  def retry_after(self) -> int:
+    """Seconds until a slot is likely free, assuming the queue drains at the current service time."""
+    seconds = self.service_time*(len(self.queue) + 1)/self.max_in_flight
+    if DEBUG >= 2: print(f"[AdmissionController] rejecting, {len(self.queue)} queued, retry after {seconds:.1f}s")
+    return max(1, math.ceil(seconds))
+
+  def stats(self) -> dict:
+    return {
+      "in_flight": self.in_flight,
+      "max_in_flight": self.max_in_flight,
+      "queue_depth": len(self.queue),
+      "queued_tokens": self.queued_tokens,
+      "admitted": self.admitted,
+      "rejected": self.rejected,
+      "avg_wait": self.total_wait/self.admitted if self.admitted else 0.0,
+      "max_wait": self.max_wait,
+    }
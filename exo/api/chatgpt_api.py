@@ -12,7 +12,9 @@ import traceback
 import signal
 from exo import DEBUG, VERSION
 from exo.helpers import PrefixDict, shutdown, get_exo_images_dir
-from exo.inference.tokenizers import resolve_tokenizer
+from exo.inference.tokenizers import IncrementalDetokenizer, TokenizerService
+from exo.api.admission import AdmissionController, AdmissionRejected, PRIORITIES
+from exo.metrics import CONTENT_TYPE_LATEST, CollectorRegistry, NodeCollector, TokenTimer, render
 from exo.orchestration import Node
 from exo.models import build_base_shard, build_full_shard, model_cards, get_repo, get_supported_models, get_pretty_name
 from typing import Callable, Optional
@@ -25,7 +27,6 @@ from exo.download.download_progress import RepoProgressEvent
 from exo.download.new_shard_download import delete_model
 import tempfile
 from exo.apputil import create_animation_mp4
-from collections import defaultdict
 
 if platform.system().lower() == "darwin" and platform.machine().lower() == "arm64":
   import mlx.core as mx
@@ -59,13 +60,13 @@ class ChatCompletionRequest:
 
 def generate_completion(
   chat_request: ChatCompletionRequest,
-  tokenizer,
-  prompt: str,
   request_id: str,
   tokens: List[int],
+  text: str,
   stream: bool,
   finish_reason: Union[Literal["length", "stop"], None],
   object_type: Literal["chat.completion", "text_completion"],
+  prompt_tokens: int = 0,
 ) -> dict:
   completion = {
     "id": f"chatcmpl-{request_id}",
@@ -75,7 +76,7 @@ def generate_completion(
     "system_fingerprint": f"exo_{VERSION}",
     "choices": [{
       "index": 0,
-      "message": {"role": "assistant", "content": tokenizer.decode(tokens)},
+      "message": {"role": "assistant", "content": text},
       "logprobs": None,
       "finish_reason": finish_reason,
     }],
@@ -86,17 +87,17 @@ def generate_completion(
 
   if not stream:
     completion["usage"] = {
-      "prompt_tokens": len(tokenizer.encode(prompt)),
+      "prompt_tokens": prompt_tokens,
       "completion_tokens": len(tokens),
-      "total_tokens": len(tokenizer.encode(prompt)) + len(tokens),
+      "total_tokens": prompt_tokens + len(tokens),
     }
 
   choice = completion["choices"][0]
   if object_type.startswith("chat.completion"):
     key_name = "delta" if stream else "message"
-    choice[key_name] = {"role": "assistant", "content": tokenizer.decode(tokens)}
+    choice[key_name] = {"role": "assistant", "content": text}
   elif object_type == "text_completion":
-    choice["text"] = tokenizer.decode(tokens)
+    choice["text"] = text
   else:
     ValueError(f"Unsupported response type: {object_type}")
 
@@ -189,7 +190,8 @@ class ChatGPTAPI:
     response_timeout: int = 90,
     on_chat_completion_request: Callable[[str, ChatCompletionRequest, str], None] = None,
     default_model: Optional[str] = None,
-    system_prompt: Optional[str] = None
+    system_prompt: Optional[str] = None,
+    admission: Optional[AdmissionController] = None
   ):
     self.node = node
     self.inference_engine_classname = inference_engine_classname
@@ -200,11 +202,11 @@ class ChatGPTAPI:
     self.prev_token_lens: Dict[str, int] = {}
     self.stream_tasks: Dict[str, asyncio.Task] = {}
     self.default_model = default_model or "llama-3.2-1b"
-    self.token_queues = defaultdict(asyncio.Queue)
+    self.tokenizer_service = TokenizerService()
+    self.admission = admission or AdmissionController()
+    self.metrics_registry = CollectorRegistry()
+    self.metrics_registry.register(NodeCollector(node, self.admission))
 
-    # Get the callback system and register our handler
-    self.token_callback = node.on_token.register("chatgpt-api-token-handler")
-    self.token_callback.on_next(lambda _request_id, tokens, is_finished: asyncio.create_task(self.handle_tokens(_request_id, tokens, is_finished)))
     self.system_prompt = system_prompt
 
     cors = aiohttp_cors.setup(self.app)
@@ -231,6 +233,8 @@ class ChatGPTAPI:
     cors.add(self.app.router.add_post("/download", self.handle_post_download), {"*": cors_options})
     cors.add(self.app.router.add_get("/v1/topology", self.handle_get_topology), {"*": cors_options})
     cors.add(self.app.router.add_get("/topology", self.handle_get_topology), {"*": cors_options})
+    cors.add(self.app.router.add_get("/v1/queue", self.handle_get_queue), {"*": cors_options})
+    cors.add(self.app.router.add_get("/metrics", self.handle_get_metrics), {"*": cors_options})
 
     # Add static routes
     if "__compiled__" not in globals():
@@ -304,9 +308,10 @@ class ChatGPTAPI:
       model = self.default_model
     shard = build_base_shard(model, self.inference_engine_classname)
     messages = [parse_message(msg) for msg in data.get("messages", [])]
-    tokenizer = await resolve_tokenizer(get_repo(shard.model_id, self.inference_engine_classname))
-    prompt = build_prompt(tokenizer, messages, data.get("tools", None))
-    tokens = tokenizer.encode(prompt)
+    _, prompt, tokens = await self.tokenizer_service.encode_prompt(
+      get_repo(shard.model_id, self.inference_engine_classname),
+      lambda tokenizer: build_prompt(tokenizer, messages, data.get("tools", None))
+    )
     return web.json_response({
       "length": len(prompt),
       "num_tokens": len(tokens),
@@ -314,6 +319,12 @@ class ChatGPTAPI:
       "encoded_prompt": prompt,
     })
 
+  async def handle_get_queue(self, request):
+    return web.json_response(self.admission.stats())
+
+  async def handle_get_metrics(self, request):
+    return web.Response(body=render(self.metrics_registry), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
   async def handle_get_download_progress(self, request):
     progress_data = {}
     for node_id, progress_event in self.node.node_download_progress.items():
@@ -325,6 +336,7 @@ class ChatGPTAPI:
     return web.json_response(progress_data)
 
   async def handle_post_chat_completions(self, request):
+    received_at = time.perf_counter()
     data = await request.json()
     if DEBUG >= 2: print(f"[ChatGPTAPI] Handling chat completions request from {request.remote}: {data}")
     stream = data.get("stream", False)
@@ -342,15 +354,26 @@ class ChatGPTAPI:
         status=400,
       )
 
-    tokenizer = await resolve_tokenizer(get_repo(shard.model_id, self.inference_engine_classname))
-    if DEBUG >= 4: print(f"[ChatGPTAPI] Resolved tokenizer: {tokenizer}")
-
     # Add system prompt if set
     if self.system_prompt and not any(msg.role == "system" for msg in chat_request.messages):
       chat_request.messages.insert(0, Message("system", self.system_prompt))
 
-    prompt = build_prompt(tokenizer, chat_request.messages, chat_request.tools)
+    tokenizer, prompt, prompt_tokens = await self.tokenizer_service.encode_prompt(
+      get_repo(shard.model_id, self.inference_engine_classname),
+      lambda tokenizer: build_prompt(tokenizer, chat_request.messages, chat_request.tools)
+    )
+    if DEBUG >= 4: print(f"[ChatGPTAPI] Resolved tokenizer: {tokenizer}")
+
+    priority = request.headers.get("X-Priority", data.get("priority", "normal"))
+    if priority not in PRIORITIES:
+      return web.json_response({"detail": f"Invalid priority: {priority}. Must be one of {PRIORITIES}"}, status=400)
+    try:
+      ticket = await self.admission.acquire(len(prompt_tokens), priority)
+    except AdmissionRejected as e:
+      headers = {"Retry-After": str(e.retry_after)} if e.status == 429 else None
+      return web.json_response({"detail": e.reason}, status=e.status, headers=headers)
     request_id = str(uuid.uuid4())
+    subscription = self.node.token_router.subscribe(request_id)
     if self.on_chat_completion_request:
       try:
         self.on_chat_completion_request(request_id, chat_request, prompt)
@@ -358,6 +381,7 @@ class ChatGPTAPI:
         if DEBUG >= 2: traceback.print_exc()
 
     if DEBUG >= 2: print(f"[ChatGPTAPI] Processing prompt: {request_id=} {shard=} {prompt=}")
+    token_timer = TokenTimer(chat_request.model, self.node.id, started_at=received_at)
 
     try:
       await asyncio.wait_for(asyncio.shield(asyncio.create_task(self.node.process_prompt(shard, prompt, request_id=request_id))), timeout=self.response_timeout)
@@ -376,14 +400,13 @@ class ChatGPTAPI:
         await response.prepare(request)
 
         try:
+          detokenizer = IncrementalDetokenizer(tokenizer)
           # Stream tokens while waiting for inference to complete
           while True:
-            if DEBUG >= 2: print(f"[ChatGPTAPI] Waiting for token from queue: {request_id=}")
-            tokens, is_finished = await asyncio.wait_for(
-              self.token_queues[request_id].get(),
-              timeout=self.response_timeout
-            )
-            if DEBUG >= 2: print(f"[ChatGPTAPI] Got token from queue: {request_id=} {tokens=} {is_finished=}")
+            if DEBUG >= 2: print(f"[ChatGPTAPI] Waiting for tokens: {request_id=}")
+            tokens, is_finished = await subscription.get(timeout=self.response_timeout)
+            if DEBUG >= 2: print(f"[ChatGPTAPI] Got tokens: {request_id=} {tokens=} {is_finished=}")
+            token_timer.tokens(len(tokens))
 
             eos_token_id = None
             if not eos_token_id and hasattr(tokenizer, "eos_token_id"): eos_token_id = tokenizer.eos_token_id
@@ -393,12 +416,16 @@ class ChatGPTAPI:
             if is_finished: finish_reason = "stop" if tokens[-1] == eos_token_id else "length"
             if DEBUG >= 2: print(f"{eos_token_id=} {tokens[-1]=} {finish_reason=}")
 
+            text = detokenizer.add(tokens)
+            if is_finished: text += detokenizer.flush()
+            # the tokens end in the middle of a character, send it with the next ones
+            if not text and not is_finished: continue
+
             completion = generate_completion(
               chat_request,
-              tokenizer,
-              prompt,
               request_id,
               tokens,
+              text,
               stream,
               finish_reason,
               "chat.completion",
@@ -424,19 +451,16 @@ class ChatGPTAPI:
             {"detail": f"Error processing prompt: {str(e)}"},
             status=500
           )
-
-        finally:
-          # Clean up the queue for this request
-          if request_id in self.token_queues:
-            if DEBUG >= 2: print(f"[ChatGPTAPI] Cleaning up token queue: {request_id=}")
-            del self.token_queues[request_id]
       else:
-        tokens = []
+        detokenizer = IncrementalDetokenizer(tokenizer)
         while True:
-          _tokens, is_finished = await asyncio.wait_for(self.token_queues[request_id].get(), timeout=self.response_timeout)
-          tokens.extend(_tokens)
+          _tokens, is_finished = await subscription.get(timeout=self.response_timeout)
+          token_timer.tokens(len(_tokens))
+          detokenizer.add(_tokens)
           if is_finished:
+            detokenizer.flush()
             break
+        tokens = detokenizer.tokens
         finish_reason = "length"
         eos_token_id = None
         if not eos_token_id and hasattr(tokenizer, "eos_token_id"): eos_token_id = tokenizer.eos_token_id
@@ -445,12 +469,17 @@ class ChatGPTAPI:
         if tokens[-1] == eos_token_id:
           finish_reason = "stop"
 
-        return web.json_response(generate_completion(chat_request, tokenizer, prompt, request_id, tokens, stream, finish_reason, "chat.completion"))
+        return web.json_response(
+          generate_completion(chat_request, request_id, tokens, detokenizer.text, stream, finish_reason, "chat.completion", prompt_tokens=len(prompt_tokens))
+        )
     except asyncio.TimeoutError:
       return web.json_response({"detail": "Response generation timed out"}, status=408)
     except Exception as e:
       if DEBUG >= 2: traceback.print_exc()
       return web.json_response({"detail": f"Error processing prompt (see logs with DEBUG>=2): {str(e)}"}, status=500)
+    finally:
+      self.node.token_router.unsubscribe(request_id)
+      self.admission.release(ticket)
 
   async def handle_post_image_generations(self, request):
     data = await request.json()
@@ -467,8 +496,8 @@ class ChatGPTAPI:
       return web.json_response({"error": f"Unsupported model: {model} with inference engine {self.inference_engine_classname}"}, status=400)
 
     request_id = str(uuid.uuid4())
-    callback_id = f"chatgpt-api-wait-response-{request_id}"
-    callback = self.node.on_token.register(callback_id)
+    # progress updates are [step, total] lists, so they must not be merged like tokens
+    subscription = self.node.token_router.subscribe(request_id, batch=False)
     try:
       if image_url != "" and image_url != None:
         img = self.base64_decode(image_url)
@@ -525,24 +554,18 @@ class ChatGPTAPI:
             if DEBUG >= 2: traceback.print_exc()
             await response.write(json.dumps({'error': str(e)}).encode('utf-8') + b'\n')
 
-      stream_task = None
-
-      def on_result(_request_id: str, result, is_finished: bool):
-        nonlocal stream_task
-        stream_task = asyncio.create_task(stream_image(_request_id, result, is_finished))
-        return _request_id == request_id and is_finished
-
-      await callback.wait(on_result, timeout=self.response_timeout*10)
-
-      if stream_task:
-        # Wait for the stream task to complete before returning
-        await stream_task
+      is_finished = False
+      while not is_finished:
+        result, is_finished = await subscription.get(timeout=self.response_timeout*10)
+        await stream_image(request_id, result, is_finished)
 
       return response
 
     except Exception as e:
       if DEBUG >= 2: traceback.print_exc()
       return web.json_response({"detail": f"Error processing prompt (see logs with DEBUG>=2): {str(e)}"}, status=500)
+    finally:
+      self.node.token_router.unsubscribe(request_id)
 
   async def handle_delete_model(self, request):
     model_id = request.match_info.get('model_name')
@@ -623,11 +646,10 @@ class ChatGPTAPI:
       if DEBUG >= 2: traceback.print_exc()
       return web.json_response({"detail": f"Error getting topology: {str(e)}"}, status=500)
 
-  async def handle_tokens(self, request_id: str, tokens: List[int], is_finished: bool):
-    await self.token_queues[request_id].put((tokens, is_finished))
-
   async def run(self, host: str = "0.0.0.0", port: int = 52415):
-    runner = web.AppRunner(self.app)
+    # cancel the handler of a client that disconnects, so a request waiting for
+    # admission gives up its place instead of generating for nobody
+    runner = web.AppRunner(self.app, handler_cancellation=True)
     await runner.setup()
     site = web.TCPSite(runner, host, port)
     await site.start()
@@ -0,0 +1,136 @@
+import asyncio
+from unittest import mock
+
+import aiohttp
+import pytest
+
+from exo.api.admission import AdmissionController, AdmissionRejected
+from exo.api.chatgpt_api import ChatGPTAPI
+
+
+@pytest.mark.asyncio
+async def test_queue_admits_by_priority_then_arrival():
+  admission = AdmissionController(max_in_flight=1, max_queued=8)
+  running = await admission.acquire()
+  order = []
+
+  async def wait(name, priority):
+    ticket = await admission.acquire(priority=priority)
+    order.append(name)
+    admission.release(ticket)
+
+  waiters = [asyncio.create_task(wait(name, priority)) for name, priority in [("a", "low"), ("b", "normal"), ("c", "high"), ("d", "normal")]]
+  await asyncio.sleep(0)
+  assert admission.stats()["queue_depth"] == 4
+
+  admission.release(running)
+  await asyncio.gather(*waiters)
+  assert order == ["c", "b", "d", "a"]
+  assert admission.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_with_retry_after():
+  admission = AdmissionController(max_in_flight=1, max_queued=1)
+  await admission.acquire()
+  waiter = asyncio.create_task(admission.acquire())
+  await asyncio.sleep(0)
+
+  with pytest.raises(AdmissionRejected) as rejected:
+    await admission.acquire()
+  assert rejected.value.retry_after >= 1
+  assert admission.stats()["rejected"] == 1
+  waiter.cancel()
+
+
+@pytest.mark.asyncio
+async def test_higher_priority_preempts_lowest_waiter():
+  admission = AdmissionController(max_in_flight=1, max_queued=1)
+  await admission.acquire()
+  low = asyncio.create_task(admission.acquire(priority="low"))
+  await asyncio.sleep(0)
+  high = asyncio.create_task(admission.acquire(priority="high"))
+  await asyncio.sleep(0)
+
+  with pytest.raises(AdmissionRejected):
+    await low
+  assert not high.done()
+  high.cancel()
+
+
+@pytest.mark.asyncio
+async def test_queued_token_budget():
+  admission = AdmissionController(max_in_flight=1, max_queued=8, max_queued_tokens=100)
+  await admission.acquire(tokens=500)
+  waiter = asyncio.create_task(admission.acquire(tokens=80))
+  await asyncio.sleep(0)
+
+  with pytest.raises(AdmissionRejected):
+    await admission.acquire(tokens=30)
+  assert admission.stats()["queued_tokens"] == 80
+
+  waiter.cancel()
+  await asyncio.sleep(0)
+  assert admission.stats()["queued_tokens"] == 0
+
+
+@pytest.mark.asyncio
+async def test_prompt_over_the_token_budget_is_rejected_without_preempting():
+  admission = AdmissionController(max_in_flight=1, max_queued=8, max_queued_tokens=100)
+  await admission.acquire()
+  low = asyncio.create_task(admission.acquire(tokens=50, priority="low"))
+  await asyncio.sleep(0)
+
+  with pytest.raises(AdmissionRejected) as rejected:
+    await admission.acquire(tokens=150, priority="high")
+  assert rejected.value.status == 413
+  assert not low.done()
+  low.cancel()
+
+
+@pytest.mark.asyncio
+async def test_waiters_are_only_preempted_when_that_makes_room():
+  admission = AdmissionController(max_in_flight=1, max_queued=8, max_queued_tokens=100)
+  await admission.acquire()
+  high = asyncio.create_task(admission.acquire(tokens=60, priority="high"))
+  low = asyncio.create_task(admission.acquire(tokens=30, priority="low"))
+  await asyncio.sleep(0)
+
+  # even without the low priority waiter 60 + 80 tokens would not fit
+  with pytest.raises(AdmissionRejected) as rejected:
+    await admission.acquire(tokens=80, priority="normal")
+  assert rejected.value.status == 429
+  assert not low.done()
+  assert admission.stats()["queued_tokens"] == 90
+
+  normal = asyncio.create_task(admission.acquire(tokens=30, priority="normal"))
+  await asyncio.sleep(0)
+  with pytest.raises(AdmissionRejected):
+    await low
+  assert admission.stats()["queued_tokens"] == 90
+  high.cancel()
+  normal.cancel()
+
+
+@pytest.mark.asyncio
+async def test_disconnected_client_gives_up_its_place():
+  admission = AdmissionController(max_in_flight=1, max_queued=8)
+  api = ChatGPTAPI(mock.Mock(), "DummyInferenceEngine", default_model="dummy", admission=admission)
+  api.tokenizer_service.encode_prompt = mock.AsyncMock(return_value=(None, "hello", [1, 2]))
+  await api.run("127.0.0.1", 52419)
+  running = await admission.acquire()
+
+  async with aiohttp.ClientSession() as session:
+    request = asyncio.create_task(session.post("http://127.0.0.1:52419/v1/chat/completions", json={"model": "dummy", "messages": [{"role": "user", "content": "hello"}]}))
+    for _ in range(100):
+      if admission.stats()["queue_depth"] == 1: break
+      await asyncio.sleep(0.01)
+    assert admission.stats()["queue_depth"] == 1
+    request.cancel()
+
+  for _ in range(100):
+    if admission.stats()["queue_depth"] == 0: break
+    await asyncio.sleep(0.01)
+  assert admission.stats()["queue_depth"] == 0
+  admission.release(running)
+  assert admission.stats()["in_flight"] == 0
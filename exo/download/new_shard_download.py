@@ -4,6 +4,7 @@ from pathlib import Path
 from exo.download.hf.hf_helpers import get_hf_endpoint, get_auth_headers, filter_repo_objects, get_allow_patterns
 from exo.download.shard_download import ShardDownloader
 from exo.download.download_progress import RepoProgressEvent, RepoFileProgressEvent
+from exo.download.peer_files import find_peer_files
 from exo.helpers import AsyncCallbackSystem, DEBUG
 from exo.models import get_supported_models, build_full_shard
 import os
@@ -11,7 +12,7 @@ import aiofiles.os as aios
 import aiohttp
 import aiofiles
 from urllib.parse import urljoin
-from typing import Callable, Union, Tuple, Dict, List, Optional, Literal, AsyncIterator
+from typing import Awaitable, Callable, Union, Tuple, Dict, List, Optional, Literal, AsyncIterator, Sequence
 import time
 from datetime import timedelta
 import asyncio
@@ -21,6 +22,12 @@ import shutil
 import tempfile
 import hashlib
 
+# files at least this big are downloaded over several connections
+SEGMENTED_DOWNLOAD_MIN_BYTES = 128 * 1024 * 1024
+MIN_SEGMENT_BYTES = 32 * 1024 * 1024
+# how often the received ranges of a segmented download are saved
+SEGMENT_STATE_SAVE_BYTES = 64 * 1024 * 1024
+
 def exo_home() -> Path:
   return Path(os.environ.get("EXO_HOME", Path.home()/".cache"/"exo"))
 
@@ -107,14 +114,65 @@ async def _fetch_file_list(repo_id: str, revision: str = "main", path: str = "")
         raise Exception(f"Failed to fetch file list: {response.status}")
 
 async def calc_hash(path: Path, type: Literal["sha1", "sha256"] = "sha1") -> str:
-  hash = hashlib.sha1() if type == "sha1" else hashlib.sha256()
-  if type == "sha1":
-    header = f"blob {(await aios.stat(path)).st_size}\0".encode()
-    hash.update(header)
-  async with aiofiles.open(path, 'rb') as f:
-    while chunk := await f.read(8 * 1024 * 1024):
-      hash.update(chunk)
-  return hash.hexdigest()
+  length = (await aios.stat(path)).st_size
+  return await StreamingHasher(path, length, type, available=length).hexdigest()
+
+class StreamingHasher:
+  """
+  Hashes a file while it is being downloaded, on a worker thread.
+
+  The downloader reports each chunk it wrote and how far the file is complete
+  from the start with written(). Chunks at the hash position are hashed from
+  memory. Everything else is read back from disk once the hash gets to it,
+  which covers a resumed prefix and ranges that other segments got ahead.
+  hashlib state cannot be saved, so a resumed download hashes its prefix again,
+  but it does so while the rest is still downloading.
+  """
+  def __init__(self, path: Path, length: int, type: Literal["sha1", "sha256"], available: int = 0, max_pending: int = 4):
+    self.path = path
+    self.length = length
+    self.hash = hashlib.sha1() if type == "sha1" else hashlib.sha256()
+    # git blob hash
+    if type == "sha1": self.hash.update(f"blob {length}\0".encode())
+    self.offset = 0
+    self.available = available
+    self.pending: Dict[int, bytes] = {}
+    self.max_pending = max_pending
+    self.changed = asyncio.Event()
+    self.task = asyncio.create_task(self._run())
+
+  def written(self, offset: int, chunk: bytes, available: int):
+    # only chunks the hash reaches next are kept, the rest is cheaper to read back than to hold
+    if self.offset <= offset <= self.available and len(self.pending) < self.max_pending: self.pending[offset] = chunk
+    self.available = max(self.available, available)
+    self.changed.set()
+
+  async def _run(self):
+    while self.offset < self.length:
+      if self.offset >= self.available:
+        self.changed.clear()
+        await self.changed.wait()
+        continue
+      chunk = self.pending.pop(self.offset, None)
+      if chunk is None:
+        until = min([offset for offset in self.pending if offset > self.offset] + [self.available, self.offset + 8 * 1024 * 1024])
+        chunk = await asyncio.to_thread(_read_range, self.path, self.offset, until - self.offset)
+        if not chunk: raise Exception(f"{self.path} ends at {self.offset} but {self.available} bytes were written")
+      await asyncio.to_thread(self.hash.update, chunk)
+      self.offset += len(chunk)
+      for offset in [offset for offset in self.pending if offset < self.offset]: del self.pending[offset]
+
+  async def hexdigest(self) -> str:
+    await self.task
+    return self.hash.hexdigest()
+
+  def cancel(self):
+    self.task.cancel()
+
+def _read_range(path: Path, offset: int, size: int) -> bytes:
+  with open(path, 'rb') as f:
+    f.seek(offset)
+    return f.read(size)
 
 async def file_meta(repo_id: str, revision: str, path: str) -> Tuple[int, str]:
   url = urljoin(f"{get_hf_endpoint()}/{repo_id}/resolve/{revision}/", path)
@@ -128,36 +186,48 @@ async def file_meta(repo_id: str, revision: str, path: str) -> Tuple[int, str]:
       if  (etag[0] == '"' and etag[-1] == '"') or (etag[0] == "'" and etag[-1] == "'"): etag = etag[1:-1]
       return content_length, etag
 
-async def download_file_with_retry(repo_id: str, revision: str, path: str, target_dir: Path, on_progress: Callable[[int, int], None] = lambda _, __: None) -> Path:
+async def download_file_with_retry(repo_id: str, revision: str, path: str, target_dir: Path, on_progress: Callable[[int, int], None] = lambda _, __: None, max_connections: int = 1, peers: Sequence = ()) -> Path:
   n_attempts = 30
   for attempt in range(n_attempts):
-    try: return await _download_file(repo_id, revision, path, target_dir, on_progress)
+    try: return await _download_file(repo_id, revision, path, target_dir, on_progress, max_connections, peers)
     except Exception as e:
       if isinstance(e, FileNotFoundError) or attempt == n_attempts - 1: raise e
       print(f"Download error on attempt {attempt}/{n_attempts} for {repo_id=} {revision=} {path=} {target_dir=}")
       traceback.print_exc()
       await asyncio.sleep(min(8, 0.1 * (2 ** attempt)))
 
-async def _download_file(repo_id: str, revision: str, path: str, target_dir: Path, on_progress: Callable[[int, int], None] = lambda _, __: None) -> Path:
+async def _download_file(repo_id: str, revision: str, path: str, target_dir: Path, on_progress: Callable[[int, int], None] = lambda _, __: None, max_connections: int = 1, peers: Sequence = ()) -> Path:
   if await aios.path.exists(target_dir/path): return target_dir/path
   await aios.makedirs((target_dir/path).parent, exist_ok=True)
   length, etag = await file_meta(repo_id, revision, path)
   remote_hash = etag[:-5] if etag.endswith("-gzip") else etag
   partial_path = target_dir/f"{path}.partial"
-  resume_byte_pos = (await aios.stat(partial_path)).st_size if (await aios.path.exists(partial_path)) else None
-  if resume_byte_pos != length:
-    url = urljoin(f"{get_hf_endpoint()}/{repo_id}/resolve/{revision}/", path)
-    headers = await get_auth_headers()
-    if resume_byte_pos: headers['Range'] = f'bytes={resume_byte_pos}-'
-    n_read = resume_byte_pos or 0
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1800, connect=60, sock_read=1800, sock_connect=60)) as session:
-      async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=1800, connect=60, sock_read=1800, sock_connect=60)) as r:
-        if r.status == 404: raise FileNotFoundError(f"File not found: {url}")
-        assert r.status in [200, 206], f"Failed to download {path} from {url}: {r.status}"
-        async with aiofiles.open(partial_path, 'ab' if resume_byte_pos else 'wb') as f:
-          while chunk := await r.content.read(8 * 1024 * 1024): on_progress(n_read := n_read + await f.write(chunk), length)
-
-  final_hash = await calc_hash(partial_path, type="sha256" if len(remote_hash) == 64 else "sha1")
+  url = urljoin(f"{get_hf_endpoint()}/{repo_id}/resolve/{revision}/", path)
+  hash_type = "sha256" if len(remote_hash) == 64 else "sha1"
+  # peers that have the file are tried first, what they send is checked against the hub's hash all the same
+  for peer in peers:
+    if await aios.path.exists(segment_state_path(partial_path)): break
+    try: peer_hash = await _download_from_peer(peer, repo_id, path, partial_path, length, on_progress, hash_type)
+    except Exception as e:
+      if DEBUG >= 1: print(f"Failed to download {path} from peer {peer.id()}: {e}")
+      continue
+    if peer_hash == remote_hash:
+      await aios.rename(partial_path, target_dir/path)
+      return target_dir/path
+    print(f"{path} from peer {peer.id()} has hash {peer_hash} but remote hash is {remote_hash}")
+    await aios.remove(partial_path)
+  # a download that was started in segments is always resumed in segments
+  segmented = await aios.path.exists(segment_state_path(partial_path)) or (max_connections > 1 and length >= SEGMENTED_DOWNLOAD_MIN_BYTES)
+  if segmented:
+    try: final_hash = await _download_segments(url, partial_path, length, etag, max_connections, on_progress, hash_type)
+    except RangeNotSupported as e:
+      if DEBUG >= 1: print(f"{e}, downloading {path} over one connection")
+      for stale_path in (partial_path, segment_state_path(partial_path)):
+        if await aios.path.exists(stale_path): await aios.remove(stale_path)
+      segmented = False
+  if not segmented:
+    final_hash = await _download_stream(url, partial_path, length, on_progress, hash_type)
+
   integrity = final_hash == remote_hash
   if not integrity:
     try: await aios.remove(partial_path)
@@ -167,6 +237,151 @@ async def _download_file(repo_id: str, revision: str, path: str, target_dir: Pat
   return target_dir/path
 
 
+async def _download_stream(url: str, partial_path: Path, length: int, on_progress: Callable[[int, int], None], hash_type: Literal["sha1", "sha256"]) -> str:
+  """Download a file over one connection, resuming after what is in the .partial file. Returns its hash."""
+  resume_byte_pos = (await aios.stat(partial_path)).st_size if (await aios.path.exists(partial_path)) else None
+  hasher = StreamingHasher(partial_path, length, hash_type, available=resume_byte_pos or 0)
+  try:
+    if resume_byte_pos != length:
+      headers = await get_auth_headers()
+      if resume_byte_pos: headers['Range'] = f'bytes={resume_byte_pos}-'
+      n_read = resume_byte_pos or 0
+      async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1800, connect=60, sock_read=1800, sock_connect=60)) as session:
+        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=1800, connect=60, sock_read=1800, sock_connect=60)) as r:
+          if r.status == 404: raise FileNotFoundError(f"File not found: {url}")
+          assert r.status in [200, 206], f"Failed to download {partial_path.name[:-len('.partial')]} from {url}: {r.status}"
+          async with aiofiles.open(partial_path, 'ab' if resume_byte_pos else 'wb') as f:
+            while chunk := await r.content.read(8 * 1024 * 1024):
+              await f.write(chunk)
+              # the hasher reads written ranges back from disk, not through this buffer
+              await f.flush()
+              hasher.written(n_read, chunk, n_read + len(chunk))
+              on_progress(n_read := n_read + len(chunk), length)
+    return await hasher.hexdigest()
+  finally:
+    hasher.cancel()
+
+async def _download_from_peer(peer, repo_id: str, path: str, partial_path: Path, length: int, on_progress: Callable[[int, int], None], hash_type: Literal["sha1", "sha256"]) -> str:
+  """Copy a file from a peer that has all of it, resuming after what is in the .partial file. Returns its hash."""
+  resume_byte_pos = (await aios.stat(partial_path)).st_size if (await aios.path.exists(partial_path)) else 0
+  if resume_byte_pos > length: resume_byte_pos = 0
+  hasher = StreamingHasher(partial_path, length, hash_type, available=resume_byte_pos)
+  try:
+    n_read = resume_byte_pos
+    if n_read < length:
+      if DEBUG >= 2: print(f"Downloading {path} from peer {peer.id()} from byte {n_read}")
+      async with aiofiles.open(partial_path, 'ab' if n_read else 'wb') as f:
+        async for chunk in peer.read_repo_file(repo_id, path, n_read):
+          chunk = chunk[:length - n_read]
+          await f.write(chunk)
+          await f.flush()
+          hasher.written(n_read, chunk, n_read + len(chunk))
+          on_progress(n_read := n_read + len(chunk), length)
+          if n_read == length: break
+    if n_read < length: raise Exception(f"Peer {peer.id()} sent {n_read}/{length} bytes of {path}")
+    return await hasher.hexdigest()
+  finally:
+    hasher.cancel()
+
+class RangeNotSupported(Exception):
+  pass
+
+def segment_state_path(partial_path: Path) -> Path:
+  return partial_path.with_name(partial_path.name + ".json")
+
+def plan_segments(length: int, prefix: int, max_connections: int) -> List[List[int]]:
+  """[start, end, downloaded] byte ranges covering the file, with the first prefix bytes already there."""
+  segments = [[0, prefix, prefix]] if prefix else []
+  count = max(1, min(max_connections, (length - prefix)//MIN_SEGMENT_BYTES))
+  size = -(-(length - prefix)//count)
+  for start in range(prefix, length, size):
+    segments.append([start, min(start + size, length), 0])
+  return segments
+
+async def load_segment_state(partial_path: Path, length: int, etag: str) -> Optional[List[List[int]]]:
+  state_path = segment_state_path(partial_path)
+  if not await aios.path.exists(state_path) or not await aios.path.exists(partial_path): return None
+  try:
+    async with aiofiles.open(state_path, 'r') as f: state = json.loads(await f.read())
+  except (OSError, ValueError): return None
+  # the remote file changed since, start over
+  if state.get("length") != length or state.get("etag") != etag: return None
+  return state["segments"]
+
+async def save_segment_state(partial_path: Path, length: int, etag: str, segments: List[List[int]]):
+  state_path = segment_state_path(partial_path)
+  tmp_path = state_path.with_name(state_path.name + ".tmp")
+  async with aiofiles.open(tmp_path, 'w') as f: await f.write(json.dumps({"length": length, "etag": etag, "segments": segments}))
+  await aios.replace(tmp_path, state_path)
+
+def contiguous_end(segments: List[List[int]]) -> int:
+  """How far the file is complete from its start."""
+  end = 0
+  for start, segment_end, downloaded in sorted(segments):
+    if start > end: break
+    end = max(end, start + downloaded)
+    if downloaded < segment_end - start: break
+  return end
+
+async def _download_segments(url: str, partial_path: Path, length: int, etag: str, max_connections: int, on_progress: Callable[[int, int], None], hash_type: Literal["sha1", "sha256"]) -> str:
+  """
+  Download a file over up to max_connections HTTP Range requests into a file
+  preallocated at its full size. What each segment has received is saved next
+  to the .partial file, so a retry only fetches the ranges still missing.
+  Returns the file's hash.
+  """
+  segments = await load_segment_state(partial_path, length, etag)
+  if segments is None:
+    prefix = (await aios.stat(partial_path)).st_size if await aios.path.exists(partial_path) else 0
+    # a prefix left by a single stream download is kept
+    prefix = prefix if prefix < length else 0
+    async with aiofiles.open(partial_path, 'r+b' if prefix else 'wb') as f: await f.truncate(length)
+    segments = plan_segments(length, prefix, max_connections)
+    await save_segment_state(partial_path, length, etag, segments)
+
+  headers = await get_auth_headers()
+  n_read = sum(segment[2] for segment in segments)
+  saved_at = n_read
+  save_lock = asyncio.Lock()
+  hasher = StreamingHasher(partial_path, length, hash_type, available=contiguous_end(segments))
+  on_progress(n_read, length)
+
+  async def on_chunk(offset: int, chunk: bytes):
+    nonlocal n_read, saved_at
+    n_read += len(chunk)
+    hasher.written(offset, chunk, contiguous_end(segments))
+    on_progress(n_read, length)
+    if n_read - saved_at >= SEGMENT_STATE_SAVE_BYTES:
+      saved_at = n_read
+      async with save_lock: await save_segment_state(partial_path, length, etag, segments)
+
+  async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1800, connect=60, sock_read=1800, sock_connect=60)) as session:
+    tasks = [asyncio.create_task(_download_segment(session, url, headers, partial_path, length, segment, on_chunk)) for segment in segments if segment[2] < segment[1] - segment[0]]
+    try: await asyncio.gather(*tasks)
+    finally:
+      for task in tasks: task.cancel()
+      await asyncio.gather(*tasks, return_exceptions=True)
+      async with save_lock: await save_segment_state(partial_path, length, etag, segments)
+      if any(not task.done() or task.cancelled() or task.exception() for task in tasks): hasher.cancel()
+  await aios.remove(segment_state_path(partial_path))
+  return await hasher.hexdigest()
+
+async def _download_segment(session: aiohttp.ClientSession, url: str, headers: Dict[str, str], partial_path: Path, length: int, segment: List[int], on_chunk: Callable[[int, bytes], Awaitable[None]]):
+  start, end, downloaded = segment
+  async with session.get(url, headers={**headers, 'Range': f'bytes={start + downloaded}-{end - 1}'}) as r:
+    if r.status == 404: raise FileNotFoundError(f"File not found: {url}")
+    if r.status == 200 and (start + downloaded, end) != (0, length): raise RangeNotSupported(f"{url} does not support range requests")
+    assert r.status in [200, 206], f"Failed to download bytes {start + downloaded}-{end - 1} from {url}: {r.status}"
+    async with aiofiles.open(partial_path, 'r+b') as f:
+      await f.seek(start + downloaded)
+      while segment[2] < end - start and (chunk := await r.content.read(8 * 1024 * 1024)):
+        chunk = chunk[:end - start - segment[2]]
+        await f.write(chunk)
+        await f.flush()
+        segment[2] += len(chunk)
+        await on_chunk(start + segment[2] - len(chunk), chunk)
+  if segment[2] < end - start: raise Exception(f"Connection closed after {segment[2]}/{end - start} bytes of segment {start}-{end - 1} of {url}")
+
 def calculate_repo_progress(shard: Shard, repo_id: str, revision: str, file_progress: Dict[str, RepoFileProgressEvent], all_start_time: float) -> RepoProgressEvent:
   all_total_bytes = sum([p.total for p in file_progress.values()])
   all_downloaded_bytes = sum([p.downloaded for p in file_progress.values()])
@@ -195,10 +410,15 @@ async def resolve_allow_patterns(shard: Shard, inference_engine_classname: str)
 async def get_downloaded_size(path: Path) -> int:
   partial_path = path.with_suffix(path.suffix + ".partial")
   if await aios.path.exists(path): return (await aios.stat(path)).st_size
+  # segmented downloads preallocate the whole file
+  if await aios.path.exists(segment_state_path(partial_path)):
+    try:
+      async with aiofiles.open(segment_state_path(partial_path), 'r') as f: return sum(segment[2] for segment in json.loads(await f.read())["segments"])
+    except (OSError, ValueError, KeyError): return 0
   if await aios.path.exists(partial_path): return (await aios.stat(partial_path)).st_size
   return 0
 
-async def download_shard(shard: Shard, inference_engine_classname: str, on_progress: AsyncCallbackSystem[str, Tuple[Shard, RepoProgressEvent]], max_parallel_downloads: int = 8, skip_download: bool = False) -> tuple[Path, RepoProgressEvent]:
+async def download_shard(shard: Shard, inference_engine_classname: str, on_progress: AsyncCallbackSystem[str, Tuple[Shard, RepoProgressEvent]], max_parallel_downloads: int = 8, skip_download: bool = False, max_connections_per_file: int = 8, peers: Sequence = ()) -> tuple[Path, RepoProgressEvent]:
   if DEBUG >= 2 and not skip_download: print(f"Downloading {shard.model_id=} for {inference_engine_classname}")
   repo_id = get_repo(shard.model_id, inference_engine_classname)
   revision = "main"
@@ -227,11 +447,18 @@ async def download_shard(shard: Shard, inference_engine_classname: str, on_progr
     downloaded_bytes = await get_downloaded_size(target_dir/file["path"])
     file_progress[file["path"]] = RepoFileProgressEvent(repo_id, revision, file["path"], downloaded_bytes, 0, file["size"], 0, timedelta(0), "complete" if downloaded_bytes == file["size"] else "not_started", time.time())
 
+  missing = [file for file in filtered_file_list if file_progress[file["path"]].status != "complete"]
+  holders = await find_peer_files(peers, repo_id) if peers and missing and not skip_download else {}
+  def file_peers(i: int, file: dict) -> list:
+    # files are spread over the peers that have them so no one peer serves everything
+    candidates = [peer for peer, size in holders.get(file["path"], []) if size == file["size"]]
+    return candidates[i % len(candidates):] + candidates[:i % len(candidates)] if candidates else []
+
   semaphore = asyncio.Semaphore(max_parallel_downloads)
-  async def download_with_semaphore(file):
+  async def download_with_semaphore(i, file):
     async with semaphore:
-      await download_file_with_retry(repo_id, revision, file["path"], target_dir, lambda curr_bytes, total_bytes: on_progress_wrapper(file, curr_bytes, total_bytes))
-  if not skip_download: await asyncio.gather(*[download_with_semaphore(file) for file in filtered_file_list])
+      await download_file_with_retry(repo_id, revision, file["path"], target_dir, lambda curr_bytes, total_bytes: on_progress_wrapper(file, curr_bytes, total_bytes), max_connections_per_file, file_peers(i, file))
+  if not skip_download: await asyncio.gather(*[download_with_semaphore(i, file) for i, file in enumerate(filtered_file_list)])
   final_repo_progress = calculate_repo_progress(shard, repo_id, revision, file_progress, all_start_time)
   on_progress.trigger_all(shard, final_repo_progress)
   if gguf := next((f for f in filtered_file_list if f["path"].endswith(".gguf")), None):
@@ -239,8 +466,8 @@ async def download_shard(shard: Shard, inference_engine_classname: str, on_progr
   else:
     return target_dir, final_repo_progress
 
-def new_shard_downloader(max_parallel_downloads: int = 8) -> ShardDownloader:
-  return SingletonShardDownloader(CachedShardDownloader(NewShardDownloader(max_parallel_downloads)))
+def new_shard_downloader(max_parallel_downloads: int = 8, max_connections_per_file: int = 8) -> ShardDownloader:
+  return SingletonShardDownloader(CachedShardDownloader(NewShardDownloader(max_parallel_downloads, max_connections_per_file)))
 
 class SingletonShardDownloader(ShardDownloader):
   def __init__(self, shard_downloader: ShardDownloader):
@@ -251,6 +478,9 @@ class SingletonShardDownloader(ShardDownloader):
   def on_progress(self) -> AsyncCallbackSystem[str, Tuple[Shard, RepoProgressEvent]]:
     return self.shard_downloader.on_progress
 
+  def use_peers(self, get_peers: Callable[[], Sequence]) -> None:
+    self.shard_downloader.use_peers(get_peers)
+
   async def ensure_shard(self, shard: Shard, inference_engine_name: str) -> Path:
     if shard not in self.active_downloads: self.active_downloads[shard] = asyncio.create_task(self.shard_downloader.ensure_shard(shard, inference_engine_name))
     try: return await self.active_downloads[shard]
@@ -270,6 +500,9 @@ class CachedShardDownloader(ShardDownloader):
   def on_progress(self) -> AsyncCallbackSystem[str, Tuple[Shard, RepoProgressEvent]]:
     return self.shard_downloader.on_progress
 
+  def use_peers(self, get_peers: Callable[[], Sequence]) -> None:
+    self.shard_downloader.use_peers(get_peers)
+
   async def ensure_shard(self, shard: Shard, inference_engine_name: str) -> Path:
     if (inference_engine_name, shard) in self.cache:
       if DEBUG >= 2: print(f"ensure_shard cache hit {shard=} for {inference_engine_name}")
@@ -284,16 +517,21 @@ class CachedShardDownloader(ShardDownloader):
       yield path, status
 
 class NewShardDownloader(ShardDownloader):
-  def __init__(self, max_parallel_downloads: int = 8):
+  def __init__(self, max_parallel_downloads: int = 8, max_connections_per_file: int = 8):
     self.max_parallel_downloads = max_parallel_downloads
+    self.max_connections_per_file = max_connections_per_file
+    self.get_peers: Callable[[], Sequence] = lambda: []
     self._on_progress = AsyncCallbackSystem[str, Tuple[Shard, RepoProgressEvent]]()
 
   @property
   def on_progress(self) -> AsyncCallbackSystem[str, Tuple[Shard, RepoProgressEvent]]:
     return self._on_progress
 
+  def use_peers(self, get_peers: Callable[[], Sequence]) -> None:
+    self.get_peers = get_peers
+
   async def ensure_shard(self, shard: Shard, inference_engine_name: str) -> Path:
-    target_dir, _ = await download_shard(shard, inference_engine_name, self.on_progress, max_parallel_downloads=self.max_parallel_downloads)
+    target_dir, _ = await download_shard(shard, inference_engine_name, self.on_progress, max_parallel_downloads=self.max_parallel_downloads, max_connections_per_file=self.max_connections_per_file, peers=list(self.get_peers()))
     return target_dir
 
   async def get_shard_download_status(self, inference_engine_name: str) -> AsyncIterator[tuple[Path, RepoProgressEvent]]:
@@ -0,0 +1,82 @@
+"""
+Model files shared between nodes
+
+A file only lands in the downloads dir under its final name after its hash
+matched the hub's, so every complete file there can be served to peers as is.
+Nodes list the files they hold for a repo and stream them to peers, which
+fetch what they can over the LAN before going to the hub.
+"""
+import asyncio
+import os
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import aiofiles
+
+from exo.helpers import DEBUG
+
+CHUNK_BYTES = 4*1024*1024
+# suffixes of files that are still being written
+INCOMPLETE_SUFFIXES = (".partial", ".partial.json", ".partial.json.tmp")
+
+
+def repo_dir(downloads_dir: Path, repo_id: str) -> Path:
+  return downloads_dir/repo_id.replace("/", "--")
+
+
+def _list_files(root: Path) -> Dict[str, int]:
+  files = {}
+  for dirpath, _, filenames in os.walk(root):
+    for filename in filenames:
+      if filename.endswith(INCOMPLETE_SUFFIXES): continue
+      path = Path(dirpath)/filename
+      files[path.relative_to(root).as_posix()] = path.stat().st_size
+  return files
+
+
+def _safe_repo_dir(downloads_dir: Path, repo_id: str) -> Optional[Path]:
+  downloads_dir = downloads_dir.resolve()
+  root = repo_dir(downloads_dir, repo_id).resolve()
+  return root if root.parent == downloads_dir else None
+
+
+async def local_repo_files(downloads_dir: Path, repo_id: str) -> Dict[str, int]:
+  """Size by path of every complete file of repo_id in downloads_dir."""
+  root = _safe_repo_dir(downloads_dir, repo_id)
+  if root is None or not root.is_dir(): return {}
+  return await asyncio.to_thread(_list_files, root)
+
+
+def local_repo_file(downloads_dir: Path, repo_id: str, path: str) -> Optional[Path]:
+  """The complete file at path in repo_id, None if it is missing or outside the repo."""
+  root = _safe_repo_dir(downloads_dir, repo_id)
+  if root is None or path.endswith(INCOMPLETE_SUFFIXES): return None
+  file_path = (root/path).resolve()
+  if not file_path.is_relative_to(root) or not file_path.is_file(): return None
+  return file_path
+
+
+async def read_file_chunks(path: Path, offset: int = 0, chunk_bytes: int = CHUNK_BYTES) -> AsyncIterator[bytes]:
+  async with aiofiles.open(path, 'rb') as f:
+    await f.seek(offset)
+    while chunk := await f.read(chunk_bytes):
+      yield chunk
+
+
+async def find_peer_files(peers: Sequence, repo_id: str) -> Dict[str, List[Tuple[object, int]]]:
+  """
+  Which peers hold which files of repo_id, as {path: [(peer, size)]}. Peers
+  that cannot share files or do not answer are left out.
+  """
+  async def list_files(peer):
+    try: return peer, await asyncio.wait_for(peer.list_repo_files(repo_id), timeout=10.0)
+    except NotImplementedError: return peer, {}
+    except Exception as e:
+      if DEBUG >= 1: print(f"Could not list files of {repo_id} on {peer.id()}: {e}")
+      return peer, {}
+
+  holders: Dict[str, List[Tuple[object, int]]] = {}
+  for peer, files in await asyncio.gather(*[list_files(peer) for peer in peers]):
+    for path, size in files.items():
+      holders.setdefault(path, []).append((peer, size))
+  return holders
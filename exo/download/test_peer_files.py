@@ -0,0 +1,113 @@
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from exo.download import new_shard_download
+from exo.download.new_shard_download import download_file_with_retry
+from exo.download.peer_files import find_peer_files, local_repo_file, local_repo_files, read_file_chunks, repo_dir
+from exo.download.test_ranged_download import PATH, REPO, hub  # noqa: F401
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.orchestration.node import Node
+from exo.topology.device_capabilities import UNKNOWN_DEVICE_CAPABILITIES
+
+
+class DirectoryPeer:
+  """A peer serving the downloads dir it was given, optionally corrupting or cutting off what it sends."""
+  def __init__(self, peer_id: str, downloads_dir: Path, corrupt: bool = False, stop_after: int = None):
+    self._id = peer_id
+    self.downloads_dir = downloads_dir
+    self.corrupt = corrupt
+    self.stop_after = stop_after
+    self.sent = 0
+
+  def id(self) -> str:
+    return self._id
+
+  async def list_repo_files(self, repo_id: str):
+    return await local_repo_files(self.downloads_dir, repo_id)
+
+  async def read_repo_file(self, repo_id: str, path: str, offset: int = 0):
+    async for chunk in read_file_chunks(local_repo_file(self.downloads_dir, repo_id, path), offset, 64*1024):
+      if self.corrupt: chunk = bytes(len(chunk))
+      if self.stop_after is not None and self.sent + len(chunk) > self.stop_after: raise ConnectionError("peer went away")
+      self.sent += len(chunk)
+      yield chunk
+
+
+class LegacyPeer:
+  def id(self) -> str:
+    return "legacy"
+
+  async def list_repo_files(self, repo_id: str):
+    raise NotImplementedError
+
+
+def seed(downloads_dir: Path, files: dict) -> Path:
+  root = repo_dir(downloads_dir, REPO)
+  for path, data in files.items():
+    (root/path).parent.mkdir(parents=True, exist_ok=True)
+    (root/path).write_bytes(data)
+  return root
+
+
+@pytest.mark.asyncio
+async def test_only_complete_files_inside_the_repo_are_shared(tmp_path):
+  downloads_dir = tmp_path/"downloads"
+  seed(downloads_dir, {"config.json": b"{}", "weights/model.safetensors": b"x"*10, "model-2.safetensors.partial": b"x", "model-2.safetensors.partial.json": b"{}"})
+  (tmp_path/"secret").write_bytes(b"secret")
+
+  assert await local_repo_files(downloads_dir, REPO) == {"config.json": 2, "weights/model.safetensors": 10}
+  assert local_repo_file(downloads_dir, REPO, "weights/model.safetensors") is not None
+  assert local_repo_file(downloads_dir, REPO, "model-2.safetensors.partial") is None
+  assert local_repo_file(downloads_dir, REPO, "../../secret") is None
+  assert local_repo_file(downloads_dir, "..", "secret") is None
+  assert await local_repo_files(downloads_dir, "..") == {}
+
+  holders = await find_peer_files([DirectoryPeer("a", downloads_dir), LegacyPeer()], REPO)
+  assert [(peer.id(), size) for peer, size in holders["config.json"]] == [("a", 2)]
+
+
+@pytest.mark.asyncio
+async def test_files_come_from_peers_before_the_hub(hub, tmp_path):
+  peer = DirectoryPeer("a", tmp_path/"peer")
+  seed(peer.downloads_dir, {PATH: hub.data})
+  progress = []
+  path = await download_file_with_retry(REPO, "main", PATH, tmp_path/"local", lambda n, total: progress.append((n, total)), max_connections=4, peers=[peer])
+
+  assert path.read_bytes() == hub.data
+  assert hub.requests == []
+  assert progress[-1] == (len(hub.data), len(hub.data))
+
+
+@pytest.mark.asyncio
+async def test_bad_peers_fall_back_to_the_hub(hub, tmp_path, monkeypatch):
+  monkeypatch.setattr(new_shard_download, "SEGMENTED_DOWNLOAD_MIN_BYTES", 1 << 40)
+  corrupt = DirectoryPeer("corrupt", tmp_path/"peer", corrupt=True)
+  flaky = DirectoryPeer("flaky", tmp_path/"peer", stop_after=len(hub.data)//2)
+  seed(corrupt.downloads_dir, {PATH: hub.data})
+  path = await download_file_with_retry(REPO, "main", PATH, tmp_path/"local", peers=[corrupt, flaky])
+
+  assert path.read_bytes() == hub.data
+  # the corrupt copy was thrown away and the hub carried on where the flaky peer stopped
+  assert hub.requests == [f"bytes={flaky.sent}-"]
+  assert hub.served == len(hub.data) - flaky.sent
+
+
+@pytest.mark.asyncio
+async def test_files_are_served_over_grpc(tmp_path, monkeypatch):
+  monkeypatch.setenv("EXO_HOME", str(tmp_path))
+  data = bytes(range(256))*40000
+  seed(tmp_path/"downloads", {PATH: data, "config.json": b"{}"})
+  server = GRPCServer(mock.AsyncMock(spec=Node), "localhost", 50062)
+  await server.start()
+  peer = GRPCPeerHandle("server", "localhost:50062", "test", UNKNOWN_DEVICE_CAPABILITIES)
+  try:
+    assert await peer.list_repo_files(REPO) == {PATH: len(data), "config.json": 2}
+    assert b"".join([chunk async for chunk in peer.read_repo_file(REPO, PATH, 1000)]) == data[1000:]
+    with pytest.raises(FileNotFoundError):
+      async for _ in peer.read_repo_file(REPO, "../../secret"): pass
+  finally:
+    await peer.disconnect()
+    await server.stop()
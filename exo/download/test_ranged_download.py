@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import json
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from exo.download import new_shard_download
+from exo.download.new_shard_download import StreamingHasher, _download_file, _read_range, download_file_with_retry, get_downloaded_size, segment_state_path
+
+REPO = "test-org/test-model"
+PATH = "model-00001-of-00001.safetensors"
+# kept before tests patch out the retry backoff, which is the same asyncio.sleep
+real_sleep = asyncio.sleep
+
+
+class FakeHub:
+  """Serves one file the way the HF endpoint does, optionally dropping connections or ignoring ranges."""
+  def __init__(self, data: bytes, ranges: bool = True):
+    self.data = data
+    self.etag = hashlib.sha256(data).hexdigest()
+    self.ranges = ranges
+    self.requests = []
+    self.served = 0
+    # close the connection after this many bytes of the first ranged response
+    self.fail_after = None
+    # send bodies in writes of this many bytes instead of all at once
+    self.write_size = None
+
+  async def handle(self, request: web.Request) -> web.StreamResponse:
+    headers = {"ETag": f'"{self.etag}"', "Content-Length": str(len(self.data))}
+    if request.method == "HEAD": return web.Response(headers=headers)
+
+    start, end = 0, len(self.data) - 1
+    range_header = request.headers.get("Range")
+    self.requests.append(range_header)
+    if range_header and self.ranges:
+      first, last = range_header.removeprefix("bytes=").split("-")
+      start, end = int(first), int(last) if last else len(self.data) - 1
+    body = self.data[start:end + 1]
+    response = web.StreamResponse(status=206 if range_header and self.ranges else 200, headers={"Content-Length": str(len(body))})
+    await response.prepare(request)
+    if self.fail_after is not None and range_header:
+      self.fail_after, limit = None, self.fail_after
+      await response.write(body[:limit])
+      self.served += limit
+      # drop the connection once the client had time to read what was sent,
+      # aiohttp raises on a closed payload before handing out buffered data
+      await real_sleep(0.05)
+      request.transport.close()
+      return response
+    for i in range(0, len(body), self.write_size or len(body) or 1):
+      await response.write(body[i:i + (self.write_size or len(body))])
+      # let the client read each write on its own
+      if self.write_size: await real_sleep(0.001)
+    self.served += len(body)
+    return response
+
+
+@pytest_asyncio.fixture
+async def hub(monkeypatch, tmp_path):
+  data = bytes(range(256))*4096
+  fake = FakeHub(data)
+  app = web.Application()
+  app.router.add_route("*", f"/{REPO}/resolve/main/{{path:.*}}", fake.handle)
+  runner = web.AppRunner(app)
+  await runner.setup()
+  site = web.TCPSite(runner, "127.0.0.1", 0)
+  await site.start()
+  port = site._server.sockets[0].getsockname()[1]
+  monkeypatch.setenv("HF_ENDPOINT", f"http://127.0.0.1:{port}")
+  monkeypatch.setenv("HF_HOME", str(tmp_path/"hf"))
+  monkeypatch.setattr(new_shard_download, "SEGMENTED_DOWNLOAD_MIN_BYTES", 64*1024)
+  monkeypatch.setattr(new_shard_download, "MIN_SEGMENT_BYTES", 64*1024)
+  monkeypatch.setattr(new_shard_download, "SEGMENT_STATE_SAVE_BYTES", 16*1024)
+  yield fake
+  await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_large_file_is_downloaded_in_ranges(hub, tmp_path):
+  progress = []
+  path = await download_file_with_retry(REPO, "main", PATH, tmp_path, lambda n, total: progress.append((n, total)), max_connections=4)
+
+  assert path.read_bytes() == hub.data
+  assert len(hub.requests) == 4 and all(r.startswith("bytes=") for r in hub.requests)
+  assert progress[-1] == (len(hub.data), len(hub.data))
+  assert not segment_state_path(tmp_path/f"{PATH}.partial").exists()
+
+
+@pytest.mark.asyncio
+async def test_interrupted_segments_resume_where_they_stopped(hub, tmp_path, monkeypatch):
+  # fail the first attempt right away instead of waiting out the retry backoff
+  monkeypatch.setattr(new_shard_download.asyncio, "sleep", lambda _: _no_wait())
+  hub.fail_after = 100*1024
+  path = await download_file_with_retry(REPO, "main", PATH, tmp_path, max_connections=4)
+
+  assert path.read_bytes() == hub.data
+  assert len(hub.requests) > 4
+  # the retry picked up where each segment stopped instead of starting over
+  assert hub.served < 1.5*len(hub.data)
+
+
+@pytest.mark.asyncio
+async def test_saved_state_survives_a_restart(hub, tmp_path):
+  partial_path = tmp_path/f"{PATH}.partial"
+  quarter = len(hub.data)//4
+  with open(partial_path, "wb") as f:
+    f.truncate(len(hub.data))
+    f.seek(quarter)
+    f.write(hub.data[quarter:2*quarter])
+  etag = hashlib.sha256(hub.data).hexdigest()
+  segments = [[i*quarter, (i + 1)*quarter, quarter if i == 1 else 0] for i in range(4)]
+  segment_state_path(partial_path).write_text(json.dumps({"length": len(hub.data), "etag": etag, "segments": segments}))
+  assert await get_downloaded_size(tmp_path/PATH) == quarter
+
+  path = await download_file_with_retry(REPO, "main", PATH, tmp_path, max_connections=4)
+  assert path.read_bytes() == hub.data
+  assert hub.served == 3*quarter
+
+
+@pytest.mark.asyncio
+async def test_servers_without_ranges_fall_back_to_one_stream(hub, tmp_path):
+  hub.ranges = False
+  path = await download_file_with_retry(REPO, "main", PATH, tmp_path, max_connections=4)
+  assert path.read_bytes() == hub.data
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_connections", [1, 4])
+async def test_file_is_hashed_while_it_downloads(hub, tmp_path, monkeypatch, max_connections):
+  async def no_read_back(*args, **kwargs): raise AssertionError("the finished file was read again to hash it")
+  monkeypatch.setattr(new_shard_download, "calc_hash", no_read_back)
+  path = await _download_file(REPO, "main", PATH, tmp_path, max_connections=max_connections)
+  assert path.read_bytes() == hub.data
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_connections", [1, 4])
+async def test_corrupt_download_is_discarded(hub, tmp_path, max_connections):
+  hub.data = hub.data[:-1] + b"x"
+  with pytest.raises(Exception, match="remote hash"):
+    await _download_file(REPO, "main", PATH, tmp_path, max_connections=max_connections)
+  assert not (tmp_path/f"{PATH}.partial").exists()
+  assert not segment_state_path(tmp_path/f"{PATH}.partial").exists()
+  assert not (tmp_path/PATH).exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("max_connections", [1, 4])
+async def test_chunks_are_on_disk_when_they_are_reported(hub, tmp_path, monkeypatch, max_connections):
+  # chunks smaller than the file buffer are what a slow link delivers
+  hub.write_size = 4000
+  not_on_disk = []
+  written = StreamingHasher.written
+
+  def checked_written(self, offset, chunk, available):
+    # the hasher may read any reported range back from disk right away
+    if _read_range(self.path, offset, len(chunk)) != chunk: not_on_disk.append(offset)
+    written(self, offset, chunk, available)
+
+  monkeypatch.setattr(StreamingHasher, "written", checked_written)
+  path = await download_file_with_retry(REPO, "main", PATH, tmp_path, max_connections=max_connections)
+  assert path.read_bytes() == hub.data
+  assert not_on_disk == []
+
+
+@pytest.mark.asyncio
+async def test_resumed_prefix_is_hashed_from_disk(tmp_path):
+  data = bytes(range(256))*1024
+  path = tmp_path/"file"
+  path.write_bytes(data[:100_000] + bytes(len(data) - 100_000))
+  hasher = StreamingHasher(path, len(data), "sha256", available=100_000)
+  # later segments finish first, then the gap before them is filled
+  with open(path, "r+b") as f:
+    for start, end in [(200_000, len(data)), (100_000, 200_000)]:
+      f.seek(start)
+      f.write(data[start:end])
+      f.flush()
+      hasher.written(start, data[start:end], len(data) if start == 100_000 else 100_000)
+  assert await hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+
+  git_hasher = StreamingHasher(path, len(data), "sha1", available=len(data))
+  assert await git_hasher.hexdigest() == hashlib.sha1(f"blob {len(data)}\0".encode() + data).hexdigest()
+
+
+async def _no_wait():
+  pass
@@ -147,6 +147,65 @@ class AsyncCallbackSystem(Generic[K, T]):
       callback.set(*args)
 
 
+class TokenSubscription:
+  """
+  Results of one request, in order. With batch set, token lists that arrive
+  before the subscriber wakes up are merged so a slow reader gets them in one
+  go. Without it (image progress, images) every result is kept as it is.
+  """
+  def __init__(self, request_id: str, batch: bool = True) -> None:
+    self.request_id = request_id
+    self.batch = batch
+    self.pending: List[Tuple[object, bool]] = []
+    self.ready = asyncio.Event()
+
+  def put(self, result, is_finished: bool) -> None:
+    if self.batch and self.pending and isinstance(result, list) and isinstance(self.pending[-1][0], list) and not self.pending[-1][1]:
+      self.pending[-1] = (self.pending[-1][0] + result, is_finished)
+    else:
+      self.pending.append((result, is_finished))
+    self.ready.set()
+
+  async def get(self, timeout: Optional[float] = None) -> Tuple[object, bool]:
+    """Next (result, is_finished), raising asyncio.TimeoutError after timeout seconds."""
+    if not self.pending:
+      await asyncio.wait_for(self.ready.wait(), timeout)
+    result = self.pending.pop(0)
+    if not self.pending: self.ready.clear()
+    return result
+
+
+class TokenRouter:
+  """
+  Routes results to the subscriber of their request_id. Delivery is a dict
+  lookup and an append, with no task per token however many requests are
+  running. Observers see every result and must be cheap and synchronous.
+  """
+  def __init__(self) -> None:
+    self.subscriptions: Dict[str, TokenSubscription] = {}
+    self.observers: List[Callable[[str, object, bool], None]] = []
+
+  def subscribe(self, request_id: str, batch: bool = True) -> TokenSubscription:
+    if request_id not in self.subscriptions:
+      self.subscriptions[request_id] = TokenSubscription(request_id, batch)
+    return self.subscriptions[request_id]
+
+  def unsubscribe(self, request_id: str) -> None:
+    self.subscriptions.pop(request_id, None)
+
+  def observe(self, observer: Callable[[str, object, bool], None]) -> None:
+    self.observers.append(observer)
+
+  def publish(self, request_id: str, result, is_finished: bool) -> None:
+    for observer in self.observers:
+      observer(request_id, result, is_finished)
+    subscription = self.subscriptions.get(request_id)
+    if subscription is not None:
+      subscription.put(result, is_finished)
+    elif DEBUG >= 5:
+      print(f"[TokenRouter] no subscriber for {request_id=}")
+
+
 K = TypeVar('K', bound=str)
 V = TypeVar('V')
 
@@ -2,7 +2,7 @@ import numpy as np
 import os
 from exo.helpers import DEBUG  # Make sure to import DEBUG
 
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 from abc import ABC, abstractmethod
 from .shard import Shard
 from exo.download.shard_download import ShardDownloader
@@ -27,6 +27,29 @@ class InferenceEngine(ABC):
   async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[dict] = None) -> tuple[np.ndarray, Optional[dict]]:
     pass
 
+  async def infer_tensor_batch(self, shard: Shard, requests: List[Tuple[str, np.ndarray, Optional[dict]]]) -> List[Tuple[np.ndarray, Optional[dict]]]:
+    """
+    Run one inference step for several requests on the same shard. Each request is a
+    (request_id, input_data, inference_state) tuple and results come back in the same order.
+    A request that fails on its own may come back as its exception instead of a result, so
+    the rest of the batch is not failed with it.
+    Engines that can run a real batched forward override this; the default runs them one by one.
+    """
+    results = []
+    for request_id, input_data, inference_state in requests:
+      try:
+        results.append(await self.infer_tensor(request_id, shard, input_data, inference_state))
+      except Exception as e:
+        results.append(e)
+    return results
+
+  async def release_request(self, request_id: str) -> None:
+    """
+    Free what the engine keeps for a request once it has finished, like its KV cache.
+    Engines that keep nothing per request leave this as is.
+    """
+    pass
+
   @abstractmethod
   async def load_checkpoint(self, shard: Shard, path: str):
     pass
@@ -34,6 +57,10 @@ class InferenceEngine(ABC):
   async def save_checkpoint(self, shard: Shard, path: str):
     pass
 
+  def stats(self) -> dict:
+    """Memory and cache stats of the loaded shard, exported as metrics. Empty if the engine keeps none."""
+    return {}
+
   async def save_session(self, key, value):
     self.session[key] = value
 
@@ -0,0 +1,121 @@
+from collections import deque
+from typing import Deque, Dict, List
+from exo.helpers import DEBUG
+
+
+class KVBlockAllocator:
+  """
+  Block (paged) KV cache bookkeeping shared by inference engines.
+
+  The cache is split into num_blocks fixed size blocks of block_size tokens. Each request owns a
+  block table listing the blocks that hold its tokens in order, so token i of a request lives in
+  block_tables[request_id][i // block_size] at offset i % block_size. Blocks are handed out from a
+  free list as a request grows and returned once nothing references them. Full blocks can be shared
+  between requests (and a prefix cache) through reference counts. The allocator does not own any
+  tensors; engines map block ids onto their own storage.
+  """
+  def __init__(self, num_blocks: int, block_size: int = 16, block_bytes: int = 0):
+    if num_blocks < 1: raise ValueError(f"num_blocks must be at least 1, got {num_blocks}")
+    if block_size < 1: raise ValueError(f"block_size must be at least 1, got {block_size}")
+    self.num_blocks = num_blocks
+    self.block_size = block_size
+    self.block_bytes = block_bytes
+    self.free_blocks: Deque[int] = deque(range(num_blocks))
+    self.block_tables: Dict[str, List[int]] = {}
+    self.num_tokens: Dict[str, int] = {}
+    self.ref_counts: Dict[int, int] = {}
+
+  @classmethod
+  def from_budget(cls, budget_bytes: int, block_bytes: int, block_size: int = 16) -> "KVBlockAllocator":
+    return cls(max(1, budget_bytes//block_bytes), block_size=block_size, block_bytes=block_bytes)
+
+  def __contains__(self, request_id: str) -> bool:
+    return request_id in self.block_tables
+
+  def blocks_needed(self, num_tokens: int) -> int:
+    return -(-num_tokens//self.block_size)
+
+  def can_allocate(self, request_id: str, num_tokens: int) -> bool:
+    return self.blocks_needed(num_tokens) - len(self.block_tables.get(request_id, [])) <= len(self.free_blocks)
+
+  def allocate(self, request_id: str, num_tokens: int) -> List[int]:
+    """Grow the request's block table to hold num_tokens tokens and return it."""
+    table = self.block_tables.setdefault(request_id, [])
+    missing = self.blocks_needed(num_tokens) - len(table)
+    if missing > len(self.free_blocks):
+      if not table: del self.block_tables[request_id]
+      raise MemoryError(f"KV cache out of blocks: {request_id} needs {missing} more, {len(self.free_blocks)} free")
+    for _ in range(missing):
+      block = self.free_blocks.popleft()
+      self.ref_counts[block] = 1
+      table.append(block)
+    self.num_tokens[request_id] = max(num_tokens, self.num_tokens.get(request_id, 0))
+    if DEBUG >= 4 and missing > 0: print(f"[KVBlockAllocator] {request_id} +{missing} blocks ({len(table)} total, {len(self.free_blocks)} free)")
+    return table
+
+  def share(self, request_id: str, blocks: List[int], num_tokens: int) -> List[int]:
+    """Start a request's block table with blocks already holding its first num_tokens tokens."""
+    if request_id in self.block_tables: raise ValueError(f"{request_id} already has a block table")
+    self.retain(blocks)
+    self.block_tables[request_id] = list(blocks)
+    self.num_tokens[request_id] = num_tokens
+    return self.block_tables[request_id]
+
+  def retain(self, blocks: List[int]) -> None:
+    for block in blocks:
+      self.ref_counts[block] += 1
+
+  def release(self, blocks: List[int]) -> int:
+    """Drop one reference to each block, returning how many went back to the free list."""
+    freed = 0
+    for block in blocks:
+      self.ref_counts[block] -= 1
+      if self.ref_counts[block] == 0:
+        del self.ref_counts[block]
+        self.free_blocks.append(block)
+        freed += 1
+    return freed
+
+  def free(self, request_id: str) -> int:
+    table = self.block_tables.pop(request_id, [])
+    self.num_tokens.pop(request_id, None)
+    return self.release(table)
+
+  def block_table(self, request_id: str) -> List[int]:
+    return self.block_tables.get(request_id, [])
+
+  def reset(self) -> None:
+    self.free_blocks = deque(range(self.num_blocks))
+    self.block_tables.clear()
+    self.num_tokens.clear()
+    self.ref_counts.clear()
+
+  @property
+  def num_free_blocks(self) -> int:
+    return len(self.free_blocks)
+
+  @property
+  def num_used_blocks(self) -> int:
+    return self.num_blocks - len(self.free_blocks)
+
+  @property
+  def used_bytes(self) -> int:
+    return self.num_used_blocks*self.block_bytes
+
+  @property
+  def total_bytes(self) -> int:
+    return self.num_blocks*self.block_bytes
+
+  def stats(self) -> dict:
+    return {
+      "blocks": self.num_blocks,
+      "block_size": self.block_size,
+      "used_blocks": self.num_used_blocks,
+      "free_blocks": self.num_free_blocks,
+      "used_bytes": self.used_bytes,
+      "total_bytes": self.total_bytes,
+      "requests": len(self.block_tables),
+      "shared_blocks": sum(1 for count in self.ref_counts.values() if count > 1),
+      # tokens actually stored vs token capacity of the blocks handed out
+      "utilization": sum(self.num_tokens.values())/max(1, self.num_used_blocks*self.block_size),
+    }
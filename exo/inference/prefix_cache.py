@@ -0,0 +1,179 @@
+import heapq
+import itertools
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+from exo.inference.paged_kv_cache import KVBlockAllocator
+from exo.helpers import DEBUG
+
+
+class PrefixCacheNode:
+  def __init__(self, key: Tuple[int, ...], block: int, parent: Optional["PrefixCacheNode"], payload: Any = None):
+    self.key = key
+    self.block = block
+    self.parent = parent
+    self.payload = payload
+    # host or device memory of the payload, counted against the budget with the block
+    self.payload_bytes = getattr(payload, "nbytes", 0)
+    self.children: Dict[Tuple[int, ...], PrefixCacheNode] = {}
+    self.last_access = 0
+
+
+class PrefixCache:
+  """
+  Radix tree of KV cache blocks keyed by token prefix, one per loaded shard.
+
+  Each edge is one full block of block_size tokens, so a path from the root spells out a token
+  prefix and lists the blocks holding its keys and values. A new prompt looks up its longest cached
+  prefix, shares those blocks and only prefills the rest. The tree holds its own reference on every
+  block, so cached prefixes outlive the requests that computed them until the block budget forces the
+  least recently used leaves out. Nodes can carry an engine specific payload for their block (e.g. the
+  shard's output hidden states for those tokens). With max_bytes, the blocks' bytes and the payloads'
+  nbytes together are kept under it as well. Leaves are kept in a heap by last access, so each
+  eviction takes the least recently used one without walking the tree.
+  """
+  def __init__(self, allocator: KVBlockAllocator, max_blocks: int, max_bytes: Optional[int] = None):
+    self.allocator = allocator
+    self.block_size = allocator.block_size
+    self.max_blocks = max_blocks
+    self.max_bytes = max_bytes
+    self.root = PrefixCacheNode((), -1, None)
+    self.num_blocks = 0
+    self.payload_bytes = 0
+    self.clock = 0
+    # leaf heap entries go stale when a leaf is accessed again or gets a child,
+    # they are skipped on pop and dropped when the heap is rebuilt
+    self.leaves: Set[PrefixCacheNode] = set()
+    self.leaf_heap: List[Tuple[int, int, PrefixCacheNode]] = []
+    self.counter = itertools.count()
+
+    # stats
+    self.lookups = 0
+    self.hits = 0
+    self.lookup_tokens = 0
+    self.hit_tokens = 0
+    self.evictions = 0
+
+  def match(self, tokens: Sequence[int], max_tokens: Optional[int] = None) -> Tuple[List[int], List[Any]]:
+    """
+    Longest cached prefix of tokens in whole blocks, at most max_tokens long.
+    Returns the blocks and payloads along it.
+    """
+    max_tokens = len(tokens) if max_tokens is None else min(max_tokens, len(tokens))
+    self.clock += 1
+    blocks, payloads = [], []
+    node = self.root
+    for start in range(0, max_tokens - self.block_size + 1, self.block_size):
+      node = node.children.get(tuple(tokens[start:start + self.block_size]))
+      if node is None: break
+      node.last_access = self.clock
+      blocks.append(node.block)
+      payloads.append(node.payload)
+    if node in self.leaves: self._push_leaf(node)
+
+    self.lookups += 1
+    self.lookup_tokens += len(tokens)
+    if blocks:
+      self.hits += 1
+      self.hit_tokens += len(blocks)*self.block_size
+      if DEBUG >= 2: print(f"[PrefixCache] hit {len(blocks)*self.block_size}/{len(tokens)} tokens")
+    return blocks, payloads
+
+  def insert(self, tokens: Sequence[int], blocks: List[int], payloads: Optional[List[Any]] = None) -> None:
+    """Cache every full block of tokens, blocks[i] holding tokens[i*block_size:(i+1)*block_size]."""
+    self.clock += 1
+    node = self.root
+    for i in range(min(len(tokens)//self.block_size, len(blocks))):
+      key = tuple(tokens[i*self.block_size:(i + 1)*self.block_size])
+      child = node.children.get(key)
+      if child is None:
+        child = PrefixCacheNode(key, blocks[i], node, payloads[i] if payloads is not None else None)
+        node.children[key] = child
+        self.leaves.discard(node)
+        self.leaves.add(child)
+        self.allocator.retain([blocks[i]])
+        self.num_blocks += 1
+        self.payload_bytes += child.payload_bytes
+      child.last_access = self.clock
+      node = child
+    if node in self.leaves: self._push_leaf(node)
+
+    while self.over_budget() and self.evict(unshared_only=False):
+      pass
+
+  @property
+  def num_bytes(self) -> int:
+    return self.num_blocks*self.allocator.block_bytes + self.payload_bytes
+
+  def over_budget(self) -> bool:
+    return self.num_blocks > self.max_blocks or (self.max_bytes is not None and self.num_bytes > self.max_bytes)
+
+  def evict(self, unshared_only: bool = True) -> bool:
+    """
+    Drop the least recently used leaf. With unshared_only, only leaves whose block
+    no request is using are considered, so the drop always frees a block.
+    """
+    node, skipped = None, []
+    while self.leaf_heap:
+      entry = heapq.heappop(self.leaf_heap)
+      last_access, _, leaf = entry
+      if leaf not in self.leaves or leaf.last_access != last_access: continue
+      if unshared_only and self.allocator.ref_counts.get(leaf.block) != 1:
+        skipped.append(entry)
+        continue
+      node = leaf
+      break
+    for entry in skipped: heapq.heappush(self.leaf_heap, entry)
+    if node is None: return False
+
+    del node.parent.children[node.key]
+    self.leaves.discard(node)
+    if node.parent is not self.root and not node.parent.children:
+      self.leaves.add(node.parent)
+      self._push_leaf(node.parent)
+    self.allocator.release([node.block])
+    self.num_blocks -= 1
+    self.payload_bytes -= node.payload_bytes
+    self.evictions += 1
+    return True
+
+  def clear(self) -> None:
+    for node in self._nodes():
+      self.allocator.release([node.block])
+    self.root.children.clear()
+    self.leaves.clear()
+    self.leaf_heap.clear()
+    self.num_blocks = 0
+    self.payload_bytes = 0
+
+  def _push_leaf(self, node: PrefixCacheNode) -> None:
+    heapq.heappush(self.leaf_heap, (node.last_access, next(self.counter), node))
+    if len(self.leaf_heap) > 2*len(self.leaves) + 64:
+      self.leaf_heap = [(leaf.last_access, next(self.counter), leaf) for leaf in self.leaves]
+      heapq.heapify(self.leaf_heap)
+
+  def _nodes(self) -> List[PrefixCacheNode]:
+    nodes, stack = [], list(self.root.children.values())
+    while stack:
+      node = stack.pop()
+      nodes.append(node)
+      stack.extend(node.children.values())
+    return nodes
+
+  @property
+  def hit_rate(self) -> float:
+    return self.hits/self.lookups if self.lookups else 0.0
+
+  @property
+  def token_hit_rate(self) -> float:
+    return self.hit_tokens/self.lookup_tokens if self.lookup_tokens else 0.0
+
+  def stats(self) -> dict:
+    return {
+      "prefix_blocks": self.num_blocks,
+      "prefix_max_blocks": self.max_blocks,
+      "prefix_bytes": self.num_bytes,
+      "prefix_lookups": self.lookups,
+      "prefix_hits": self.hits,
+      "prefix_hit_rate": self.hit_rate,
+      "prefix_token_hit_rate": self.token_hit_rate,
+      "prefix_evictions": self.evictions,
+    }
@@ -0,0 +1,52 @@
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import PreTrainedTokenizerFast
+
+from exo.inference.tokenizers import DummyTokenizer, IncrementalDetokenizer
+
+
+def byte_level_tokenizer():
+  tokenizer = Tokenizer(models.BPE())
+  tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+  tokenizer.decoder = decoders.ByteLevel()
+  trainer = trainers.BpeTrainer(vocab_size=300, initial_alphabet=pre_tokenizers.ByteLevel.alphabet())
+  tokenizer.train_from_iterator(["hello world, how are you today"]*10, trainer)
+  return PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+
+def test_deltas_add_up_to_full_decode():
+  tokenizer = byte_level_tokenizer()
+  text = "hello world 🚀 héllo, 你好 how are you"
+  tokens = tokenizer.encode(text)
+
+  detokenizer = IncrementalDetokenizer(tokenizer)
+  deltas = [detokenizer.add([token]) for token in tokens] + [detokenizer.flush()]
+
+  assert "".join(deltas) == detokenizer.text == tokenizer.decode(tokens) == text
+  # multi-byte characters span several tokens but are never emitted half done
+  assert any("�" in tokenizer.decode([token]) for token in tokens)
+  assert not any("�" in delta for delta in deltas)
+
+
+def test_chunks_of_tokens():
+  tokenizer = byte_level_tokenizer()
+  tokens = tokenizer.encode("how are you today 🚀🚀")
+  detokenizer = IncrementalDetokenizer(tokenizer)
+  for i in range(0, len(tokens), 3):
+    detokenizer.add(tokens[i:i + 3])
+  detokenizer.flush()
+  assert detokenizer.text == tokenizer.decode(tokens)
+
+
+def test_incomplete_character_is_held_back_until_flush():
+  tokenizer = byte_level_tokenizer()
+  tokens = tokenizer.encode("🚀")
+  detokenizer = IncrementalDetokenizer(tokenizer)
+
+  assert detokenizer.add(tokens[:-1]) == ""
+  assert detokenizer.flush() == tokenizer.decode(tokens[:-1])
+
+
+def test_dummy_tokenizer():
+  detokenizer = IncrementalDetokenizer(DummyTokenizer())
+  assert detokenizer.add([1]) == "dummy"
+  assert detokenizer.add([2, 3]) == "dummydummy"
@@ -0,0 +1,40 @@
+import pytest
+from exo.inference.paged_kv_cache import KVBlockAllocator
+
+
+def test_allocate_grows_block_table():
+  allocator = KVBlockAllocator(num_blocks=8, block_size=4, block_bytes=100)
+  assert allocator.allocate("a", 3) == [0]
+  assert allocator.allocate("a", 4) == [0]
+  assert allocator.allocate("a", 9) == [0, 1, 2]
+  assert allocator.num_used_blocks == 3
+  assert allocator.used_bytes == 300
+
+
+def test_free_returns_blocks_for_reuse():
+  allocator = KVBlockAllocator(num_blocks=4, block_size=4)
+  allocator.allocate("a", 8)
+  allocator.allocate("b", 8)
+  assert not allocator.can_allocate("c", 1)
+
+  assert allocator.free("a") == 2
+  assert allocator.allocate("c", 5) == [0, 1]
+  assert "a" not in allocator
+
+
+def test_out_of_blocks():
+  allocator = KVBlockAllocator(num_blocks=2, block_size=4)
+  with pytest.raises(MemoryError):
+    allocator.allocate("a", 9)
+  assert "a" not in allocator
+  assert allocator.num_free_blocks == 2
+
+
+def test_from_budget_and_stats():
+  allocator = KVBlockAllocator.from_budget(budget_bytes=1000, block_bytes=300, block_size=4)
+  assert allocator.num_blocks == 3
+  allocator.allocate("a", 6)
+  stats = allocator.stats()
+  assert stats["used_blocks"] == 2
+  assert stats["requests"] == 1
+  assert stats["utilization"] == 6/8
@@ -0,0 +1,101 @@
+import numpy as np
+
+from exo.inference.paged_kv_cache import KVBlockAllocator
+from exo.inference.prefix_cache import PrefixCache
+
+
+def cache_prompt(allocator: KVBlockAllocator, prefix_cache: PrefixCache, request_id: str, tokens):
+  blocks = allocator.allocate(request_id, len(tokens))
+  prefix_cache.insert(tokens, blocks, [f"{request_id}:{i}" for i in range(len(blocks))])
+  return blocks
+
+
+def test_match_longest_block_aligned_prefix():
+  allocator = KVBlockAllocator(num_blocks=16, block_size=2)
+  prefix_cache = PrefixCache(allocator, max_blocks=16)
+  blocks = cache_prompt(allocator, prefix_cache, "a", [1, 2, 3, 4, 5])
+
+  assert prefix_cache.match([1, 2, 3, 4, 9, 9]) == (blocks[:2], ["a:0", "a:1"])
+  assert prefix_cache.match([1, 2, 3, 9]) == (blocks[:1], ["a:0"])
+  assert prefix_cache.match([1, 2, 3, 4], max_tokens=3) == (blocks[:1], ["a:0"])
+  assert prefix_cache.match([7, 7]) == ([], [])
+  assert prefix_cache.hit_rate == 3/4
+
+
+def test_cached_blocks_outlive_request():
+  allocator = KVBlockAllocator(num_blocks=4, block_size=2)
+  prefix_cache = PrefixCache(allocator, max_blocks=4)
+  blocks = cache_prompt(allocator, prefix_cache, "a", [1, 2, 3, 4])
+  allocator.free("a")
+
+  assert allocator.num_used_blocks == 2
+  allocator.share("b", prefix_cache.match([1, 2, 3, 4, 5])[0], 4)
+  assert allocator.block_table("b") == blocks
+  assert allocator.stats()["shared_blocks"] == 2
+
+
+def test_budget_evicts_least_recently_used_leaves():
+  allocator = KVBlockAllocator(num_blocks=8, block_size=2)
+  prefix_cache = PrefixCache(allocator, max_blocks=3)
+  cache_prompt(allocator, prefix_cache, "a", [1, 2, 3, 4])
+  cache_prompt(allocator, prefix_cache, "b", [5, 6, 7, 8])
+
+  assert prefix_cache.num_blocks == 3
+  assert prefix_cache.match([1, 2, 3, 4])[1] == ["a:0"]
+  assert prefix_cache.match([5, 6, 7, 8])[1] == ["b:0", "b:1"]
+
+
+def test_evict_only_frees_unshared_blocks():
+  allocator = KVBlockAllocator(num_blocks=4, block_size=2)
+  prefix_cache = PrefixCache(allocator, max_blocks=4)
+  cache_prompt(allocator, prefix_cache, "a", [1, 2])
+  assert not prefix_cache.evict()
+
+  allocator.free("a")
+  assert prefix_cache.evict()
+  assert allocator.num_free_blocks == 4
+
+
+def test_payload_bytes_count_against_the_budget():
+  allocator = KVBlockAllocator(num_blocks=16, block_size=2, block_bytes=100)
+  prefix_cache = PrefixCache(allocator, max_blocks=16, max_bytes=1000)
+  hidden = lambda: np.zeros((2, 25), dtype=np.float32)
+  for request_id, tokens in [("a", [1, 2, 3, 4]), ("b", [5, 6, 7, 8])]:
+    blocks = allocator.allocate(request_id, len(tokens))
+    prefix_cache.insert(tokens, blocks, [hidden() for _ in blocks])
+    allocator.free(request_id)
+
+  # four blocks of 100 bytes and four 200 byte payloads only fit three at a time
+  assert prefix_cache.num_blocks == 3
+  assert prefix_cache.num_bytes == 3*(100 + 200)
+  assert prefix_cache.stats()["prefix_bytes"] == 900
+  # the least recently used leaf went
+  assert len(prefix_cache.match([1, 2, 3, 4])[0]) == 1
+
+  prefix_cache.evict()
+  assert prefix_cache.num_bytes == 2*(100 + 200)
+  prefix_cache.clear()
+  assert prefix_cache.num_bytes == 0
+
+
+def test_evictions_follow_last_access_without_walking_the_tree(monkeypatch):
+  rng = np.random.default_rng(0)
+  allocator = KVBlockAllocator(num_blocks=256, block_size=2)
+  prefix_cache = PrefixCache(allocator, max_blocks=256)
+  for i in range(40):
+    tokens = rng.integers(0, 3, size=8).tolist()
+    if i % 3: prefix_cache.match(tokens)
+    else: cache_prompt(allocator, prefix_cache, f"r{i}", tokens)
+    allocator.free(f"r{i}")
+
+  nodes = prefix_cache._nodes
+  while prefix_cache.num_blocks:
+    before = set(nodes())
+    oldest = min(node.last_access for node in before if not node.children)
+    # evict must not walk the tree
+    monkeypatch.setattr(prefix_cache, "_nodes", None)
+    assert prefix_cache.evict()
+    monkeypatch.undo()
+    (evicted,) = before - set(nodes())
+    assert evicted.last_access == oldest
+  assert allocator.num_free_blocks == 256
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+
+from exo.inference.tokenizers import DummyTokenizer, TokenizerService
+
+
+@pytest.mark.asyncio
+async def test_tokenizers_are_loaded_once_per_repo():
+  service = TokenizerService()
+  tokenizers = await asyncio.gather(*[service.resolve("dummy") for _ in range(4)])
+
+  assert all(tokenizer is tokenizers[0] for tokenizer in tokenizers)
+  assert isinstance(tokenizers[0], DummyTokenizer)
+  assert service.stats() == {"tokenizers": 1, "hits": 3, "misses": 1}
+
+
+@pytest.mark.asyncio
+async def test_encode_prompt_runs_off_the_event_loop():
+  service = TokenizerService()
+  threads = []
+
+  def build_prompt(tokenizer):
+    threads.append(threading.current_thread().name)
+    return tokenizer.apply_chat_template([{"role": "user", "content": "hi"}], tokenize=False)
+
+  tokenizer, prompt, tokens = await service.encode_prompt("dummy", build_prompt)
+
+  assert threads[0].startswith("exo-tokenizer")
+  assert prompt == "dummy_tokenized_prompt"
+  assert tokens == [1] and isinstance(tokens[0], int)
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_tokenizer_is_dropped():
+  service = TokenizerService(max_tokenizers=1)
+  await service.resolve("dummy")
+  service.tokenizers["other"] = service.tokenizers.pop("dummy")
+  await service.resolve("dummy")
+
+  assert list(service.tokenizers) == ["dummy"]
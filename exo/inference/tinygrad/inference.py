@@ -7,6 +7,7 @@ from exo.inference.tokenizers import resolve_tokenizer
 from tinygrad.nn.state import safe_save, safe_load, get_state_dict, load_state_dict
 from tinygrad import Tensor, nn, Context, TinyJit
 from exo.inference.inference_engine import InferenceEngine
+from exo.inference.paged_kv_cache import KVBlockAllocator
 import numpy as np
 from exo.inference.tinygrad.tinygrad_helpers import concat_weights, load
 from exo.download.shard_download import ShardDownloader
@@ -23,6 +24,7 @@ TOP_K = 25
 TOP_P = 0.9
 ALPHA_F = 0.1
 ALPHA_P = 0.0
+KV_BLOCK_SIZE = 16
 MODEL_PARAMS = {
   "1B": {
     "args": {
@@ -67,18 +69,36 @@ class TinygradDynamicShardInferenceEngine(InferenceEngine):
     self.shard = None
     self.shard_downloader = shard_downloader
     self.states = OrderedDict()
+    self.kv_allocator = None
+    self.kv_cache_budget = int(os.getenv("TINYGRAD_KV_CACHE_MB", "0"))*1024*1024
     self.executor = _executor
 
+  def create_kv_allocator(self, x: Tensor, max_states: int) -> KVBlockAllocator:
+    attention = self.model.layers[0].attention
+    block_bytes = 2*len(self.model.layers)*attention.n_kv_heads*attention.head_dim*KV_BLOCK_SIZE*x.dtype.itemsize
+    if self.kv_cache_budget > 0: return KVBlockAllocator.from_budget(self.kv_cache_budget, block_bytes, block_size=KV_BLOCK_SIZE)
+    return KVBlockAllocator(max_states*-(-self.model.max_context//KV_BLOCK_SIZE), block_size=KV_BLOCK_SIZE, block_bytes=block_bytes)
+
   def poll_state(self, x, request_id: str, max_states=2):
     if request_id not in self.states:
-      if len(self.states) >= max_states:
-        self.states.popitem(last=False)
+      if self.kv_allocator is None: self.kv_allocator = self.create_kv_allocator(x, max_states)
+      # the jitted decode step needs fixed shape caches, so each state takes blocks for the full max_context
+      while self.states and not self.kv_allocator.can_allocate(request_id, self.model.max_context):
+        evicted_id, _ = self.states.popitem(last=False)
+        self.kv_allocator.free(evicted_id)
+      self.kv_allocator.allocate(request_id, self.model.max_context)
       self.states[request_id] = make_prompt_state(x, self.model)
     else:
       self.states.move_to_end(request_id)
     state = self.states[request_id]
     return {"start_pos": state.start, "cache": state.cache}
 
+  async def release_request(self, request_id: str) -> None:
+    def release():
+      self.states.pop(request_id, None)
+      if self.kv_allocator is not None: self.kv_allocator.free(request_id)
+    await asyncio.get_running_loop().run_in_executor(self.executor, release)
+
   async def sample(self, x: np.ndarray, temp=TEMPERATURE, top_p: float = 0.0) -> np.ndarray:
     def sample_wrapper():
       logits = x[:, -1, :]
@@ -95,6 +115,9 @@ class TinygradDynamicShardInferenceEngine(InferenceEngine):
     tokens = await asyncio.get_running_loop().run_in_executor(self.executor, self.tokenizer.decode, tokens)
     return tokens
   
+  def stats(self) -> dict:
+    return self.kv_allocator.stats() if self.kv_allocator is not None else {}
+
   async def load_checkpoint(self, shard: Shard, path: str):
     await self.ensure_shard(shard)
     state_dict = safe_load(path)
@@ -155,3 +178,5 @@ class TinygradDynamicShardInferenceEngine(InferenceEngine):
       self.tokenizer = await resolve_tokenizer(tokenizer_path)
       self.shard = shard
       self.model = model_shard
+      self.states.clear()
+      self.kv_allocator = None
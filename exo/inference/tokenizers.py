@@ -1,7 +1,10 @@
+import asyncio
 import traceback
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
 from os import PathLike
 from aiofiles import os as aios
-from typing import Union
+from typing import Any, Callable, List, Optional, Tuple, Union
 from transformers import AutoTokenizer, AutoProcessor
 import numpy as np
 from exo.helpers import DEBUG
@@ -23,7 +26,48 @@ class DummyTokenizer:
     return "dummy" * len(tokens)
 
 
-async def resolve_tokenizer(repo_id: Union[str, PathLike]):
+class IncrementalDetokenizer:
+  """
+  Turns a stream of generated tokens into text deltas for one request.
+
+  Decoding a token on its own loses the leading space sentencepiece merges into it
+  and splits multi-byte characters spread over several tokens. Instead the tokens
+  since prefix_offset are decoded with and without the new ones and only the
+  difference is emitted, holding text back while it ends in an incomplete character.
+  Each step decodes a window of a few tokens, not the whole output.
+  """
+  def __init__(self, tokenizer):
+    self.tokenizer = tokenizer
+    self.tokens: List[int] = []
+    self.text = ""
+    self.prefix_offset = 0
+    self.read_offset = 0
+
+  def add(self, tokens: List[int]) -> str:
+    """Add generated tokens, returning the text they complete."""
+    self.tokens.extend(int(token) for token in tokens)
+    prefix_text = self.tokenizer.decode(self.tokens[self.prefix_offset:self.read_offset])
+    new_text = self.tokenizer.decode(self.tokens[self.prefix_offset:])
+    if len(new_text) <= len(prefix_text) or new_text.endswith("\ufffd"):
+      return ""
+
+    delta = new_text[len(prefix_text):]
+    self.prefix_offset = self.read_offset
+    self.read_offset = len(self.tokens)
+    self.text += delta
+    return delta
+
+  def flush(self) -> str:
+    """Text still held back at the end of generation."""
+    prefix_text = self.tokenizer.decode(self.tokens[self.prefix_offset:self.read_offset])
+    new_text = self.tokenizer.decode(self.tokens[self.prefix_offset:])
+    delta = new_text[len(prefix_text):]
+    self.prefix_offset = self.read_offset = len(self.tokens)
+    self.text += delta
+    return delta
+
+
+async def resolve_tokenizer(repo_id: Union[str, PathLike], executor: Optional[Executor] = None):
   if repo_id == "dummy":
     return DummyTokenizer()
   local_path = await ensure_downloads_dir()/str(repo_id).replace("/", "--")
@@ -31,14 +75,19 @@ async def resolve_tokenizer(repo_id: Union[str, PathLike]):
   try:
     if local_path and await aios.path.exists(local_path):
       if DEBUG >= 2: print(f"Resolving tokenizer for {repo_id=} from {local_path=}")
-      return await _resolve_tokenizer(local_path)
+      return await _resolve_tokenizer(local_path, executor)
   except:
     if DEBUG >= 5: print(f"Local check for {local_path=} failed. Resolving tokenizer for {repo_id=} normally...")
     if DEBUG >= 5: traceback.print_exc()
-  return await _resolve_tokenizer(repo_id)
+  return await _resolve_tokenizer(repo_id, executor)
+
+
+async def _resolve_tokenizer(repo_id_or_local_path: Union[str, PathLike], executor: Optional[Executor] = None):
+  # loading reads and parses files from disk, keep it off the event loop
+  return await asyncio.get_running_loop().run_in_executor(executor, _load_tokenizer, repo_id_or_local_path)
 
 
-async def _resolve_tokenizer(repo_id_or_local_path: Union[str, PathLike]):
+def _load_tokenizer(repo_id_or_local_path: Union[str, PathLike]):
   try:
     if DEBUG >= 4: print(f"Trying AutoProcessor for {repo_id_or_local_path}")
     processor = AutoProcessor.from_pretrained(repo_id_or_local_path, use_fast=True if "Mistral-Large" in f"{repo_id_or_local_path}" else False, trust_remote_code=True)
@@ -61,3 +110,65 @@ async def _resolve_tokenizer(repo_id_or_local_path: Union[str, PathLike]):
     if DEBUG >= 4: print(traceback.format_exc())
 
   raise ValueError(f"[TODO] Unsupported model: {repo_id_or_local_path}")
+
+
+class TokenizerService:
+  """
+  Loaded tokenizers per repo with prompt rendering and encoding on a worker pool.
+
+  Loading a tokenizer reads it from disk, and chat templates and encoding of long
+  prompts take long enough to stall every other stream when run on the event loop.
+  Tokenizers are loaded once and kept in an LRU of max_tokenizers, concurrent
+  requests for a repo that is still loading wait on the same load.
+  """
+  def __init__(self, max_workers: int = 4, max_tokenizers: int = 8):
+    self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="exo-tokenizer")
+    self.max_tokenizers = max_tokenizers
+    self.tokenizers: OrderedDict[str, asyncio.Future] = OrderedDict()
+
+    # stats
+    self.hits = 0
+    self.misses = 0
+
+  async def resolve(self, repo_id: Union[str, PathLike]):
+    key = str(repo_id)
+    if key in self.tokenizers:
+      self.hits += 1
+      self.tokenizers.move_to_end(key)
+    else:
+      self.misses += 1
+      self.tokenizers[key] = asyncio.ensure_future(resolve_tokenizer(repo_id, self.executor))
+      while len(self.tokenizers) > self.max_tokenizers:
+        self.tokenizers.popitem(last=False)
+
+    future = self.tokenizers[key]
+    try:
+      return await asyncio.shield(future)
+    except Exception:
+      # don't cache failures, the next request tries again
+      if self.tokenizers.get(key) is future: self.tokenizers.pop(key)
+      raise
+
+  async def run(self, fn: Callable, *args) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+  async def encode_prompt(self, repo_id: Union[str, PathLike], build_prompt: Callable[[Any], str]) -> Tuple[Any, str, List[int]]:
+    """
+    Render a prompt with build_prompt(tokenizer) and encode it in one trip to the worker pool.
+    Returns the tokenizer, prompt and prompt tokens so callers never encode it again.
+    """
+    tokenizer = await self.resolve(repo_id)
+
+    def render_and_encode():
+      prompt = build_prompt(tokenizer)
+      return prompt, [int(token) for token in tokenizer.encode(prompt)]
+
+    prompt, tokens = await self.run(render_and_encode)
+    return tokenizer, prompt, tokens
+
+  def stats(self) -> dict:
+    return {
+      "tokenizers": len(self.tokenizers),
+      "hits": self.hits,
+      "misses": self.misses,
+    }
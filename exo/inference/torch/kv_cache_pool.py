@@ -0,0 +1,115 @@
+"""
+KVCachePool
+Maps requests to paged KV cache blocks of the sharded model with LRU eviction
+"""
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+
+import torch
+
+from exo.helpers import DEBUG
+from exo.inference.paged_kv_cache import KVBlockAllocator
+from exo.inference.prefix_cache import PrefixCache
+from exo.inference.torch.models.llm_utils import ShardInferenceState
+
+def kv_cache_block_bytes(n_layers: int, num_kv_heads: int, head_dim: int, block_size: int, dtype: torch.dtype) -> int:
+  """
+  Bytes used by one block of keys and values across n_layers
+  """
+  itemsize = torch.tensor([], dtype=dtype).element_size()
+  return 2*n_layers*num_kv_heads*head_dim*block_size*itemsize
+
+class KVCachePool:
+  """
+  Generation state and KV cache blocks per request_id
+
+  Blocks come from a shared KVBlockAllocator and are added as a request
+  grows. When blocks run out, cached prefixes no request is using are
+  dropped first, then the least recently used request that is not pinned
+  (part of the batch being run) is evicted.
+  """
+  def __init__(
+    self,
+    allocator: KVBlockAllocator,
+    max_requests: Optional[int] = None,
+    device: torch.device = torch.device("cpu"),
+    prefix_cache: Optional[PrefixCache] = None
+  ):
+    self.allocator = allocator
+    self.prefix_cache = prefix_cache
+    self.max_requests = max(1, max_requests if max_requests is not None else allocator.num_blocks)
+    self.device = device
+    self.entries: OrderedDict[str, ShardInferenceState] = OrderedDict()
+
+    # stats
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __contains__(self, request_id: str) -> bool:
+    return request_id in self.entries
+
+  def __len__(self) -> int:
+    return len(self.entries)
+
+  def poll_state(self, request_id: str, pinned: Optional[Set[str]] = None) -> Tuple[ShardInferenceState, bool]:
+    """
+    Get the state of a request, creating it if new
+
+    Returns:
+      Tuple[ShardInferenceState, bool]: state and whether the request was already cached
+    """
+    if request_id in self.entries:
+      self.hits += 1
+      self.entries.move_to_end(request_id)
+      return self.entries[request_id], True
+
+    self.misses += 1
+    if len(self.entries) >= self.max_requests:
+      self.evict(pinned or set())
+
+    self.entries[request_id] = ShardInferenceState(device=self.device)
+    return self.entries[request_id], False
+
+  def reserve(self, request_id: str, num_tokens: int, pinned: Optional[Set[str]] = None) -> List[int]:
+    """
+    Make sure the request has blocks for num_tokens tokens, evicting
+    other requests if needed, and return its block table
+    """
+    pinned = (pinned or set()) | {request_id}
+    while not self.allocator.can_allocate(request_id, num_tokens):
+      if self.prefix_cache is not None and self.prefix_cache.evict():
+        continue
+      self.evict(pinned)
+
+    return self.allocator.allocate(request_id, num_tokens)
+
+  def evict(self, pinned: Set[str]):
+    evict_id = next((request_id for request_id in self.entries if request_id not in pinned), None)
+    if evict_id is None:
+      raise RuntimeError(f"KV cache too small for the current batch ({self.allocator.num_blocks} blocks)")
+
+    if DEBUG >= 2:
+      print(f"[KVCachePool] evicting {evict_id} ({self.evictions + 1} evictions)")
+
+    self.release(evict_id)
+    self.evictions += 1
+
+  def release(self, request_id: str):
+    self.entries.pop(request_id, None)
+    self.allocator.free(request_id)
+
+  def clear(self):
+    self.entries.clear()
+    if self.prefix_cache is not None:
+      self.prefix_cache.clear()
+    self.allocator.reset()
+
+  def stats(self) -> dict:
+    return {
+      **self.allocator.stats(),
+      **(self.prefix_cache.stats() if self.prefix_cache is not None else {}),
+      "hits": self.hits,
+      "misses": self.misses,
+      "evictions": self.evictions,
+    }
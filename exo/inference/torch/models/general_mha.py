@@ -250,3 +250,57 @@ class ShardedGeneralModel(nn.Module):
       print(f"model_hs\n{model_hs}\nmodel_logits\n{model_logits}")
 
     return model_hs, model_logits
+
+  def generate_batch(
+    self,
+    mask: torch.Tensor,
+    input_pos: torch.Tensor,
+    block_tables: torch.Tensor,
+    cache_pos: torch.Tensor,
+    seq_lens: torch.Tensor,
+    tokens: Optional[torch.Tensor] = None,
+    hidden_state: Optional[torch.Tensor] = None,
+  ) -> Tuple[
+    Optional[torch.Tensor],
+    Optional[torch.Tensor],
+  ]:
+    """
+    Generate logits and/or hidden_states for a right padded batch of requests
+    in one forward, each row reading and writing its own KV cache blocks
+
+    Args
+      mask (torch.Tensor) - [b, s, n_blocks*block_size] attention mask rows for every input position
+      input_pos (torch.Tensor) - [b, s] position ids
+      block_tables (torch.Tensor) - [b, n_blocks] cache blocks of each row in order
+      cache_pos (torch.Tensor) - [b] cache position the first token of each row is written at
+      seq_lens (torch.Tensor) - [b] number of real tokens in each row
+      tokens (torch.Tensor, optional) - [b, s] tokens
+      hidden_state (torch.Tensor, optional) - [b, s, embed_dim] hidden state from the previous shard
+    """
+    if DEBUG >= 4:
+      print("generate_batch called")
+      print(f"mask: {mask.size()}")
+      print(f"input_pos: {input_pos}")
+      print(f"block_tables: {block_tables}")
+      print(f"cache_pos: {cache_pos}")
+      print(f"seq_lens: {seq_lens}")
+
+    self.model.output_hidden_states = [self.shard.end_layer]
+    self.model.set_cache_batch(block_tables, cache_pos, seq_lens)
+
+    try:
+      with torch.no_grad():
+        model_output = self.model(
+          tokens=tokens,
+          mask=mask,
+          input_pos=input_pos,
+          hidden_state=hidden_state,
+          dtype=self.dtype
+        )
+    finally:
+      self.model.set_cache_batch()
+
+    if self.shard.is_last_layer():
+      return None, model_output
+
+    return model_output, None
@@ -4,9 +4,11 @@ Utility methods used by LLMs
 import os
 import re
 import json
+import warnings
 from pathlib import Path
-from typing import Any, Dict, Optional, Union, List, Callable
+from typing import Any, Dict, Optional, Union, List, Callable, Tuple
 
+import numpy as np
 import torch
 import torch.nn as nn
 from torchtune.modules.attention_utils import _MaskType
@@ -324,25 +326,51 @@ class ShardTransformerDecoder(TransformerDecoder):
     *,
     encoder_max_seq_len: Optional[int] = None,
     decoder_max_seq_len: Optional[int] = None,
+    num_blocks: Optional[int] = None,
+    block_size: int = 16,
   ):
     """
     modified version for shard
 
-    assume just decoder layers
+    assume just decoder layers, num_blocks sizes the shared
+    paged cache pool and defaults to a full sequence per batch row
     """
     if decoder_max_seq_len is not None:
       self.decoder_max_cache_seq_len = decoder_max_seq_len
     else:
       self.decoder_max_cache_seq_len = self.max_seq_len
 
+    # cache blocks are addressable per request so decode steps
+    # at different positions can share one batched forward
     for layer in self.layers:
       if layer is not None:
-        layer.setup_caches(
-          batch_size,
-          dtype,
-          encoder_max_seq_len=self.encoder_max_cache_seq_len,
-          decoder_max_seq_len=self.decoder_max_cache_seq_len,
+        layer.attn.kv_cache = ShardKVCache(
+          batch_size=batch_size,
+          max_seq_len=self.decoder_max_cache_seq_len,
+          num_kv_heads=layer.attn.num_kv_heads,
+          head_dim=layer.attn.head_dim,
+          dtype=dtype,
+          num_blocks=num_blocks,
+          block_size=block_size,
         )
+        layer.attn.cache_enabled = True
+
+  def set_cache_batch(
+    self,
+    block_tables: Optional[torch.Tensor] = None,
+    cache_pos: Optional[torch.Tensor] = None,
+    seq_lens: Optional[torch.Tensor] = None
+  ):
+    """
+    Select the cache blocks each row of the next forward reads and writes,
+    the position each row starts writing at and how many tokens
+    of each row are real (not padding)
+
+    Passing None restores the default torchtune behaviour
+    """
+    for layer in self.layers:
+      if layer is not None and isinstance(layer.attn.kv_cache, ShardKVCache):
+        layer.attn.kv_cache.set_batch(block_tables, cache_pos, seq_lens)
 
   def caches_are_enabled(self) -> bool:
     """
@@ -438,6 +466,104 @@ class ShardTransformerDecoder(TransformerDecoder):
 
       return hidden[-1]
 
+class ShardKVCache(nn.Module):
+  """
+  Paged KV cache
+
+  Keys and values live in a pool of num_blocks blocks of block_size tokens.
+  When a batch is set with set_batch, each input row is written through its
+  own block table starting at its own position, skipping the right padding
+  past each row's length, and reads back its blocks as one contiguous
+  sequence. This lets requests at different generation steps share one
+  batched forward while only holding the blocks they use.
+
+  Without a batch set it behaves like torchtune KVCache, row i using the
+  i-th contiguous run of blocks.
+  """
+  def __init__(
+    self,
+    batch_size: int,
+    max_seq_len: int,
+    num_kv_heads: int,
+    head_dim: int,
+    dtype: torch.dtype,
+    num_blocks: Optional[int] = None,
+    block_size: int = 16,
+  ):
+    super().__init__()
+    self.block_size = block_size
+    self.blocks_per_seq = -(-max_seq_len//block_size)
+    self.num_blocks = num_blocks if num_blocks is not None else batch_size*self.blocks_per_seq
+    cache_shape = (self.num_blocks, num_kv_heads, block_size, head_dim)
+    self.register_buffer("k_cache", torch.zeros(cache_shape, dtype=dtype), persistent=False)
+    self.register_buffer("v_cache", torch.zeros(cache_shape, dtype=dtype), persistent=False)
+    self.register_buffer("cache_pos", torch.arange(0, max_seq_len), persistent=False)
+    self.batch_size = batch_size
+    self.max_seq_len = max_seq_len
+    self.block_tables = None
+    self.slot_pos = None
+    self.seq_lens = None
+
+  def set_batch(self, block_tables: Optional[torch.Tensor], cache_pos: Optional[torch.Tensor], seq_lens: Optional[torch.Tensor]):
+    self.block_tables = block_tables
+    self.slot_pos = cache_pos
+    self.seq_lens = seq_lens
+
+  def reset(self):
+    self.k_cache.zero_()
+    self.v_cache.zero_()
+    self.cache_pos -= self.size
+
+  @property
+  def size(self) -> int:
+    return self.cache_pos[0].item()
+
+  def update(self, k_val: torch.Tensor, v_val: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    bsz, _, seq_len, _ = k_val.shape
+    if self.block_tables is None:
+      assert (self.cache_pos[0] + seq_len) <= self.max_seq_len
+      block_tables = torch.arange(bsz*self.blocks_per_seq, device=k_val.device).view(bsz, self.blocks_per_seq)
+      k_out, v_out = self.write(
+        k_val,
+        v_val,
+        block_tables,
+        self.cache_pos[:1].expand(bsz),
+        torch.full((bsz,), seq_len, device=k_val.device)
+      )
+      self.cache_pos.add_(seq_len)
+      return k_out[:, :, :self.max_seq_len], v_out[:, :, :self.max_seq_len]
+
+    return self.write(k_val, v_val, self.block_tables, self.slot_pos, self.seq_lens)
+
+  def write(
+    self,
+    k_val: torch.Tensor,
+    v_val: torch.Tensor,
+    block_tables: torch.Tensor,
+    cache_pos: torch.Tensor,
+    seq_lens: torch.Tensor
+  ) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    Write only the real tokens of every row through its block table and
+    return each row's blocks gathered to [b, num_kv_heads, n_blocks*block_size, head_dim]
+    """
+    bsz, num_kv_heads, seq_len, head_dim = k_val.shape
+    n_blocks = block_tables.size(1)
+
+    offsets = torch.arange(seq_len, device=k_val.device)
+    positions = cache_pos[:, None] + offsets
+    valid = offsets[None, :] < seq_lens[:, None]
+    assert positions[valid].max() < n_blocks*self.block_size
+    blocks = block_tables.gather(1, (positions//self.block_size).clamp(max=n_blocks - 1))
+    block_offsets = positions % self.block_size
+    self.k_cache[blocks[valid], :, block_offsets[valid]] = k_val.transpose(1, 2)[valid]
+    self.v_cache[blocks[valid], :, block_offsets[valid]] = v_val.transpose(1, 2)[valid]
+
+    # [b, n_blocks, h, block_size, d] -> [b, h, n_blocks*block_size, d]
+    k_out = self.k_cache[block_tables].transpose(1, 2).reshape(bsz, num_kv_heads, n_blocks*self.block_size, head_dim)
+    v_out = self.v_cache[block_tables].transpose(1, 2).reshape(bsz, num_kv_heads, n_blocks*self.block_size, head_dim)
+    return k_out, v_out
+
 class MultiLayerPreceptron(nn.Module):
   def __init__(self, input_dim, hidden_dim, activation="silu", use_bias=False):
     """
@@ -468,6 +594,16 @@ class MultiLayerPreceptron(nn.Module):
   def forward(self, x) -> torch.Tensor:
     return self.down_proj(self.act_fn(self.gate_proj(x))*self.up_proj(x))
 
+def tensor_from_numpy(x: np.ndarray) -> torch.Tensor:
+  """
+  CPU tensor sharing memory with x. Arrays received from peers are read-only
+  views of the message buffer, which torch warns about, but inputs are never
+  written to in place so no copy is needed.
+  """
+  with warnings.catch_warnings():
+    warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+    return torch.from_numpy(np.asarray(x))
+
 class ShardInferenceState:
   def __init__(
     self,
@@ -486,17 +622,33 @@ class ShardInferenceState:
   def from_dict(self, state_dict):
     """
     Data is stored as torch tensors on needed devices
+
+    The mask and input_pos are not sent, the receiving shard rebuilds them
+    from the tokens. Tokens arrive in full at prefill, later hops only carry
+    the newest token which is appended if this shard hasn't seen it yet.
     """
-    self.tokens = torch.tensor(state_dict["tokens"]).to(self.device)
-    self.input_pos = torch.tensor(state_dict["input_pos"]).to(self.device)
-    self.mask = torch.tensor(state_dict["mask"]).to(self.device)
+    if state_dict.get("tokens") is not None:
+      self.tokens = tensor_from_numpy(state_dict["tokens"]).to(self.device)
+    elif state_dict.get("new_tokens") is not None:
+      new_tokens = tensor_from_numpy(state_dict["new_tokens"]).to(self.device)
+      num_tokens = state_dict["num_tokens"]
+      have_tokens = 0 if self.tokens is None else self.tokens.size(-1)
+      if have_tokens == num_tokens - new_tokens.size(-1):
+        self.tokens = new_tokens if self.tokens is None else torch.cat([self.tokens.to(self.device), new_tokens], dim=-1)
+      elif have_tokens != num_tokens:
+        raise ValueError(f"Inference state out of sync, have {have_tokens} tokens but sender has {num_tokens}")
     self.curr_pos = state_dict["curr_pos"]
 
   def to_dict(self) -> dict:
+    if self.curr_pos == 0:
+      return {
+        "tokens": self.tokens.numpy(force=True),
+        "curr_pos": self.curr_pos
+      }
+
     return {
-      "tokens": self.tokens.numpy(force=True).tolist(),
-      "input_pos": self.input_pos.numpy(force=True).tolist(),
-      "mask": self.mask.numpy(force=True).tolist(),
+      "new_tokens": self.tokens[:, -1:].numpy(force=True),
+      "num_tokens": self.tokens.size(-1),
       "curr_pos": self.curr_pos
     }
 
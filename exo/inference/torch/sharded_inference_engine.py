@@ -9,7 +9,7 @@ from concurrent.futures import ThreadPoolExecutor
 import asyncio
 import uuid
 import re
-from typing import Optional
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import numpy as np
 import torch
@@ -24,10 +24,14 @@ from exo.helpers import DEBUG
 from exo.inference.torch.models.llm_utils import (
   load_model_config,
   load_model_weights_torchtune,
-  ShardInferenceState
+  ShardInferenceState,
+  tensor_from_numpy
 )
 
 from exo.inference.torch.models.general_mha import ShardedGeneralModel
+from exo.inference.torch.kv_cache_pool import KVCachePool, kv_cache_block_bytes
+from exo.inference.paged_kv_cache import KVBlockAllocator
+from exo.inference.prefix_cache import PrefixCache
 
 # from torchtune generate recipe
 # https://github.com/pytorch/torchtune/blob/main/recipes/configs/generation.yaml#L40
@@ -42,17 +46,22 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
     self.shard = None
     self.shard_downloader = shard_downloader
     self.sharded_model = None
-    self.request_id = None
     self.executor = ThreadPoolExecutor(max_workers=1)
     self.uuid = str(uuid.uuid4())
     self.model_path = None
     self.model_config = None
-    self.state = None
     self.oom_cnt = 0
 
+    # generation state and kv cache blocks per request, set up with the model
+    self.kv_pool = None
+
     # cache settings
     self.use_cache = bool(os.getenv("TORCH_USE_CACHE", "True").lower() == "true")
-    self.cache_setup = False
+    self.max_batch_size = max(1, int(os.getenv("TORCH_MAX_BATCH_SIZE", "8")))
+    self.max_cache_len = int(os.getenv("TORCH_MAX_CACHE_LEN", "2048"))
+    self.kv_block_size = max(1, int(os.getenv("TORCH_KV_BLOCK_SIZE", "16")))
+    self.kv_cache_budget = int(os.getenv("TORCH_KV_CACHE_MB", "0"))*1024*1024
+    self.prefix_cache_budget = int(os.getenv("TORCH_PREFIX_CACHE_MB"))*1024*1024 if os.getenv("TORCH_PREFIX_CACHE_MB") else None
 
     # device settings
     if os.environ.get("TORCH_DEVICE"):
@@ -68,19 +77,63 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
     self.rng = torch.Generator(device=self.device)
     self.rng.manual_seed(1234)
 
-  def setup_cache(self, batch_size: int=1, total_response_length: int=1024):
-    # setup cache
-    # this is needed for a primary node that gets the initial encoding
+  @property
+  def cache_len(self) -> int:
+    # whole blocks so a full block table lines up with the mask
+    max_len = min(self.max_cache_len, self.model_config["max_seq_len"])
+    return max(self.kv_block_size, max_len//self.kv_block_size*self.kv_block_size)
+
+  def setup_cache(self):
+    """
+    Set up the request pool and the paged cache its blocks index into.
+    With TORCH_KV_CACHE_MB the block count comes from the memory budget,
+    otherwise there are enough blocks for a full batch of max length requests.
+    """
+    block_bytes = kv_cache_block_bytes(
+      n_layers=self.shard.get_layer_count(),
+      num_kv_heads=self.model_config["num_kv_heads"],
+      head_dim=self.model_config["head_dim"],
+      block_size=self.kv_block_size,
+      dtype=self.model_config["torch_dtype"]
+    )
+
+    if self.kv_cache_budget > 0:
+      allocator = KVBlockAllocator.from_budget(self.kv_cache_budget, block_bytes, block_size=self.kv_block_size)
+    else:
+      allocator = KVBlockAllocator(self.max_batch_size*self.cache_len//self.kv_block_size, block_size=self.kv_block_size, block_bytes=block_bytes)
+
+    # prefix cache defaults to a quarter of the blocks, hidden states cached on
+    # shards before the last count against the same bytes
+    prefix_cache = None
+    prefix_blocks = allocator.num_blocks//4 if self.prefix_cache_budget is None else self.prefix_cache_budget//block_bytes
+    if self.use_cache and prefix_blocks > 0:
+      prefix_cache = PrefixCache(allocator, max_blocks=prefix_blocks, max_bytes=prefix_blocks*block_bytes if self.prefix_cache_budget is None else self.prefix_cache_budget)
+
+    # without a cache, states are only bounded by the batch size
+    self.kv_pool = KVCachePool(
+      allocator,
+      max_requests=None if self.use_cache else self.max_batch_size,
+      device=self.device,
+      prefix_cache=prefix_cache
+    )
+
+    if DEBUG >= 2:
+      print(f"[TorchDynamicShardInferenceEngine] {allocator.num_blocks} kv cache blocks of {self.kv_block_size} tokens ({allocator.total_bytes} bytes)")
+
     if not self.sharded_model.model.caches_are_enabled() and self.use_cache:
       with self.device:
         self.sharded_model.model.setup_caches(
-          batch_size,
+          self.max_batch_size,
           self.model_config["torch_dtype"],
-          decoder_max_seq_len=total_response_length
+          decoder_max_seq_len=self.cache_len,
+          num_blocks=allocator.num_blocks,
+          block_size=self.kv_block_size
         )
-      
-      self.cache_setup = True
 
+  async def release_request(self, request_id: str) -> None:
+    if self.kv_pool is None: return
+    # the pool is only ever changed on the executor thread
+    await asyncio.get_running_loop().run_in_executor(self.executor, self.kv_pool.release, request_id)
 
   def clear_model(self):
     """
@@ -103,7 +156,45 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
       torch.cuda.empty_cache()
     
     self.shard = None
-    self.state = None
+    self.kv_pool = None
+
+  def init_state(self, state: ShardInferenceState, tokens: torch.Tensor):
+    """
+    Start a request's state from its prompt tokens along with
+    the input_pos and mask for the whole cache length
+    """
+    state.tokens = tokens.clone()
+    state.curr_pos = 0
+    max_seq_len = self.cache_len
+
+    # set pad_id
+    if hasattr(self.tokenizer, "pad_id"):
+      pad_id = self.tokenizer.pad_id
+    elif hasattr(self.tokenizer, "pad_token_id") and self.tokenizer.pad_token_id is not None:
+      pad_id = self.tokenizer.pad_token_id
+    else:
+      pad_id = 0
+
+    padding_masks = tokens != pad_id
+    if not padding_masks.all():
+      padding_masks = torch.nn.functional.pad(
+        padding_masks,
+        (0, max_seq_len - tokens.size(-1)),
+        value=True,
+      )
+
+      state.mask = ttg.get_causal_mask_from_padding_mask(padding_masks, target_seq_len=max_seq_len)
+
+      state.input_pos = ttg.get_position_ids_from_padding_mask(padding_masks)
+    else:
+      state.mask = torch.tril(torch.ones(
+        max_seq_len,
+        max_seq_len,
+        dtype=torch.bool,
+        device=self.device,
+      )).unsqueeze(0)
+
+      state.input_pos = torch.arange(0, max_seq_len, device=self.device).unsqueeze(0)
 
   async def encode(self, shard: Shard, prompt: str) -> np.ndarray:
     if DEBUG >= 4:
@@ -114,73 +205,19 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
     await self.ensure_shard(shard)
 
     def encode_wrapper() -> np.ndarray:
-      """
-      Encode the tensors from prompt along with the
-      initial input_pos and mask
-      """
       tokens = self.tokenizer.encode(
         prompt,
-        return_tensors="pt"
+        return_tensors="np"
       )
 
-      # move to proper device, default is CPU
-      if tokens.device != self.device:
-        tokens = tokens.to(device=self.device)
-      
       if DEBUG >= 4:
         print("encoded_wrapper called")
         print(f"tokens: {tokens}")
 
       # if going past max, just take from max onward
-      if len(tokens) > self.sharded_model.max_generated_tokens:
-        max_gen_tokens = self.sharded_model.max_generated_tokens
-        tokens = tokens[-max_gen_tokens:]
-
-      self.state.tokens = tokens
-
-      bsz, tklng = tokens.size()
-      total_response_length = tklng + self.sharded_model.max_generated_tokens
-
-      self.setup_cache(bsz, total_response_length)
-      
-      # setup max sequence length
-      if not self.sharded_model.model.caches_are_enabled():
-        max_seq_len = total_response_length
-      else:
-        max_seq_len = self.sharded_model.model.decoder_max_cache_seq_len
-
-      # set pad_id
-      if hasattr(self.tokenizer, "pad_id"):
-        pad_id = self.tokenizer.pad_id
-      elif hasattr(self.tokenizer, "pad_token_id"):
-        print(f"pad_token_id: {self.tokenizer.pad_token_id}")
-        if self.tokenizer.pad_token_id is not None:
-          pad_id = self.tokenizer.pad_token_id
-        else:
-          pad_id = 0
-      else:
-        pad_id = 0
-      
-      padding_masks = tokens != pad_id
-      if not padding_masks.all():
-        padding_masks = torch.nn.functional.pad(
-          padding_masks,
-          (0, self.sharded_model.max_generated_tokens),
-          value=True,
-        )
-
-        self.state.mask = ttg.get_causal_mask_from_padding_mask(padding_masks, target_seq_len=max_seq_len)
-
-        self.state.input_pos = ttg.get_position_ids_from_padding_mask(padding_masks)
-      else:
-        self.state.mask = torch.tril(torch.ones(
-          total_response_length,
-          max_seq_len,
-          dtype=torch.bool,
-          device=self.device,
-        )).unsqueeze(0)
-
-        self.state.input_pos = torch.arange(0, total_response_length, device=self.device).unsqueeze(0)
+      max_prompt_len = max(1, self.cache_len - self.sharded_model.max_generated_tokens)
+      if tokens.shape[-1] > max_prompt_len:
+        tokens = tokens[:, -max_prompt_len:]
 
       return tokens
 
@@ -231,108 +268,106 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
     input_data: np.ndarray,
     inference_state: Optional[dict] = None
   ) -> tuple[np.ndarray, Optional[dict]]:
+    results = await self.infer_tensor_batch(shard, [(request_id, input_data, inference_state)])
+    if isinstance(results[0], Exception): raise results[0]
+    return results[0]
 
+  async def infer_tensor_batch(
+    self,
+    shard: Shard,
+    requests: List[Tuple[str, np.ndarray, Optional[dict]]]
+  ) -> List[Union[Tuple[np.ndarray, Optional[dict]], Exception]]:
+    """
+    Runs one forward over all requests, right padding prompts and
+    decode steps of different lengths into a single batch.
+    Batches larger than TORCH_MAX_BATCH_SIZE are split.
+    A request whose KV cache was evicted gets its error in place of a result.
+    """
     await self.ensure_shard(shard)
 
-    # ensure shard
     if DEBUG >= 4:
-      print("infer_tensor called")
+      print("infer_tensor_batch called")
       print(f"shard: {shard}")
-      print(f"input_data: {input_data}")
+      print(f"request_ids: {[request_id for request_id, _, _ in requests]}")
 
-    if inference_state.get("tokens") is not None:
-      self.state.from_dict(inference_state)
+    results = []
+    for i in range(0, len(requests), self.max_batch_size):
+      results.extend(await asyncio.get_running_loop().run_in_executor(
+        self.executor,
+        functools.partial(self.infer_batch_wrapper, requests[i:i + self.max_batch_size])
+      ))
 
-    self.request_id = request_id if not self.request_id else self.request_id
+    return results
 
-    hidden_state = None
-    input_tensor = None
-    if input_data.ndim == 3:
-      hidden_state = torch.tensor(input_data).to(
-        device=self.device,
-        dtype=self.model_config["torch_dtype"]
-      )
-    elif input_data.ndim == 2:
-      input_tensor = torch.tensor(input_data).to(
-        device=self.device
-      )
-
-    if self.use_cache and not self.cache_setup:
-      if input_tensor is not None:
-        bsz, tklng = input_tensor.size()
-        self.setup_cache(
-          bsz,
-          tklng + self.sharded_model.max_generated_tokens
-        )
-      else:
-        bsz, tklng = self.state.tokens.size()
-        self.setup_cache(
-          bsz,
-          tklng + self.sharded_model.max_generated_tokens
-        )
-
-    def infer_wrapper():
-      if DEBUG >= 4:
-        print(f"infer_wrapper called [{self.oom_cnt} OOM]")
-        print(f"self.state.tokens: {self.state.tokens}")
-        print(f"hidden_state: {hidden_state}")
-
-      model_cache = self.sharded_model.model.caches_are_enabled()
-
-      if self.state.tokens is not None:
-        if input_data.ndim == 2 and input_tensor.size(-1) == 1:
-          self.state.tokens = torch.cat([
-            self.state.tokens.to(self.device),
-            input_tensor.clone()
-          ], dim=-1).to(self.device)
-      else:
-        self.state.tokens = input_tensor.clone()
-
-      try:
-        in_tokens = self.state.tokens.clone().to(
-          device=self.device
-        )
-
-        in_input_pos = self.state.input_pos.clone().to(
-          device=self.device
+  def infer_batch_wrapper(self, requests: List[Tuple[str, np.ndarray, Optional[dict]]]) -> List[Union[Tuple[np.ndarray, Optional[dict]], Exception]]:
+    if DEBUG >= 4:
+      print(f"infer_batch_wrapper called [{self.oom_cnt} OOM]")
+
+    # a decode step whose cache was evicted can't be recovered here, it fails
+    # on its own before any state is touched and the rest of the batch still runs
+    failed: Dict[int, Exception] = {}
+    for i, (request_id, input_data, inference_state) in enumerate(requests):
+      if self.use_cache and request_id not in self.kv_pool and inference_state and inference_state.get("curr_pos", 0) > 0:
+        failed[i] = RuntimeError(f"KV cache for request {request_id} was evicted, raise TORCH_KV_CACHE_MB or lower concurrency")
+      elif input_data.ndim != 2 and not self.has_tokens(request_id, inference_state):
+        failed[i] = ValueError(f"No inference state for request {request_id}")
+    requests = [request for i, request in enumerate(requests) if i not in failed]
+
+    pinned = {request_id for request_id, _, _ in requests}
+    rows = []
+    for request_id, input_data, inference_state in requests:
+      state, _ = self.kv_pool.poll_state(request_id, pinned)
+
+      if inference_state is not None and "curr_pos" in inference_state:
+        state.from_dict(inference_state)
+
+        # a new prompt from the previous shard, rebuild mask and positions locally
+        if inference_state.get("tokens") is not None:
+          self.init_state(state, state.tokens)
+
+      hidden_state = None
+      input_tensor = None
+      # wrap the received buffer, .to() only copies for a device or dtype change
+      if input_data.ndim == 3:
+        hidden_state = tensor_from_numpy(input_data).to(
+          device=self.device,
+          dtype=self.model_config["torch_dtype"]
         )
-
-        in_mask = self.state.mask.clone().to(
+      elif input_data.ndim == 2:
+        input_tensor = tensor_from_numpy(input_data).to(
           device=self.device
         )
 
-        if hidden_state is not None:
-          model_hs, model_logits = self.sharded_model.generate(
-            tokens=in_tokens,
-            hidden_state=hidden_state,
-            input_pos=in_input_pos,
-            mask=in_mask,
-            curr_pos=self.state.curr_pos
-          )
-        else:
-          if not model_cache:
-            model_hs, model_logits = self.sharded_model.generate(
-              tokens=in_tokens,
-              input_pos=in_input_pos,
-              mask=in_mask,
-              curr_pos=self.state.curr_pos
-            )
-          else:
-            model_hs, model_logits = self.sharded_model.generate(
-              tokens=input_tensor,
-              input_pos=in_input_pos,
-              mask=in_mask,
-              curr_pos=self.state.curr_pos
-            )
-      except torch.cuda.OutOfMemoryError:
-        print(f"OOM on cuda, clearing model and stopping")
-        self.oom_cnt += 1
-        self.clear_model()
-        return
-      except Exception as err:
-        print(f"infer_tensor err\n{err}")
-        raise
-
+      if input_tensor is not None and (state.tokens is None or input_tensor.size(-1) > 1):
+        self.init_state(state, input_tensor)
+      elif input_tensor is not None:
+        state.tokens = torch.cat([
+          state.tokens.to(self.device),
+          input_tensor.clone()
+        ], dim=-1).to(self.device)
+      elif state.tokens is None:
+        raise ValueError(f"No inference state for request {request_id}")
+
+      rows.append((request_id, state, input_tensor, hidden_state))
+
+    try:
+      if not rows:
+        outputs = []
+      elif self.sharded_model.model.caches_are_enabled():
+        outputs = self.forward_batch(rows, pinned)
+      else:
+        outputs = [self.forward_uncached(state, input_tensor, hidden_state) for _, state, input_tensor, hidden_state in rows]
+    except torch.cuda.OutOfMemoryError:
+      print(f"OOM on cuda, clearing model and stopping")
+      self.oom_cnt += 1
+      self.clear_model()
+      raise
+    except Exception as err:
+      print(f"infer_tensor err\n{err}")
+      raise
+
+    results = []
+    for (_, state, _, _), (model_hs, model_logits) in zip(rows, outputs):
       if model_hs is not None:
         # numpy current no support for bf16
         if model_hs.dtype == torch.bfloat16:
@@ -341,30 +376,139 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
         if DEBUG >= 4:
           print("sending hidden states")
           print(f"model_hs: {model_hs.size()}")
-          print(f"state.tokens: {self.state.tokens}")
-          print(f"state.input_pos: {self.state.input_pos.size()}")
-          print(f"state.mask: {self.state.mask.size()}")
-        
-        return (
-          model_hs.numpy(force=True),
-          self.state.to_dict(),
-        )
-      
-      if self.state.curr_pos == 0:
-        self.state.curr_pos = self.state.tokens.size(-1)
+          print(f"state.tokens: {state.tokens}")
+
+        results.append((model_hs.numpy(force=True), state.to_dict()))
+        continue
+
+      if state.curr_pos == 0:
+        state.curr_pos = state.tokens.size(-1)
       else:
-        self.state.curr_pos += 1
+        state.curr_pos += 1
 
       # numpy current no support for bf16
       if model_logits.dtype == torch.bfloat16:
         model_logits = model_logits.float()
 
-      return (
-        model_logits[:, -1].numpy(force=True),
-        self.state.to_dict(),
-      )
+      results.append((model_logits.numpy(force=True), state.to_dict()))
+
+    for i in sorted(failed):
+      results.insert(i, failed[i])
+    return results
+
+  def has_tokens(self, request_id: str, inference_state: Optional[dict]) -> bool:
+    """Whether a hidden state step gets its tokens from the inference state it came with or an earlier step."""
+    if inference_state is not None and "curr_pos" in inference_state:
+      if inference_state.get("tokens") is not None or inference_state.get("new_tokens") is not None:
+        return True
+    return request_id in self.kv_pool and self.kv_pool.entries[request_id].tokens is not None
 
-    return await asyncio.get_running_loop().run_in_executor(self.executor, infer_wrapper)
+  def forward_batch(
+    self,
+    rows: List[Tuple[str, ShardInferenceState, Optional[torch.Tensor], Optional[torch.Tensor]]],
+    pinned: Set[str]
+  ) -> List[Tuple[Optional[torch.Tensor], Optional[torch.Tensor]]]:
+    """
+    One cached forward over every row. Rows are right padded to the longest,
+    padded positions reuse the last real mask row and are never written to the cache.
+    Each row attends over its own blocks, so the key length is the longest block table.
+
+    Prompts first share the blocks of their longest cached prefix and only the rest
+    is run. Hidden states for the cached part come from the prefix cache so the next
+    shard still gets the whole prompt.
+    """
+    prefix_cache = self.kv_pool.prefix_cache
+    inputs, starts, prefix_payloads = [], [], []
+    for request_id, state, input_tensor, hidden_state in rows:
+      x = input_tensor if input_tensor is not None else hidden_state
+      start = state.curr_pos
+      payloads = []
+      if start == 0:
+        # prefill, drop blocks from an earlier prompt with this request id
+        self.kv_pool.allocator.free(request_id)
+        if prefix_cache is not None:
+          blocks, payloads = prefix_cache.match(state.tokens[0].tolist(), max_tokens=x.size(1) - 1)
+          if blocks:
+            start = len(blocks)*self.kv_block_size
+            self.kv_pool.allocator.share(request_id, blocks, start)
+            x = x[:, start:]
+      inputs.append(x)
+      starts.append(start)
+      prefix_payloads.append(payloads)
+
+    seq_lens = [x.size(1) for x in inputs]
+    max_len = max(seq_lens)
+
+    block_tables = [
+      list(self.kv_pool.reserve(request_id, start + seq_len, pinned))
+      for (request_id, _, _, _), start, seq_len in zip(rows, starts, seq_lens)
+    ]
+    n_blocks = max(len(table) for table in block_tables)
+    kv_len = n_blocks*self.kv_block_size
+
+    tokens, hidden, masks, input_pos = [], [], [], []
+    for (_, state, input_tensor, _), x, start, seq_len in zip(rows, inputs, starts, seq_lens):
+      pad = max_len - seq_len
+      row_pos = state.input_pos[0, start:start + seq_len].to(self.device)
+      row_mask = state.mask[0, start:start + seq_len, :kv_len].to(self.device)
+      input_pos.append(torch.cat([row_pos, row_pos[-1:].expand(pad)]))
+      masks.append(torch.cat([row_mask, row_mask[-1:].expand(pad, -1)]))
+      if input_tensor is not None:
+        tokens.append(torch.nn.functional.pad(x[0], (0, pad)))
+      else:
+        hidden.append(torch.nn.functional.pad(x[0], (0, 0, 0, pad)))
+
+    if tokens and hidden:
+      raise ValueError("Cannot batch token and hidden state inputs together")
+
+    # unused table entries point at block 0, they are always masked out
+    model_hs, model_logits = self.sharded_model.generate_batch(
+      tokens=torch.stack(tokens) if tokens else None,
+      hidden_state=torch.stack(hidden) if hidden else None,
+      mask=torch.stack(masks),
+      input_pos=torch.stack(input_pos),
+      block_tables=torch.tensor([table + [0]*(n_blocks - len(table)) for table in block_tables], device=self.device),
+      cache_pos=torch.tensor(starts, device=self.device),
+      seq_lens=torch.tensor(seq_lens, device=self.device),
+    )
+
+    outputs = []
+    for b, ((request_id, state, _, _), seq_len, payloads) in enumerate(zip(rows, seq_lens, prefix_payloads)):
+      row_hs = None
+      if model_hs is not None:
+        row_hs = torch.cat(payloads + [model_hs[b, :seq_len]])[None]
+
+      if state.curr_pos == 0 and prefix_cache is not None:
+        chunks = None
+        if row_hs is not None:
+          chunks = [chunk.clone() for chunk in row_hs[0].split(self.kv_block_size)]
+        prefix_cache.insert(state.tokens[0].tolist(), self.kv_pool.allocator.block_table(request_id), chunks)
+
+      outputs.append((row_hs, model_logits[b:b + 1, seq_len - 1] if model_logits is not None else None))
+
+    return outputs
+
+  def forward_uncached(
+    self,
+    state: ShardInferenceState,
+    input_tensor: Optional[torch.Tensor],
+    hidden_state: Optional[torch.Tensor]
+  ) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor]]:
+    """
+    Without a cache every step recomputes the full sequence so requests run one at a time
+    """
+    model_hs, model_logits = self.sharded_model.generate(
+      tokens=state.tokens.clone().to(device=self.device),
+      hidden_state=hidden_state,
+      input_pos=state.input_pos.clone().to(device=self.device),
+      mask=state.mask.clone().to(device=self.device),
+      curr_pos=state.curr_pos
+    )
+
+    if model_logits is not None:
+      model_logits = model_logits[:, -1]
+
+    return model_hs, model_logits
 
   async def ensure_shard(self, shard: Shard):
     if DEBUG >= 4:
@@ -379,9 +523,6 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
 
     self.shard = shard
 
-    # Using CPU to store inference state
-    self.state = ShardInferenceState()
-
     # download model safetensors and shard
 
     self.model_path = await self.shard_downloader.ensure_shard(shard, self.__class__.__name__)
@@ -411,11 +552,16 @@ class TorchDynamicShardInferenceEngine(InferenceEngine):
         dim=self.model_config["embed_dim"],
         head_dim=self.model_config["head_dim"]
       )
+
+      self.setup_cache()
     
     await asyncio.get_running_loop().run_in_executor(
       self.executor,
       functools.partial(start_model),
     )
 
+  def stats(self) -> dict:
+    return self.kv_pool.stats() if self.kv_pool is not None else {}
+
   async def load_checkpoint(self, shard: Shard, path: str):
     await self.ensure_shard(shard)
@@ -0,0 +1,56 @@
+"""
+Accuracy check of reduced precision activations between shards against
+the full precision path
+"""
+import numpy as np
+import pytest
+
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.inference.torch.tests.test_prefix_cache import make_pipeline
+
+# (max error relative to the logit range, min top-1 agreement) per format
+TOLERANCES = {
+  "bf16": (5e-3, 1.0),
+  "fp16": (1e-3, 1.0),
+  "int8": (2e-2, 0.75),
+}
+
+def send_hidden_state(hidden_state: np.ndarray, wire_format: str) -> np.ndarray:
+  proto = GRPCPeerHandle("peer", "localhost:0", "test", None).serialize_tensor(hidden_state, wire_format)
+  return GRPCServer(None, "localhost", 0).deserialize_tensor(proto), proto.ByteSize()
+
+def logit_error(reference: np.ndarray, logits: np.ndarray) -> dict:
+  ref, out = reference.reshape(-1, reference.shape[-1]), logits.reshape(-1, logits.shape[-1])
+  return {
+    "max_rel_err": float(np.abs(ref - out).max()/(ref.max() - ref.min())),
+    "top1_agreement": float((ref.argmax(-1) == out.argmax(-1)).mean()),
+  }
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("wire_format", list(TOLERANCES))
+async def test_quantized_logits_match_full_precision(wire_format):
+  prompt = np.array([[5, 6, 7, 8, 9, 10, 11, 12]])
+  tokens = [20, 21, 22]
+
+  async def run(fmt):
+    engines = make_pipeline()
+    (first_shard, first), (last_shard, last) = engines
+    logits, sent, x, state = [], 0, prompt, {}
+    for token in [None] + tokens:
+      if token is not None: x = np.array([[token]])
+      hidden_state, state = await first.infer_tensor("r", first_shard, x, state)
+      hidden_state, nbytes = send_hidden_state(hidden_state, fmt)
+      out, state = await last.infer_tensor("r", last_shard, hidden_state, state)
+      logits.append(out)
+      sent += nbytes
+    return np.concatenate(logits), sent
+
+  reference, full_bytes = await run("none")
+  logits, quant_bytes = await run(wire_format)
+
+  error = logit_error(reference, logits)
+  max_rel_err, min_top1 = TOLERANCES[wire_format]
+  assert error["max_rel_err"] < max_rel_err, error
+  assert error["top1_agreement"] >= min_top1, error
+  assert quant_bytes < full_bytes*(0.3 if wire_format == "int8" else 0.55)
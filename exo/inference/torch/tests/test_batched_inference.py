@@ -0,0 +1,90 @@
+"""
+Test batched inference against running each request on its own
+using a small randomly initialized model
+"""
+import copy
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from exo.inference.shard import Shard
+from exo.inference.torch.models.general_mha import ShardedGeneralModel
+from exo.inference.torch.sharded_inference_engine import TorchDynamicShardInferenceEngine
+
+CONFIG = {
+  "embed_dim": 64,
+  "num_heads": 4,
+  "head_dim": 16,
+  "num_kv_heads": 2,
+  "max_seq_len": 128,
+  "intermediate_dim": 128,
+  "attn_dropout": 0.0,
+  "norm_eps": 1e-5,
+  "rope_base": 10000,
+  "vocab_size": 97,
+  "num_layers": 4,
+  "attn_bias": False,
+  "hidden_act": "silu",
+  "torch_dtype": torch.float32,
+}
+
+def make_engine(shard: Shard, model: ShardedGeneralModel, max_batch_size: int = 4, kv_cache_budget: int = 0) -> TorchDynamicShardInferenceEngine:
+  engine = TorchDynamicShardInferenceEngine(None)
+  engine.device = torch.device("cpu")
+  engine.use_cache = True
+  engine.max_batch_size = max_batch_size
+  engine.max_cache_len = 64
+  engine.kv_block_size = 4
+  engine.kv_cache_budget = kv_cache_budget
+  engine.shard = shard
+  engine.model_config = CONFIG
+  engine.tokenizer = SimpleNamespace(pad_token_id=None)
+  engine.sharded_model = model
+  engine.setup_cache()
+  return engine
+
+@pytest.fixture
+def engines():
+  torch.manual_seed(0)
+  shard = Shard("test-tiny", 0, 3, 4)
+  model = ShardedGeneralModel(CONFIG, shard, device=torch.device("cpu"), dtype=torch.float32, use_cache=True)
+  return shard, make_engine(shard, model), make_engine(shard, copy.deepcopy(model))
+
+@pytest.mark.asyncio
+async def test_batched_matches_sequential(engines):
+  shard, batched, sequential = engines
+  prompts = {
+    "r0": np.array([[5, 6, 7, 8, 9, 10, 11]]),
+    "r1": np.array([[12, 13, 14]]),
+    "r2": np.array([[15, 16, 17, 18, 19]]),
+  }
+
+  # prefill of different lengths in one forward
+  batched_out = await batched.infer_tensor_batch(shard, [(rid, tokens, {}) for rid, tokens in prompts.items()])
+  sequential_out = [await sequential.infer_tensor(rid, shard, tokens, {}) for rid, tokens in prompts.items()]
+
+  # decode steps where each request is at a different position
+  for step in range(3):
+    for (b_logits, b_state), (s_logits, s_state) in zip(batched_out, sequential_out):
+      assert b_logits.shape == (1, CONFIG["vocab_size"])
+      np.testing.assert_allclose(b_logits, s_logits, rtol=1e-4, atol=1e-4)
+      assert b_state["curr_pos"] == s_state["curr_pos"]
+
+    next_tokens = {rid: np.array([[20 + step + i]]) for i, rid in enumerate(prompts)}
+    batched_out = await batched.infer_tensor_batch(shard, [(rid, next_tokens[rid], state) for rid, (_, state) in zip(prompts, batched_out)])
+    sequential_out = [await sequential.infer_tensor(rid, shard, next_tokens[rid], state) for rid, (_, state) in zip(prompts, sequential_out)]
+
+@pytest.mark.asyncio
+async def test_batch_larger_than_max_batch_size_is_split(engines):
+  shard, _, _ = engines
+  model = ShardedGeneralModel(CONFIG, shard, device=torch.device("cpu"), dtype=torch.float32, use_cache=True)
+  engine = make_engine(shard, model, max_batch_size=2)
+
+  results = await engine.infer_tensor_batch(shard, [(f"r{i}", np.array([[i + 1, i + 2]]), {}) for i in range(5)])
+
+  assert len(results) == 5
+  assert all(state["curr_pos"] == 2 for _, state in results)
+  assert len(engine.kv_pool) == 5
+  assert engine.kv_pool.allocator.num_used_blocks == 5
@@ -0,0 +1,59 @@
+"""
+Test the inference state sent between shards is small, binary and
+still gives the same outputs after going over the wire
+"""
+import numpy as np
+import pytest
+
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.inference.torch.models.llm_utils import ShardInferenceState, tensor_from_numpy
+from exo.inference.torch.tests.test_prefix_cache import make_pipeline
+
+def over_the_wire(inference_state: dict) -> dict:
+  proto = GRPCPeerHandle("peer", "localhost:0", "test", None).serialize_inference_state(inference_state)
+  assert "mask" not in proto.other_data_json and "input_pos" not in proto.other_data_json
+  return GRPCServer(None, "localhost", 0).deserialize_inference_state(proto), proto.ByteSize()
+
+async def run_pipeline(engines, request_id: str, x: np.ndarray, state: dict, wire: bool):
+  sizes = []
+  for shard, engine in engines:
+    x, state = await engine.infer_tensor(request_id, shard, x, state)
+    if wire:
+      state, size = over_the_wire(state)
+      sizes.append(size)
+  return x, state, sizes
+
+@pytest.mark.asyncio
+async def test_state_over_the_wire_matches_in_process():
+  wire = make_pipeline()
+  local = make_pipeline()
+  prompt = np.array([[5, 6, 7, 8, 9, 10, 11]])
+
+  wire_out, wire_state, prefill_sizes = await run_pipeline(wire, "r", prompt, {}, wire=True)
+  local_out, local_state, _ = await run_pipeline(local, "r", prompt, {}, wire=False)
+  np.testing.assert_allclose(wire_out, local_out, rtol=1e-5, atol=1e-5)
+
+  for token in [20, 21, 22]:
+    wire_out, wire_state, decode_sizes = await run_pipeline(wire, "r", np.array([[token]]), wire_state, wire=True)
+    local_out, local_state, _ = await run_pipeline(local, "r", np.array([[token]]), local_state, wire=False)
+    np.testing.assert_allclose(wire_out, local_out, rtol=1e-5, atol=1e-5)
+
+  # decode hops carry one token no matter how long the context is
+  assert all(size < 100 for size in decode_sizes)
+  assert wire_state["num_tokens"] == prompt.shape[-1] + 3
+
+def test_out_of_sync_state_raises():
+  state = ShardInferenceState()
+  with pytest.raises(ValueError):
+    state.from_dict({"new_tokens": np.array([[1]]), "num_tokens": 5, "curr_pos": 4})
+
+def test_received_tensors_are_not_copied():
+  hidden_state = np.ones((1, 4, 8), dtype=np.float32)
+  proto = GRPCPeerHandle("peer", "localhost:0", "test", None).serialize_tensor(hidden_state)
+  server = GRPCServer(None, "localhost", 0)
+  received = server.deserialize_tensor(proto)
+  assert tensor_from_numpy(received).data_ptr() == received.ctypes.data
+
+  state, _ = over_the_wire({"tokens": np.array([[1, 2, 3]]), "curr_pos": 0})
+  assert tensor_from_numpy(state["tokens"]).data_ptr() == state["tokens"].ctypes.data
@@ -0,0 +1,139 @@
+"""
+Test KV cache pool block reuse, LRU eviction and interleaved requests
+"""
+import copy
+
+import numpy as np
+import pytest
+import torch
+
+from exo.inference.paged_kv_cache import KVBlockAllocator
+from exo.inference.shard import Shard
+from exo.inference.torch.kv_cache_pool import KVCachePool, kv_cache_block_bytes
+from exo.inference.torch.models.general_mha import ShardedGeneralModel
+from exo.inference.torch.tests.test_batched_inference import CONFIG, make_engine
+
+def test_pool_evicts_least_recently_used():
+  pool = KVCachePool(KVBlockAllocator(num_blocks=4, block_size=4))
+  pool.poll_state("a")
+  pool.reserve("a", 8)
+  pool.poll_state("b")
+  pool.reserve("b", 8)
+  _, cached = pool.poll_state("a")
+  assert cached
+
+  _, cached = pool.poll_state("c")
+  assert not cached
+  assert pool.reserve("c", 5) == [2, 3]
+  assert "a" in pool and "b" not in pool
+  assert pool.stats()["evictions"] == 1
+  assert pool.stats()["hits"] == 1
+
+def test_pool_never_evicts_pinned():
+  pool = KVCachePool(KVBlockAllocator(num_blocks=2, block_size=4))
+  for request_id in ["a", "b"]:
+    pool.poll_state(request_id)
+    pool.reserve(request_id, 4)
+
+  pool.poll_state("c", pinned={"a"})
+  pool.reserve("c", 4, pinned={"a"})
+  assert "a" in pool and "b" not in pool
+
+  with pytest.raises(RuntimeError):
+    pool.reserve("c", 8, pinned={"a"})
+
+def test_block_bytes():
+  assert kv_cache_block_bytes(n_layers=4, num_kv_heads=2, head_dim=16, block_size=4, dtype=torch.float16) == 2*4*2*16*4*2
+
+@pytest.mark.asyncio
+async def test_interleaved_requests_keep_their_cache():
+  torch.manual_seed(0)
+  shard = Shard("test-tiny", 0, 3, 4)
+  model = ShardedGeneralModel(CONFIG, shard, device=torch.device("cpu"), dtype=torch.float32, use_cache=True)
+  interleaved = make_engine(shard, model)
+  alone = make_engine(shard, copy.deepcopy(model))
+
+  a_logits, a_state = await interleaved.infer_tensor("a", shard, np.array([[5, 6, 7]]), {})
+  b_logits, b_state = await interleaved.infer_tensor("b", shard, np.array([[8, 9, 10, 11]]), {})
+  for token in [12, 13]:
+    a_logits, a_state = await interleaved.infer_tensor("a", shard, np.array([[token]]), a_state)
+    b_logits, b_state = await interleaved.infer_tensor("b", shard, np.array([[token]]), b_state)
+
+  _, alone_state = await alone.infer_tensor("a", shard, np.array([[5, 6, 7]]), {})
+  for token in [12, 13]:
+    alone_logits, alone_state = await alone.infer_tensor("a", shard, np.array([[token]]), alone_state)
+
+  np.testing.assert_allclose(a_logits, alone_logits, rtol=1e-4, atol=1e-4)
+
+@pytest.mark.asyncio
+async def test_evicted_request_raises():
+  torch.manual_seed(0)
+  shard = Shard("test-tiny", 0, 3, 4)
+  model = ShardedGeneralModel(CONFIG, shard, device=torch.device("cpu"), dtype=torch.float32, use_cache=True)
+  block_bytes = kv_cache_block_bytes(n_layers=4, num_kv_heads=CONFIG["num_kv_heads"], head_dim=CONFIG["head_dim"], block_size=4, dtype=torch.float32)
+  engine = make_engine(shard, model, kv_cache_budget=2*block_bytes)
+
+  _, a_state = await engine.infer_tensor("a", shard, np.array([[5, 6, 7]]), {})
+  await engine.infer_tensor("b", shard, np.array([[8, 9, 10, 11, 12]]), {})
+
+  with pytest.raises(RuntimeError):
+    await engine.infer_tensor("a", shard, np.array([[12]]), a_state)
+  assert engine.kv_pool.evictions == 1
+
+@pytest.mark.asyncio
+async def test_evicted_request_fails_alone_in_its_batch():
+  torch.manual_seed(0)
+  shard = Shard("test-tiny", 0, 3, 4)
+  model = ShardedGeneralModel(CONFIG, shard, device=torch.device("cpu"), dtype=torch.float32, use_cache=True)
+  block_bytes = kv_cache_block_bytes(n_layers=4, num_kv_heads=CONFIG["num_kv_heads"], head_dim=CONFIG["head_dim"], block_size=4, dtype=torch.float32)
+  engine = make_engine(shard, model, kv_cache_budget=2*block_bytes)
+  alone = make_engine(shard, copy.deepcopy(model))
+
+  _, a_state = await engine.infer_tensor("a", shard, np.array([[5, 6, 7]]), {})
+  _, b_state = await engine.infer_tensor("b", shard, np.array([[8, 9, 10, 11, 12]]), {})
+  _, alone_state = await alone.infer_tensor("b", shard, np.array([[8, 9, 10, 11, 12]]), {})
+  assert "a" not in engine.kv_pool
+
+  forwards = []
+  forward_batch = engine.forward_batch
+  engine.forward_batch = lambda rows, pinned: forwards.append([row[0] for row in rows]) or forward_batch(rows, pinned)
+  a_result, b_result = await engine.infer_tensor_batch(shard, [("a", np.array([[13]]), a_state), ("b", np.array([[13]]), b_state)])
+  alone_logits, alone_state = await alone.infer_tensor("b", shard, np.array([[13]]), alone_state)
+
+  assert isinstance(a_result, RuntimeError)
+  # the evicted request left no state behind and the healthy one still ran
+  assert "a" not in engine.kv_pool
+  assert forwards == [["b"]]
+  np.testing.assert_allclose(b_result[0], alone_logits, rtol=1e-4, atol=1e-4)
+  assert b_result[1]["curr_pos"] == alone_state["curr_pos"]
+
+@pytest.mark.asyncio
+async def test_missing_state_fails_alone_in_its_batch():
+  torch.manual_seed(0)
+  shard = Shard("test-tiny", 1, 3, 4)
+  model = ShardedGeneralModel(CONFIG, shard, device=torch.device("cpu"), dtype=torch.float32, use_cache=True)
+  engine = make_engine(shard, model)
+  hidden_state = np.random.default_rng(0).standard_normal((1, 3, CONFIG["embed_dim"])).astype(np.float32)
+
+  a_result, b_result = await engine.infer_tensor_batch(shard, [("a", hidden_state, {}), ("b", hidden_state, {"tokens": np.array([[5, 6, 7]]), "curr_pos": 0})])
+
+  assert isinstance(a_result, ValueError)
+  # no empty state is left behind to slip past the eviction check later
+  assert "a" not in engine.kv_pool
+  assert b_result[1]["curr_pos"] == 3
+
+@pytest.mark.asyncio
+async def test_finished_request_releases_its_blocks():
+  torch.manual_seed(0)
+  shard = Shard("test-tiny", 0, 3, 4)
+  model = ShardedGeneralModel(CONFIG, shard, device=torch.device("cpu"), dtype=torch.float32, use_cache=True)
+  engine = make_engine(shard, model)
+
+  _, a_state = await engine.infer_tensor("a", shard, np.array([[5, 6, 7]]), {})
+  await engine.infer_tensor("b", shard, np.array([[8, 9]]), {})
+  used = engine.kv_pool.allocator.num_used_blocks
+
+  await engine.release_request("a")
+  assert "a" not in engine.kv_pool and "b" in engine.kv_pool
+  assert engine.kv_pool.allocator.num_used_blocks < used
+  assert engine.kv_pool.evictions == 0
@@ -0,0 +1,68 @@
+"""
+Test prefix cache reuse gives the same outputs as a full prefill
+"""
+import copy
+
+import numpy as np
+import torch
+
+import pytest
+
+from exo.inference.shard import Shard
+from exo.inference.torch.models.general_mha import ShardedGeneralModel
+from exo.inference.torch.tests.test_batched_inference import CONFIG, make_engine
+
+SYSTEM_PROMPT = [5, 6, 7, 8, 9, 10, 11, 12, 13]
+
+def make_pipeline(seed: int = 0):
+  torch.manual_seed(seed)
+  full = ShardedGeneralModel(CONFIG, Shard("test-tiny", 0, 3, 4), device=torch.device("cpu"), dtype=torch.float32, use_cache=True)
+  shards = [Shard("test-tiny", 0, 1, 4), Shard("test-tiny", 2, 3, 4)]
+  engines = []
+  for shard in shards:
+    model = ShardedGeneralModel(CONFIG, shard, device=torch.device("cpu"), dtype=torch.float32, use_cache=True)
+    model.load_state_dict(full.state_dict(), strict=False)
+    engines.append((shard, make_engine(shard, model)))
+  return engines
+
+async def run_pipeline(engines, request_id: str, tokens):
+  x, state = np.array([tokens]), {}
+  for shard, engine in engines:
+    x, state = await engine.infer_tensor(request_id, shard, x, state)
+  return x, state
+
+@pytest.mark.asyncio
+async def test_prefix_hit_matches_full_prefill():
+  torch.manual_seed(0)
+  shard = Shard("test-tiny", 0, 3, 4)
+  model = ShardedGeneralModel(CONFIG, shard, device=torch.device("cpu"), dtype=torch.float32, use_cache=True)
+  warm = make_engine(shard, model)
+  cold = make_engine(shard, copy.deepcopy(model))
+  cold.kv_pool.prefix_cache = None
+
+  await warm.infer_tensor("first", shard, np.array([SYSTEM_PROMPT + [20, 21]]), {})
+  warm_logits, warm_state = await warm.infer_tensor("second", shard, np.array([SYSTEM_PROMPT + [30, 31, 32]]), {})
+  cold_logits, cold_state = await cold.infer_tensor("second", shard, np.array([SYSTEM_PROMPT + [30, 31, 32]]), {})
+
+  assert warm.kv_pool.prefix_cache.hits == 1
+  assert warm.kv_pool.prefix_cache.hit_tokens == 8
+  np.testing.assert_allclose(warm_logits, cold_logits, rtol=1e-4, atol=1e-4)
+
+  # decoding after a hit reads the shared blocks
+  warm_logits, _ = await warm.infer_tensor("second", shard, np.array([[40]]), warm_state)
+  cold_logits, _ = await cold.infer_tensor("second", shard, np.array([[40]]), cold_state)
+  np.testing.assert_allclose(warm_logits, cold_logits, rtol=1e-4, atol=1e-4)
+
+@pytest.mark.asyncio
+async def test_prefix_hit_across_shards():
+  warm = make_pipeline()
+  cold = make_pipeline()
+  for _, engine in cold:
+    engine.kv_pool.prefix_cache = None
+
+  await run_pipeline(warm, "first", SYSTEM_PROMPT + [20])
+  warm_logits, _ = await run_pipeline(warm, "second", SYSTEM_PROMPT + [30, 31])
+  cold_logits, _ = await run_pipeline(cold, "second", SYSTEM_PROMPT + [30, 31])
+
+  assert all(engine.kv_pool.prefix_cache.hits == 1 for _, engine in warm)
+  np.testing.assert_allclose(warm_logits, cold_logits, rtol=1e-4, atol=1e-4)
@@ -8,6 +8,7 @@ import os
 import time
 import traceback
 import uuid
+from typing import Dict
 import numpy as np
 from tqdm import tqdm
 from exo.train.dataset import load_dataset, iterate_batches
@@ -17,15 +18,19 @@ from exo.networking.grpc.grpc_server import GRPCServer
 from exo.networking.udp.udp_discovery import UDPDiscovery
 from exo.networking.tailscale.tailscale_discovery import TailscaleDiscovery
 from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.compression import CompressionPolicy, COMPRESSION_MODES
+from exo.networking.quantization import WIRE_FORMATS
 from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
+from exo.topology.ring_latency_partitioning_strategy import RingLatencyPartitioningStrategy
 from exo.api import ChatGPTAPI
+from exo.api.admission import AdmissionController
 from exo.download.shard_download import ShardDownloader, NoopShardDownloader
 from exo.download.download_progress import RepoProgressEvent
 from exo.download.new_shard_download import new_shard_downloader, has_exo_home_read_access, has_exo_home_write_access, ensure_exo_home, seed_models
 from exo.helpers import print_yellow_exo, find_available_port, DEBUG, get_system_info, get_or_create_node_id, get_all_ip_addresses_and_interfaces, terminal_link, shutdown
 from exo.inference.shard import Shard
 from exo.inference.inference_engine import get_inference_engine
-from exo.inference.tokenizers import resolve_tokenizer
+from exo.inference.tokenizers import IncrementalDetokenizer, resolve_tokenizer
 from exo.models import build_base_shard, get_repo
 from exo.viz.topology_viz import TopologyViz
 
@@ -86,6 +91,7 @@ parser.add_argument("--models-seed-dir", type=str, default=None, help="Model see
 parser.add_argument("--listen-port", type=int, default=5678, help="Listening port for discovery")
 parser.add_argument("--download-quick-check", action="store_true", help="Quick check local path for model shards download")
 parser.add_argument("--max-parallel-downloads", type=int, default=8, help="Max parallel downloads for model shards download")
+parser.add_argument("--max-connections-per-file", type=int, default=8, help="Max HTTP range requests downloading one large model file at once")
 parser.add_argument("--broadcast-port", type=int, default=5678, help="Broadcast port for discovery")
 parser.add_argument("--discovery-module", type=str, choices=["udp", "tailscale", "manual"], default="udp", help="Discovery module to use")
 parser.add_argument("--discovery-timeout", type=int, default=30, help="Discovery timeout in seconds")
@@ -93,7 +99,16 @@ parser.add_argument("--discovery-config-path", type=str, default=None, help="Pat
 parser.add_argument("--wait-for-peers", type=int, default=0, help="Number of peers to wait to connect to before starting")
 parser.add_argument("--chatgpt-api-port", type=int, default=52415, help="ChatGPT API port")
 parser.add_argument("--chatgpt-api-response-timeout", type=int, default=900, help="ChatGPT API response timeout in seconds")
+parser.add_argument("--max-inflight-requests", type=int, default=16, help="Max chat completion requests running at once, more are queued")
+parser.add_argument("--max-queued-requests", type=int, default=64, help="Max chat completion requests waiting to run before new ones get a 429")
+parser.add_argument("--max-queued-tokens", type=int, default=0, help="Max prompt tokens of waiting requests before new ones get a 429 (0 for no limit)")
 parser.add_argument("--max-generate-tokens", type=int, default=10000, help="Max tokens to generate in each request")
+parser.add_argument("--max-batch-size", type=int, default=8, help="Max concurrent requests coalesced into one batched inference step")
+parser.add_argument("--partitioning-strategy", type=str, choices=["memory", "latency"], default="memory", help="Split layers by node memory, or by estimated per-token latency from compute, memory and links")
+parser.add_argument("--topology-gossip-fanout", type=int, default=3, help="Peers contacted per topology gossip round")
+parser.add_argument("--wire-compression", type=str, choices=COMPRESSION_MODES, default="auto", help="Compression of tensors sent to peers (auto picks per message from size, dtype and link bandwidth)")
+parser.add_argument("--link-bandwidth", type=float, default=None, help="Link bandwidth to peers in Mbit/s for --wire-compression auto (measured if not set)")
+parser.add_argument("--activation-format", type=str, choices=WIRE_FORMATS, default="none", help="Precision of hidden states sent to peers that support it (bf16, fp16 or per-row int8)")
 parser.add_argument("--inference-engine", type=str, default=None, help="Inference engine to use (torch, mlx, tinygrad, or dummy)")
 parser.add_argument("--disable-tui", action=argparse.BooleanOptionalAction, help="Disable TUI")
 parser.add_argument("--run-model", type=str, help="Specify a model to run directly")
@@ -112,7 +127,7 @@ print_yellow_exo()
 system_info = get_system_info()
 print(f"Detected system: {system_info}")
 
-shard_downloader: ShardDownloader = new_shard_downloader(args.max_parallel_downloads) if args.inference_engine != "dummy" else NoopShardDownloader()
+shard_downloader: ShardDownloader = new_shard_downloader(args.max_parallel_downloads, args.max_connections_per_file) if args.inference_engine != "dummy" else NoopShardDownloader()
 inference_engine_name = args.inference_engine or ("mlx" if system_info == "Apple Silicon Mac" else "tinygrad")
 print(f"Inference engine name after selection: {inference_engine_name}")
 
@@ -140,13 +155,18 @@ if DEBUG >= 0:
 allowed_node_ids = args.node_id_filter.split(',') if args.node_id_filter else None
 allowed_interface_types = args.interface_type_filter.split(',') if args.interface_type_filter else None
 
+link_bandwidth = args.link_bandwidth*1e6/8 if args.link_bandwidth else None
+create_peer_handle = lambda peer_id, address, description, device_capabilities: GRPCPeerHandle(
+  peer_id, address, description, device_capabilities, CompressionPolicy(args.wire_compression, link_bandwidth), args.activation_format
+)
+
 if args.discovery_module == "udp":
   discovery = UDPDiscovery(
     args.node_id,
     args.node_port,
     args.listen_port,
     args.broadcast_port,
-    lambda peer_id, address, description, device_capabilities: GRPCPeerHandle(peer_id, address, description, device_capabilities),
+    create_peer_handle,
     discovery_timeout=args.discovery_timeout,
     allowed_node_ids=allowed_node_ids,
     allowed_interface_types=allowed_interface_types
@@ -155,7 +175,7 @@ elif args.discovery_module == "tailscale":
   discovery = TailscaleDiscovery(
     args.node_id,
     args.node_port,
-    lambda peer_id, address, description, device_capabilities: GRPCPeerHandle(peer_id, address, description, device_capabilities),
+    create_peer_handle,
     discovery_timeout=args.discovery_timeout,
     tailscale_api_key=args.tailscale_api_key,
     tailnet=args.tailnet_name,
@@ -165,7 +185,7 @@ elif args.discovery_module == "manual":
   if not args.discovery_config_path:
     raise ValueError(f"--discovery-config-path is required when using manual discovery. Please provide a path to a config json file.")
   discovery = ManualDiscovery(
-    args.discovery_config_path, args.node_id, create_peer_handle=lambda peer_id, address, description, device_capabilities: GRPCPeerHandle(peer_id, address, description, device_capabilities)
+    args.discovery_config_path, args.node_id, create_peer_handle=create_peer_handle
   )
 topology_viz = TopologyViz(chatgpt_api_endpoints=chatgpt_api_endpoints, web_chat_urls=web_chat_urls) if not args.disable_tui else None
 node = Node(
@@ -174,30 +194,39 @@ node = Node(
   inference_engine,
   discovery,
   shard_downloader,
-  partitioning_strategy=RingMemoryWeightedPartitioningStrategy(),
+  partitioning_strategy=RingLatencyPartitioningStrategy() if args.partitioning_strategy == "latency" else RingMemoryWeightedPartitioningStrategy(),
   max_generate_tokens=args.max_generate_tokens,
   topology_viz=topology_viz,
-  default_sample_temperature=args.default_temp
+  default_sample_temperature=args.default_temp,
+  max_batch_size=args.max_batch_size,
+  gossip_fanout=args.topology_gossip_fanout,
 )
 server = GRPCServer(node, args.node_host, args.node_port)
 node.server = server
+# model files peers already have are copied from them instead of the hub
+shard_downloader.use_peers(lambda: node.peers)
 api = ChatGPTAPI(
   node,
   node.inference_engine.__class__.__name__,
   response_timeout=args.chatgpt_api_response_timeout,
   on_chat_completion_request=lambda req_id, __, prompt: topology_viz.update_prompt(req_id, prompt) if topology_viz else None,
   default_model=args.default_model,
-  system_prompt=args.system_prompt
+  system_prompt=args.system_prompt,
+  admission=AdmissionController(args.max_inflight_requests, args.max_queued_requests, args.max_queued_tokens)
 )
-buffered_token_output = {}
-def update_topology_viz(req_id, tokens, __):
+viz_detokenizers: Dict[str, IncrementalDetokenizer] = {}
+def update_topology_viz(req_id, tokens, is_finished):
   if not topology_viz: return
   if not node.inference_engine.shard: return
   if node.inference_engine.shard.model_id == 'stable-diffusion-2-1-base': return
-  if req_id in buffered_token_output: buffered_token_output[req_id].extend(tokens)
-  else: buffered_token_output[req_id] = tokens
-  topology_viz.update_prompt_output(req_id, node.inference_engine.tokenizer.decode(buffered_token_output[req_id]))
-node.on_token.register("update_topology_viz").on_next(update_topology_viz)
+  if req_id not in viz_detokenizers: viz_detokenizers[req_id] = IncrementalDetokenizer(node.inference_engine.tokenizer)
+  detokenizer = viz_detokenizers[req_id]
+  detokenizer.add(tokens)
+  if is_finished:
+    detokenizer.flush()
+    viz_detokenizers.pop(req_id)
+  topology_viz.update_prompt_output(req_id, detokenizer.text)
+node.token_router.observe(update_topology_viz)
 def update_prompt_viz(request_id, opaque_status: str):
   if not topology_viz: return
   try:
@@ -243,8 +272,7 @@ async def run_model_cli(node: Node, model_name: str, prompt: str):
     return
   tokenizer = await resolve_tokenizer(get_repo(shard.model_id, inference_class))
   request_id = str(uuid.uuid4())
-  callback_id = f"cli-wait-response-{request_id}"
-  callback = node.on_token.register(callback_id)
+  subscription = node.token_router.subscribe(request_id)
   if topology_viz:
     topology_viz.update_prompt(request_id, prompt)
   prompt = tokenizer.apply_chat_template([{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True)
@@ -254,10 +282,10 @@ async def run_model_cli(node: Node, model_name: str, prompt: str):
     await node.process_prompt(shard, prompt, request_id=request_id)
 
     tokens = []
-    def on_token(_request_id, _tokens, _is_finished):
+    is_finished = False
+    while not is_finished:
+      _tokens, is_finished = await subscription.get(timeout=300)
       tokens.extend(_tokens)
-      return _request_id == request_id and _is_finished
-    await callback.wait(on_token, timeout=300)
 
     print("\nGenerated response:")
     print(tokenizer.decode(tokens))
@@ -265,7 +293,7 @@ async def run_model_cli(node: Node, model_name: str, prompt: str):
     print(f"Error processing prompt: {str(e)}")
     traceback.print_exc()
   finally:
-    node.on_token.deregister(callback_id)
+    node.token_router.unsubscribe(request_id)
 
 
 def clean_path(path):
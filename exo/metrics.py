@@ -0,0 +1,133 @@
+"""
+Prometheus metrics, served by the ChatGPT API at /metrics
+
+Latencies, token counts, gRPC traffic and download progress are recorded
+where they happen into REGISTRY. Queue depth and KV cache memory are read
+from the node when scraped, see NodeCollector.
+"""
+import time
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+REGISTRY = CollectorRegistry()
+
+# from a few ms for a decode step up to a long prefill or a slow first token
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+TIME_TO_FIRST_TOKEN = Histogram(
+  "exo_time_to_first_token_seconds", "Time from receiving a chat request to its first generated token", ["model", "node"], buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+INTER_TOKEN_LATENCY = Histogram(
+  "exo_inter_token_latency_seconds", "Time between consecutive tokens of a chat request", ["model", "node"], buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+GENERATED_TOKENS = Counter("exo_generated_tokens", "Tokens sampled on this node", ["model", "node"], registry=REGISTRY)
+SHARD_FORWARD_SECONDS = Histogram(
+  "exo_shard_forward_seconds", "Time of one forward pass over this node's shard", ["model", "node", "kind"], buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+GRPC_HOP_SECONDS = Histogram(
+  "exo_grpc_hop_seconds", "Time to hand a tensor to the next peer, until it is acked", ["model", "peer"], buckets=LATENCY_BUCKETS, registry=REGISTRY
+)
+GRPC_SENT_BYTES = Counter("exo_grpc_sent_bytes", "Tensor bytes sent to peers", ["model", "peer"], registry=REGISTRY)
+DOWNLOADED_BYTES = Gauge("exo_download_downloaded_bytes", "Bytes of a model downloaded so far", ["model", "node"], registry=REGISTRY)
+DOWNLOAD_SPEED = Gauge("exo_download_speed_bytes_per_second", "Current download throughput of a model", ["model", "node"], registry=REGISTRY)
+
+
+class TokenTimer:
+  """
+  Records time to first token and inter-token latency of one request as its tokens arrive.
+  """
+  def __init__(self, model: str, node: str, started_at: Optional[float] = None):
+    self.model = model
+    self.node = node
+    self.started_at = time.perf_counter() if started_at is None else started_at
+    self.last_token_at: Optional[float] = None
+
+  def tokens(self, n: int) -> None:
+    if n <= 0: return
+    now = time.perf_counter()
+    if self.last_token_at is None:
+      TIME_TO_FIRST_TOKEN.labels(model=self.model, node=self.node).observe(now - self.started_at)
+    else:
+      # tokens that arrive together share the gap since the last ones
+      gap = (now - self.last_token_at)/n
+      histogram = INTER_TOKEN_LATENCY.labels(model=self.model, node=self.node)
+      for _ in range(n): histogram.observe(gap)
+    self.last_token_at = now
+
+
+class NodeCollector(Collector):
+  """
+  Gauges read from a node and the API's admission controller at scrape time.
+  """
+  # inference engine stats exported as gauges
+  ENGINE_STATS = {
+    "used_bytes": ("exo_kv_cache_used_bytes", "KV cache memory in use"),
+    "total_bytes": ("exo_kv_cache_total_bytes", "KV cache memory reserved"),
+    "utilization": ("exo_kv_cache_utilization", "Fraction of allocated KV cache slots holding tokens"),
+    "prefix_hit_rate": ("exo_prefix_cache_hit_rate", "Fraction of prompts that reused a cached prefix"),
+    "prefix_bytes": ("exo_prefix_cache_bytes", "Memory held by cached prefixes, KV blocks and hidden states"),
+  }
+
+  # topology gossip convergence
+  GOSSIP_STATS = {
+    "records": ("exo_gossip_known_records", "Node records held in the topology gossip state"),
+    "converged_peers": ("exo_gossip_converged_peers", "Fraction of gossip peers that held all our records at the last exchange"),
+    "seconds_since_change": ("exo_gossip_seconds_since_change", "Seconds since the gossip state last changed"),
+  }
+  GOSSIP_COUNTERS = {
+    "rounds": ("exo_gossip_rounds", "Gossip rounds started by the node"),
+    "records_sent": ("exo_gossip_records_sent", "Node records sent in gossip rounds"),
+    "records_received": ("exo_gossip_records_received", "Newer node records received in gossip rounds"),
+  }
+
+  def __init__(self, node, admission=None):
+    self.node = node
+    self.admission = admission
+
+  def collect(self):
+    node_id = self.node.id
+    queue_depth = GaugeMetricFamily("exo_queue_depth", "Requests waiting for admission or for an inference step", labels=["node", "queue"])
+    queue_depth.add_metric([node_id, "scheduler"], self.node.batch_scheduler.queue_depth)
+    if self.admission is not None:
+      stats = self.admission.stats()
+      queue_depth.add_metric([node_id, "admission"], stats["queue_depth"])
+      yield self._gauge("exo_requests_in_flight", "Requests admitted and running", ["node"], [node_id], stats["in_flight"])
+    yield queue_depth
+
+    yield self._gauge("exo_topology_version", "Version of the node's current topology", ["node"], [node_id], self.node.topology.version)
+    gossip = self.node.gossip.stats()
+    for key, (name, documentation) in self.GOSSIP_STATS.items():
+      yield self._gauge(name, documentation, ["node"], [node_id], gossip[key])
+    for key, (name, documentation) in self.GOSSIP_COUNTERS.items():
+      counter = CounterMetricFamily(name, documentation, labels=["node"])
+      counter.add_metric([node_id], gossip[key])
+      yield counter
+
+    latency = GaugeMetricFamily("exo_link_latency_seconds", "Measured round trip time to each peer", labels=["node", "peer"])
+    bandwidth = GaugeMetricFamily("exo_link_bandwidth_bytes_per_second", "Measured throughput to each peer", labels=["node", "peer"])
+    for peer_id, (peer_latency, peer_bandwidth) in self.node.link_prober.stats().items():
+      latency.add_metric([node_id, peer_id], peer_latency)
+      bandwidth.add_metric([node_id, peer_id], peer_bandwidth)
+    yield latency
+    yield bandwidth
+
+    engine = self.node.inference_engine
+    shard = getattr(engine, "shard", None)
+    if shard is None: return
+    stats = engine.stats()
+    for key, (name, documentation) in self.ENGINE_STATS.items():
+      if key in stats:
+        yield self._gauge(name, documentation, ["model", "node"], [shard.model_id, node_id], stats[key])
+
+  @staticmethod
+  def _gauge(name, documentation, labels, values, value) -> GaugeMetricFamily:
+    gauge = GaugeMetricFamily(name, documentation, labels=labels)
+    gauge.add_metric(values, value)
+    return gauge
+
+
+def render(*registries: CollectorRegistry) -> bytes:
+  return b"".join(generate_latest(registry) for registry in (REGISTRY, *registries))
@@ -1,7 +1,8 @@
 import grpc
 import numpy as np
 import asyncio
-from typing import Optional, Tuple, List
+from typing import AsyncIterator, Callable, Coroutine, Deque, Dict, Optional, Tuple, List
+from collections import deque
 
 from . import node_service_pb2
 from . import node_service_pb2_grpc
@@ -9,10 +10,17 @@ from . import node_service_pb2_grpc
 from ..peer_handle import PeerHandle
 from exo.inference.shard import Shard
 from exo.topology.topology import Topology
+from exo.topology.gossip import Edge, NodeRecord
 from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+from exo.networking.compression import CompressionPolicy
+from exo.networking.quantization import negotiate_wire_format, quantize
 from exo.helpers import DEBUG
+from exo.metrics import GRPC_HOP_SECONDS, GRPC_SENT_BYTES
+import itertools
 import json
 import platform
+import random
+import time
 
 if platform.system().lower() == "darwin" and platform.machine().lower() == "arm64":
   import mlx.core as mx
@@ -21,15 +29,39 @@ else:
   import numpy as mx
   IS_APPLE = False
 
+# frames at least this big are used to measure link bandwidth
+BANDWIDTH_SAMPLE_BYTES = 64*1024
+# longest a send waits on an ack that may have been lost before it goes anyway
+CREDIT_WAIT_SECONDS = 1.0
+# longest a unary SendTensor may take, the peer runs its step before acking
+SEND_TENSOR_TIMEOUT = 120.0
+
 
 class GRPCPeerHandle(PeerHandle):
-  def __init__(self, _id: str, address: str, desc: str, device_capabilities: DeviceCapabilities):
+  def __init__(
+    self,
+    _id: str,
+    address: str,
+    desc: str,
+    device_capabilities: DeviceCapabilities,
+    compression: Optional[CompressionPolicy] = None,
+    activation_format: str = "none"
+  ):
     self._id = _id
     self.address = address
     self.desc = desc
     self._device_capabilities = device_capabilities
     self.channel = None
     self.stub = None
+    self.compression = compression or CompressionPolicy()
+    self.activation_format = activation_format
+    # wire formats the peer can decode, None until its first health check
+    self.peer_wire_formats: Optional[List[str]] = None
+    self.tensor_streams: Dict[str, TensorStream] = {}
+    self.use_tensor_streams = True
+    self.credit_window = CreditWindow()
+    # random start so frames of the same request from different senders never share an id
+    self.frame_ids = itertools.count(random.getrandbits(62) + 1)
     self.channel_options = [
       ("grpc.max_metadata_size", 32 * 1024 * 1024),
       ("grpc.max_receive_message_length", 256 * 1024 * 1024),
@@ -61,7 +93,6 @@ class GRPCPeerHandle(PeerHandle):
     self.channel = grpc.aio.insecure_channel(
       self.address,
       options=self.channel_options,
-      compression=grpc.Compression.Gzip
     )
     self.stub = node_service_pb2_grpc.NodeServiceStub(self.channel)
     await asyncio.wait_for(self.channel.channel_ready(), timeout=10.0)
@@ -70,6 +101,10 @@ class GRPCPeerHandle(PeerHandle):
     return self.channel is not None and self.channel.get_state() == grpc.ChannelConnectivity.READY
 
   async def disconnect(self):
+    for stream in self.tensor_streams.values():
+      await stream.close()
+    self.tensor_streams.clear()
+    self.credit_window.reset()
     if self.channel:
       await self.channel.close()
     self.channel = None
@@ -89,17 +124,23 @@ class GRPCPeerHandle(PeerHandle):
       await self._ensure_connected()
       request = node_service_pb2.HealthCheckRequest()
       response = await asyncio.wait_for(self.stub.HealthCheck(request), timeout=5)
+      self.peer_wire_formats = list(response.wire_formats)
+      self.compression.peer_codecs = list(response.codecs)
       return response.is_healthy
     except asyncio.TimeoutError:
-      return False
+      pass
     except Exception:
       if DEBUG >= 4:
         print(f"Health check failed for {self._id}@{self.address}.")
         import traceback
         traceback.print_exc()
-      return False
+    # what the peer decodes is unknown until a health check succeeds again,
+    # tensors go at full precision and uncompressed meanwhile
+    self.peer_wire_formats = []
+    self.compression.peer_codecs = []
+    return False
 
-  async def send_prompt(self, shard: Shard, prompt: str, inference_state: Optional[dict] = None, request_id: Optional[str] = None) -> Optional[np.array]:
+  async def send_prompt(self, shard: Shard, prompt: str, inference_state: Optional[dict] = None, request_id: Optional[str] = None, origin_node_id: str = "") -> Optional[np.array]:
     await self._ensure_connected()
     request = node_service_pb2.PromptRequest(
       prompt=prompt,
@@ -110,11 +151,18 @@ class GRPCPeerHandle(PeerHandle):
         n_layers=shard.n_layers,
       ),
       request_id=request_id,
-      inference_state=None if inference_state is None else self.serialize_inference_state(inference_state)
+      inference_state=None if inference_state is None else self.serialize_inference_state(inference_state),
+      origin_node_id=origin_node_id
     )
-    await self.stub.SendPrompt(request)
+    await self.credit_window.acquire()
+    try:
+      ack = await self.stub.SendPrompt(request)
+    except BaseException:
+      self.credit_window.reset()
+      raise
+    self.on_ack(ack)
 
-  async def send_tensor(self, shard: Shard, tensor: np.ndarray, inference_state: Optional[dict] = None, request_id: Optional[str] = None) -> Optional[np.array]:
+  async def send_tensor(self, shard: Shard, tensor: np.ndarray, inference_state: Optional[dict] = None, request_id: Optional[str] = None, origin_node_id: str = "") -> Optional[np.array]:
     await self._ensure_connected()
     request = node_service_pb2.TensorRequest(
       shard=node_service_pb2.Shard(
@@ -123,17 +171,66 @@ class GRPCPeerHandle(PeerHandle):
         end_layer=shard.end_layer,
         n_layers=shard.n_layers,
       ),
-      tensor=node_service_pb2.Tensor(tensor_data=tensor.tobytes(), shape=tensor.shape, dtype=str(tensor.dtype)),
+      tensor=self.serialize_tensor(tensor, self.wire_format_for(tensor)),
       request_id=request_id,
-      inference_state=None if inference_state is None else self.serialize_inference_state(inference_state)
+      inference_state=None if inference_state is None else self.serialize_inference_state(inference_state),
+      origin_node_id=origin_node_id,
+      frame_id=next(self.frame_ids),
     )
 
-    response = await self.stub.SendTensor(request)
-
-    if not response.tensor_data or not response.shape or not response.dtype:
+    GRPC_SENT_BYTES.labels(model=shard.model_id, peer=self._id).inc(request.tensor.ByteSize())
+    await self.credit_window.acquire()
+    if self.use_tensor_streams and await self.stream_tensor(shard.model_id, request):
       return None
 
-    return np.frombuffer(response.tensor_data, dtype=np.dtype(response.dtype)).reshape(response.shape)
+    await self._send_tensor_unary(request)
+    return None
+
+  async def _send_tensor_unary(self, request: node_service_pb2.TensorRequest) -> None:
+    start = time.perf_counter()
+    try:
+      ack = await asyncio.wait_for(self.stub.SendTensor(request), timeout=SEND_TENSOR_TIMEOUT)
+    except BaseException:
+      self.credit_window.reset()
+      raise
+    GRPC_HOP_SECONDS.labels(model=request.shard.model_id, peer=self._id).observe(time.perf_counter() - start)
+    self.on_ack(ack)
+
+  def on_ack(self, ack: node_service_pb2.TensorAck) -> None:
+    if ack.error and DEBUG >= 1: print(f"Peer {self._id}@{self.address} failed {ack.request_id}: {ack.error}")
+    if DEBUG >= 5: print(f"Ack from {self._id} {ack.request_id=} {ack.queue_position=} {ack.credits=} {ack.elapsed_ns=}")
+    self.credit_window.update(ack.credits)
+
+  async def stream_tensor(self, model_id: str, request: node_service_pb2.TensorRequest) -> bool:
+    """
+    Write request to the long-lived tensor stream for model_id, opening it on
+    first use. Returns False if the frame has to go over a unary SendTensor.
+    """
+    stream = self.tensor_streams.get(model_id)
+    if stream is None or stream.done():
+      stream = self.tensor_streams[model_id] = TensorStream(self.stub.StreamTensors(), self._on_stream_closed, self.compression, peer_id=self._id, on_ack=self.on_ack)
+    try:
+      await stream.write(request)
+      return True
+    except (grpc.aio.AioRpcError, asyncio.InvalidStateError) as e:
+      if DEBUG >= 2: print(f"Tensor stream to {self._id}@{self.address} failed, falling back to SendTensor: {e}")
+      self.tensor_streams.pop(model_id, None)
+      return False
+
+  async def _on_stream_closed(self, code: grpc.StatusCode, pending: List[node_service_pb2.TensorRequest]):
+    # acks of the closed stream are never coming
+    self.credit_window.reset()
+    if code == grpc.StatusCode.UNIMPLEMENTED:
+      if DEBUG >= 1: print(f"Peer {self._id}@{self.address} does not support StreamTensors, using SendTensor")
+      self.use_tensor_streams = False
+    # frames the peer never acked are resent so no hop is lost with the stream,
+    # the peer drops those it had already dispatched by their frame_id
+    for request in pending:
+      try:
+        await self.credit_window.acquire()
+        await self._send_tensor_unary(request)
+      except Exception as e:
+        if DEBUG >= 1: print(f"Failed to resend frame {request.frame_id} of {request.request_id} to {self._id}@{self.address}: {e!r}")
 
   async def send_example(self, shard: Shard, example: np.ndarray, target: np.ndarray, length: np.ndarray, train: bool, request_id: Optional[str] = None) -> Optional[np.array]:
     await self._ensure_connected()
@@ -144,9 +241,9 @@ class GRPCPeerHandle(PeerHandle):
         end_layer=shard.end_layer,
         n_layers=shard.n_layers,
       ),
-      example=node_service_pb2.Tensor(tensor_data=example.tobytes(), shape=example.shape, dtype=str(example.dtype)),
-      target=node_service_pb2.Tensor(tensor_data=target.tobytes(), shape=target.shape, dtype=str(target.dtype)),
-      length=node_service_pb2.Tensor(tensor_data=length.tobytes(), shape=length.shape, dtype=str(length.dtype)),
+      example=self.serialize_tensor(example),
+      target=self.serialize_tensor(target),
+      length=self.serialize_tensor(length),
       train=train,
       request_id=request_id,
     )
@@ -167,7 +264,7 @@ class GRPCPeerHandle(PeerHandle):
         end_layer=shard.end_layer,
         n_layers=shard.n_layers,
       ),
-      tensor=node_service_pb2.Tensor(tensor_data=tensor.tobytes(), shape=tensor.shape, dtype=str(tensor.dtype)),
+      tensor=self.serialize_tensor(tensor),
       request_id=request_id,
     )
     response = await self.stub.SendLoss(request)
@@ -183,20 +280,59 @@ class GRPCPeerHandle(PeerHandle):
     response = await self.stub.CollectTopology(request)
     topology = Topology()
     for node_id, capabilities in response.nodes.items():
-      device_capabilities = DeviceCapabilities(
-        model=capabilities.model, chip=capabilities.chip, memory=capabilities.memory, flops=DeviceFlops(fp16=capabilities.flops.fp16, fp32=capabilities.flops.fp32, int8=capabilities.flops.int8)
-      )
-      topology.update_node(node_id, device_capabilities)
+      topology.update_node(node_id, device_capabilities_from_proto(capabilities))
     for node_id, peer_connections in response.peer_graph.items():
       for conn in peer_connections.connections:
-        topology.add_edge(node_id, conn.to_id, conn.description)
+        topology.add_edge(node_id, *edge_from_proto(conn))
     return topology
 
+  async def gossip_topology(self, from_id: str, digest: Dict[str, int], records: List[NodeRecord]) -> Tuple[Dict[str, int], List[NodeRecord]]:
+    await self._ensure_connected()
+    request = node_service_pb2.GossipMessage(from_id=from_id, digest=digest, records=[node_record_to_proto(record) for record in records])
+    try:
+      response = await asyncio.wait_for(self.stub.GossipTopology(request), timeout=5.0)
+    except grpc.aio.AioRpcError as e:
+      if e.code() == grpc.StatusCode.UNIMPLEMENTED: raise NotImplementedError(f"{self._id} does not gossip") from e
+      raise
+    return dict(response.digest), [node_record_from_proto(record) for record in response.records]
+
+  async def probe_link(self, nbytes: int) -> float:
+    await self._ensure_connected()
+    request = node_service_pb2.LinkProbe(payload=bytes(nbytes))
+    start_time = time.perf_counter()
+    try:
+      await asyncio.wait_for(self.stub.ProbeLink(request), timeout=30.0)
+    except grpc.aio.AioRpcError as e:
+      if e.code() == grpc.StatusCode.UNIMPLEMENTED: raise NotImplementedError(f"{self._id} does not answer link probes") from e
+      raise
+    return time.perf_counter() - start_time
+
+  async def list_repo_files(self, repo_id: str) -> Dict[str, int]:
+    await self._ensure_connected()
+    try:
+      response = await asyncio.wait_for(self.stub.ListRepoFiles(node_service_pb2.RepoFilesRequest(repo_id=repo_id)), timeout=10.0)
+    except grpc.aio.AioRpcError as e:
+      if e.code() == grpc.StatusCode.UNIMPLEMENTED: raise NotImplementedError(f"{self._id} does not share model files") from e
+      raise
+    return dict(response.files)
+
+  async def read_repo_file(self, repo_id: str, path: str, offset: int = 0) -> AsyncIterator[bytes]:
+    await self._ensure_connected()
+    call = self.stub.ReadRepoFile(node_service_pb2.ReadRepoFileRequest(repo_id=repo_id, path=path, offset=offset))
+    try:
+      async for chunk in call:
+        yield chunk.data
+    except grpc.aio.AioRpcError as e:
+      if e.code() == grpc.StatusCode.NOT_FOUND: raise FileNotFoundError(f"{self._id} does not have {repo_id}/{path}") from e
+      raise
+    finally:
+      call.cancel()
+
   async def send_result(self, request_id: str, result: List[int], is_finished: bool) -> None:
     await self._ensure_connected()
     tensor = None
     if isinstance(result, np.ndarray):
-      tensor = node_service_pb2.Tensor(tensor_data=result.tobytes(), shape=result.shape, dtype=str(result.dtype))
+      tensor = self.serialize_tensor(result)
       result = []
     request = node_service_pb2.SendResultRequest(request_id=request_id, result=result, tensor=tensor, is_finished=is_finished)
     await self.stub.SendResult(request)
@@ -206,21 +342,36 @@ class GRPCPeerHandle(PeerHandle):
     request = node_service_pb2.SendOpaqueStatusRequest(request_id=request_id, status=status)
     await asyncio.wait_for(self.stub.SendOpaqueStatus(request), timeout=10.0)
 
+  def wire_format_for(self, tensor: np.ndarray) -> str:
+    # only hidden states between shards are sent at reduced precision, tokens and logits never are
+    if self.activation_format == "none" or tensor.ndim != 3 or tensor.dtype.kind != "f":
+      return "none"
+    # full precision until a health check from discovery has told what the peer decodes
+    return negotiate_wire_format(self.activation_format, self.peer_wire_formats)
+
+  def serialize_tensor(self, array: np.ndarray, wire_format: str = "none") -> node_service_pb2.Tensor:
+    encoded, scales = quantize(array, wire_format)
+    tensor_data, compression = self.compression.compress(encoded.tobytes(), array.dtype)
+    return node_service_pb2.Tensor(
+      tensor_data=tensor_data,
+      shape=list(array.shape),
+      dtype=str(array.dtype),
+      compression=compression,
+      quantization="" if wire_format == "none" else wire_format,
+      scales=scales.tobytes() if scales is not None else b"",
+    )
+
   def serialize_inference_state(self, inference_state: dict) -> node_service_pb2.InferenceState:
     proto_inference_state = node_service_pb2.InferenceState()
     other_data = {}
     for k, v in inference_state.items():
       mx_array_type = mx.array if IS_APPLE else mx.ndarray
-      if isinstance(v, mx_array_type):
-        np_array = np.array(v)
-        tensor_data = node_service_pb2.Tensor(tensor_data=np_array.tobytes(), shape=list(np_array.shape), dtype=str(np_array.dtype))
-        proto_inference_state.tensor_data[k].CopyFrom(tensor_data)
+      if isinstance(v, (mx_array_type, np.ndarray)):
+        proto_inference_state.tensor_data[k].CopyFrom(self.serialize_tensor(np.array(v)))
       elif isinstance(v, list) and all(isinstance(item, mx_array_type) for item in v):
         tensor_list = node_service_pb2.TensorList()
         for tensor in v:
-          np_array = np.array(tensor)
-          tensor_data = node_service_pb2.Tensor(tensor_data=np_array.tobytes(), shape=list(np_array.shape), dtype=str(np_array.dtype))
-          tensor_list.tensors.append(tensor_data)
+          tensor_list.tensors.append(self.serialize_tensor(np.array(tensor)))
         proto_inference_state.tensor_list_data[k].CopyFrom(tensor_list)
       else:
         # For non-tensor data, we'll still use JSON
@@ -228,3 +379,155 @@ class GRPCPeerHandle(PeerHandle):
     if other_data:
       proto_inference_state.other_data_json = json.dumps(other_data)
     return proto_inference_state
+
+
+def device_capabilities_to_proto(capabilities: DeviceCapabilities) -> node_service_pb2.DeviceCapabilities:
+  return node_service_pb2.DeviceCapabilities(
+    model=capabilities.model,
+    chip=capabilities.chip,
+    memory=capabilities.memory,
+    flops=node_service_pb2.DeviceFlops(fp32=capabilities.flops.fp32, fp16=capabilities.flops.fp16, int8=capabilities.flops.int8),
+  )
+
+
+def device_capabilities_from_proto(capabilities: node_service_pb2.DeviceCapabilities) -> DeviceCapabilities:
+  return DeviceCapabilities(
+    model=capabilities.model, chip=capabilities.chip, memory=capabilities.memory, flops=DeviceFlops(fp16=capabilities.flops.fp16, fp32=capabilities.flops.fp32, int8=capabilities.flops.int8)
+  )
+
+
+def node_record_to_proto(record: NodeRecord) -> node_service_pb2.NodeRecord:
+  return node_service_pb2.NodeRecord(
+    node_id=record.node_id,
+    version=record.version,
+    device_capabilities=device_capabilities_to_proto(record.device_capabilities),
+    edges=[edge_to_proto(edge) for edge in record.edges],
+  )
+
+
+def node_record_from_proto(record: node_service_pb2.NodeRecord) -> NodeRecord:
+  return NodeRecord(record.node_id, record.version, device_capabilities_from_proto(record.device_capabilities), [edge_from_proto(edge) for edge in record.edges])
+
+
+def edge_to_proto(edge: Edge) -> node_service_pb2.PeerConnection:
+  return node_service_pb2.PeerConnection(to_id=edge.to_id, description=edge.description, latency=edge.latency, bandwidth=edge.bandwidth)
+
+
+def edge_from_proto(conn: node_service_pb2.PeerConnection) -> Edge:
+  return Edge(
+    conn.to_id,
+    conn.description if conn.HasField("description") else None,
+    conn.latency if conn.HasField("latency") else None,
+    conn.bandwidth if conn.HasField("bandwidth") else None,
+  )
+
+
+class TensorStream:
+  """
+  Client side of a StreamTensors call. Frames are written in order and kept
+  until the peer acks them; if the call ends early the unacked frames are
+  handed to on_closed so they can be resent another way. Ack times are
+  recorded as hop latency, and those of large frames feed the link bandwidth
+  estimate of the compression policy.
+  """
+  def __init__(
+    self,
+    call: grpc.aio.StreamStreamCall,
+    on_closed: Callable[[grpc.StatusCode, List[node_service_pb2.TensorRequest]], Coroutine],
+    compression: Optional[CompressionPolicy] = None,
+    peer_id: str = "",
+    on_ack: Optional[Callable[[node_service_pb2.TensorAck], None]] = None
+  ):
+    self.call = call
+    self.on_closed = on_closed
+    self.compression = compression
+    self.peer_id = peer_id
+    self.on_ack = on_ack
+    self.pending: Deque[Tuple[node_service_pb2.TensorRequest, float]] = deque()
+    self.write_lock = asyncio.Lock()
+    self.ack_task = asyncio.create_task(self._read_acks())
+
+  def done(self) -> bool:
+    return self.call.done()
+
+  async def write(self, request: node_service_pb2.TensorRequest) -> None:
+    async with self.write_lock:
+      self.pending.append((request, time.perf_counter()))
+      try:
+        await self.call.write(request)
+      except BaseException:
+        self.pending.pop()
+        raise
+
+  async def _read_acks(self) -> None:
+    code = grpc.StatusCode.OK
+    try:
+      async for ack in self.call:
+        if not self.pending: continue
+        request, sent_at = self.pending.popleft()
+        GRPC_HOP_SECONDS.labels(model=request.shard.model_id, peer=self.peer_id).observe(time.perf_counter() - sent_at)
+        # large frames are dominated by transfer time, so their round trip measures the link
+        nbytes = request.tensor.ByteSize()
+        if self.compression is not None and nbytes >= BANDWIDTH_SAMPLE_BYTES:
+          self.compression.observe_bandwidth(nbytes, time.perf_counter() - sent_at)
+        if DEBUG >= 5: print(f"TensorStream ack {ack.seq} {ack.request_id=}")
+        if self.on_ack is not None: self.on_ack(ack)
+    except grpc.aio.AioRpcError as e:
+      code = e.code()
+    except asyncio.CancelledError:
+      return
+    if code == grpc.StatusCode.CANCELLED:
+      return
+    pending, self.pending = [request for request, _ in self.pending], deque()
+    if pending or code != grpc.StatusCode.OK:
+      if DEBUG >= 2: print(f"TensorStream closed with {code}, resending {len(pending)} unacked frames")
+      try:
+        await self.on_closed(code, pending)
+      except Exception as e:
+        if DEBUG >= 1: print(f"Failed to resend {len(pending)} tensor frames: {e}")
+
+  async def close(self) -> None:
+    if not self.call.done():
+      self.call.cancel()
+    self.ack_task.cancel()
+
+
+class CreditWindow:
+  """
+  Sender side of credit based flow control. Every ack says how many more
+  frames the peer wants right now; frames sent since then and not yet acked
+  use those credits up, and further sends wait for the next ack. A peer out of
+  credits still gets one frame at a time, credits only change with acks and
+  the ack of that frame is what tells the sender once the peer's queue has
+  drained. Until the first ack, and if none comes within CREDIT_WAIT_SECONDS,
+  sends go ahead so a lost ack can never stall the ring.
+  """
+  def __init__(self, max_wait: float = CREDIT_WAIT_SECONDS):
+    self.max_wait = max_wait
+    self.credits: Optional[int] = None
+    self.in_flight = 0
+    self.changed = asyncio.Event()
+
+  async def acquire(self) -> None:
+    deadline = time.perf_counter() + self.max_wait
+    while self.credits is not None and self.in_flight >= max(self.credits, 1):
+      remaining = deadline - time.perf_counter()
+      if remaining <= 0:
+        if DEBUG >= 2: print(f"No credits after {self.max_wait}s with {self.in_flight} frames in flight, sending anyway")
+        break
+      self.changed.clear()
+      try:
+        await asyncio.wait_for(self.changed.wait(), remaining)
+      except asyncio.TimeoutError:
+        pass
+    self.in_flight += 1
+
+  def update(self, credits: int) -> None:
+    self.in_flight = max(0, self.in_flight - 1)
+    self.credits = credits
+    self.changed.set()
+
+  def reset(self) -> None:
+    self.in_flight = 0
+    self.credits = None
+    self.changed.set()
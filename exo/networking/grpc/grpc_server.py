@@ -1,7 +1,10 @@
 import grpc
 from concurrent import futures
 import numpy as np
+import asyncio
 from asyncio import CancelledError
+from collections import OrderedDict
+from typing import Optional, Tuple
 
 import platform
 
@@ -10,12 +13,26 @@ from . import node_service_pb2_grpc
 from exo import DEBUG
 from exo.inference.shard import Shard
 from exo.orchestration import Node
+from exo.networking.compression import SUPPORTED_CODECS, CompressionPolicy
+from .grpc_peer_handle import device_capabilities_to_proto, edge_to_proto, node_record_from_proto, node_record_to_proto
+from exo.topology.gossip import Edge
+from exo.networking.quantization import WIRE_DTYPES, WIRE_FORMATS, dequantize
+from exo.download.new_shard_download import ensure_downloads_dir
+from exo.download.peer_files import local_repo_file, local_repo_files, read_file_chunks
 import json
+import time
+import traceback
 
 if platform.system().lower() == "darwin" and platform.machine().lower() == "arm64":
   import mlx.core as mx
+  # mlx needs its own copy, everywhere else the received buffer is used as is
+  to_array = mx.array
 else:
   import numpy as mx
+  to_array = np.asarray
+
+# how many recently dispatched frames are remembered to drop resends of
+DISPATCHED_FRAMES = 4096
 
 
 class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
@@ -24,6 +41,9 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
     self.host = host
     self.port = port
     self.server = None
+    self.stream_tasks = set()
+    self.compression = CompressionPolicy()
+    self.dispatched_frames: OrderedDict[Tuple[str, int], None] = OrderedDict()
 
   async def start(self) -> None:
     self.server = grpc.aio.server(
@@ -69,27 +89,74 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
     prompt = request.prompt
     request_id = request.request_id
     inference_state = None if request.inference_state is None else self.deserialize_inference_state(request.inference_state)
-    result = await self.node.process_prompt(shard, prompt, request_id, inference_state)
-    if DEBUG >= 5: print(f"SendPrompt {shard=} {prompt=} {request_id=} result: {result}")
-    tensor_data = result.tobytes() if result is not None else None
-    return node_service_pb2.Tensor(tensor_data=tensor_data, shape=result.shape, dtype=str(result.dtype)) if result is not None else node_service_pb2.Tensor()
+    if DEBUG >= 5: print(f"SendPrompt {shard=} {prompt=} {request_id=}")
+    return await self.run_and_ack(request_id, self.node.process_prompt(shard, prompt, request_id, inference_state, origin_node_id=request.origin_node_id))
 
   async def SendTensor(self, request, context):
-    shard = Shard(
-      model_id=request.shard.model_id,
-      start_layer=request.shard.start_layer,
-      end_layer=request.shard.end_layer,
-      n_layers=request.shard.n_layers,
-    )
-    tensor = np.frombuffer(request.tensor.tensor_data, dtype=np.dtype(request.tensor.dtype)).reshape(request.tensor.shape)
-    request_id = request.request_id
+    if not self.first_dispatch(request): return self.ack(request.request_id)
+    shard, tensor, request_id, inference_state = self.deserialize_tensor_request(request)
+    if DEBUG >= 5: print(f"SendTensor tensor {shard=} {tensor=} {request_id=}")
+    return await self.run_and_ack(request_id, self.node.process_tensor(shard, tensor, request_id, inference_state, origin_node_id=request.origin_node_id))
 
-    inference_state = None if request.inference_state is None else self.deserialize_inference_state(request.inference_state)
+  async def run_and_ack(self, request_id: str, step) -> node_service_pb2.TensorAck:
+    """
+    Run this node's step of a request and answer with a fixed-size ack. The
+    sender never needs the step's output, which goes on to the next node.
+    """
+    start_time = time.perf_counter_ns()
+    error = ""
+    try:
+      await step
+    except Exception as e:
+      if DEBUG >= 2: traceback.print_exc()
+      error = str(e)
+    return self.ack(request_id, elapsed_ns=time.perf_counter_ns() - start_time, error=error)
 
-    result = await self.node.process_tensor(shard, tensor, request_id, inference_state)
-    if DEBUG >= 5: print(f"SendTensor tensor {shard=} {tensor=} {request_id=} result: {result}")
-    tensor_data = result.tobytes() if result is not None else None
-    return node_service_pb2.Tensor(tensor_data=tensor_data, shape=result.shape, dtype=str(result.dtype)) if result is not None else node_service_pb2.Tensor()
+  def first_dispatch(self, request: node_service_pb2.TensorRequest) -> bool:
+    """
+    Whether a tensor frame has not been dispatched yet. A frame can be dispatched
+    and its stream close before the ack goes out, the sender then resends it and
+    running it again would repeat the decode step.
+    """
+    if not request.frame_id: return True
+    key = (request.request_id, request.frame_id)
+    if key in self.dispatched_frames:
+      if DEBUG >= 2: print(f"Dropping resent frame {request.frame_id} of {request.request_id}, it was already dispatched")
+      return False
+    self.dispatched_frames[key] = None
+    if len(self.dispatched_frames) > DISPATCHED_FRAMES: self.dispatched_frames.popitem(last=False)
+    return True
+
+  def ack(self, request_id: str, seq: int = 0, elapsed_ns: int = 0, error: str = "") -> node_service_pb2.TensorAck:
+    scheduler = self.node.batch_scheduler
+    return node_service_pb2.TensorAck(
+      request_id=request_id,
+      seq=seq,
+      error=error,
+      queue_position=scheduler.queue_depth,
+      credits=scheduler.credits,
+      elapsed_ns=elapsed_ns,
+    )
+
+  async def StreamTensors(self, request_iterator, context):
+    """
+    Long-lived stream of tensor frames from one upstream peer. Each frame is
+    acked as soon as it is handed to the node, so the sender pays for one
+    message write per hop instead of waiting on the rest of the ring. Acks
+    carry the node's free credits so the sender can hold off when it is busy.
+    """
+    seq = 0
+    async for request in request_iterator:
+      if self.first_dispatch(request):
+        shard, tensor, request_id, inference_state = self.deserialize_tensor_request(request)
+        if DEBUG >= 5: print(f"StreamTensors frame {seq} {shard=} {tensor.shape=} {request_id=}")
+        task = asyncio.create_task(self.node.process_tensor(shard, tensor, request_id, inference_state, origin_node_id=request.origin_node_id))
+        self.stream_tasks.add(task)
+        task.add_done_callback(self.stream_tasks.discard)
+        # let the frame reach the scheduler so the credits in its ack count it
+        await asyncio.sleep(0)
+      yield self.ack(request.request_id, seq)
+      seq += 1
 
   async def SendExample(self, request, context):
     shard = Shard(
@@ -98,9 +165,9 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
       end_layer=request.shard.end_layer,
       n_layers=request.shard.n_layers,
     )
-    example = np.frombuffer(request.example.tensor_data, dtype=np.dtype(request.example.dtype)).reshape(request.example.shape)
-    target = np.frombuffer(request.target.tensor_data, dtype=np.dtype(request.target.dtype)).reshape(request.target.shape)
-    length = np.frombuffer(request.length.tensor_data, dtype=np.dtype(request.length.dtype)).reshape(request.length.shape)
+    example = self.deserialize_tensor(request.example)
+    target = self.deserialize_tensor(request.target)
+    length = self.deserialize_tensor(request.length)
     train = request.train
     request_id = request.request_id
 
@@ -117,23 +184,19 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
     max_depth = request.max_depth
     visited = set(request.visited)
     topology = self.node.current_topology
-    nodes = {
-      node_id:
-        node_service_pb2.DeviceCapabilities(
-          model=cap.model,
-          chip=cap.chip,
-          memory=cap.memory,
-          flops=node_service_pb2.DeviceFlops(fp32=cap.flops.fp32, fp16=cap.flops.fp16, int8=cap.flops.int8),
-        )
-      for node_id, cap in topology.nodes.items()
-    }
+    nodes = {node_id: device_capabilities_to_proto(cap) for node_id, cap in topology.nodes.items()}
     peer_graph = {
-      node_id: node_service_pb2.PeerConnections(connections=[node_service_pb2.PeerConnection(to_id=conn.to_id, description=conn.description) for conn in connections])
+      node_id: node_service_pb2.PeerConnections(connections=[edge_to_proto(Edge(conn.to_id, conn.description, conn.latency, conn.bandwidth)) for conn in connections])
       for node_id, connections in topology.peer_graph.items()
     }
     if DEBUG >= 5: print(f"CollectTopology {max_depth=} {visited=} {nodes=} {peer_graph=}")
     return node_service_pb2.Topology(nodes=nodes, peer_graph=peer_graph)
 
+  async def GossipTopology(self, request, context):
+    digest, records = self.node.gossip.handle(request.from_id, dict(request.digest), [node_record_from_proto(record) for record in request.records])
+    if request.records: self.node.apply_gossip()
+    return node_service_pb2.GossipMessage(from_id=self.node.id, digest=digest, records=[node_record_to_proto(record) for record in records])
+
   async def SendResult(self, request, context):
     request_id = request.request_id
     result = request.result
@@ -142,8 +205,8 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
     if DEBUG >= 5: print(f"Received SendResult request: {request_id=} {result=} {is_finished=}")
     result = list(result)
     if len(img.tensor_data) > 0:
-      result = np.frombuffer(img.tensor_data, dtype=np.dtype(img.dtype)).reshape(img.shape)
-    self.node.on_token.trigger_all(request_id, result, is_finished)
+      result = self.deserialize_tensor(img)
+    self.node.trigger_on_token_callbacks(request_id, result, is_finished)
     return node_service_pb2.Empty()
 
   async def SendOpaqueStatus(self, request, context):
@@ -154,17 +217,50 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
     return node_service_pb2.Empty()
 
   async def HealthCheck(self, request, context):
-    return node_service_pb2.HealthCheckResponse(is_healthy=True)
+    return node_service_pb2.HealthCheckResponse(is_healthy=True, wire_formats=WIRE_FORMATS, codecs=SUPPORTED_CODECS)
+
+  async def ProbeLink(self, request, context):
+    # the payload only has to arrive, its size is what the prober measures with
+    return node_service_pb2.Empty()
+
+  async def ListRepoFiles(self, request, context):
+    return node_service_pb2.RepoFiles(files=await local_repo_files(await ensure_downloads_dir(), request.repo_id))
+
+  async def ReadRepoFile(self, request, context):
+    path = local_repo_file(await ensure_downloads_dir(), request.repo_id, request.path)
+    if path is None: await context.abort(grpc.StatusCode.NOT_FOUND, f"{request.repo_id}/{request.path} is not here")
+    if DEBUG >= 2: print(f"Sending {path} from byte {request.offset} to a peer")
+    async for chunk in read_file_chunks(path, request.offset):
+      yield node_service_pb2.FileChunk(data=chunk)
+
+  def deserialize_tensor(self, tensor: node_service_pb2.Tensor) -> np.ndarray:
+    tensor_data = self.compression.decompress(tensor.tensor_data, tensor.compression)
+    if not tensor.quantization:
+      return np.frombuffer(tensor_data, dtype=np.dtype(tensor.dtype)).reshape(tensor.shape)
+
+    encoded = np.frombuffer(tensor_data, dtype=WIRE_DTYPES[tensor.quantization]).reshape(tensor.shape)
+    scales = np.frombuffer(tensor.scales, dtype=np.float32).reshape(*tensor.shape[:-1], 1) if tensor.scales else None
+    return dequantize(encoded, tensor.quantization, np.dtype(tensor.dtype), scales)
+
+  def deserialize_tensor_request(self, request: node_service_pb2.TensorRequest) -> Tuple[Shard, np.ndarray, str, Optional[dict]]:
+    shard = Shard(
+      model_id=request.shard.model_id,
+      start_layer=request.shard.start_layer,
+      end_layer=request.shard.end_layer,
+      n_layers=request.shard.n_layers,
+    )
+    tensor = self.deserialize_tensor(request.tensor)
+    inference_state = None if request.inference_state is None else self.deserialize_inference_state(request.inference_state)
+    return shard, tensor, request.request_id, inference_state
 
   def deserialize_inference_state(self, inference_state_proto: node_service_pb2.InferenceState) -> dict:
     inference_state = {}
 
     for k, tensor_data in inference_state_proto.tensor_data.items():
-      np_array = np.frombuffer(tensor_data.tensor_data, dtype=tensor_data.dtype).reshape(tensor_data.shape)
-      inference_state[k] = mx.array(np_array)
+      inference_state[k] = to_array(self.deserialize_tensor(tensor_data))
 
     for k, tensor_list in inference_state_proto.tensor_list_data.items():
-      inference_state[k] = [mx.array(np.frombuffer(tensor.tensor_data, dtype=tensor.dtype).reshape(tensor.shape)) for tensor in tensor_list.tensors]
+      inference_state[k] = [to_array(self.deserialize_tensor(tensor)) for tensor in tensor_list.tensors]
 
     if inference_state_proto.other_data_json:
       other_data = json.loads(inference_state_proto.other_data_json)
@@ -0,0 +1,222 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import grpc
+import numpy as np
+
+from exo.inference.shard import Shard
+from exo.networking.grpc.grpc_peer_handle import CreditWindow, GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.networking.grpc import node_service_pb2
+from exo.networking.grpc.node_service_pb2_grpc import NodeServiceServicer
+from exo.orchestration.batch_scheduler import BatchScheduler
+from exo.orchestration.node import Node
+from exo.topology.device_capabilities import UNKNOWN_DEVICE_CAPABILITIES
+
+
+class LegacyGRPCServer(GRPCServer):
+  StreamTensors = NodeServiceServicer.StreamTensors
+
+  async def HealthCheck(self, request, context):
+    return node_service_pb2.HealthCheckResponse(is_healthy=True)
+
+
+class AckLosingGRPCServer(GRPCServer):
+  """Dispatches the first frame of each stream, then drops the stream before acking it."""
+  async def StreamTensors(self, request_iterator, context):
+    async for request in request_iterator:
+      self.first_dispatch(request)
+      shard, tensor, request_id, inference_state = self.deserialize_tensor_request(request)
+      await self.node.process_tensor(shard, tensor, request_id, inference_state, origin_node_id=request.origin_node_id)
+      await context.abort(grpc.StatusCode.UNAVAILABLE, "connection lost")
+      yield
+
+
+class FailingGRPCServer(GRPCServer):
+  """Fails unary SendTensor calls for request "bad"."""
+  async def SendTensor(self, request, context):
+    if request.request_id == "bad": await context.abort(grpc.StatusCode.INTERNAL, "bad frame")
+    return await super().SendTensor(request, context)
+
+
+class TestGRPCTensorStream(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.received = []
+    self.origins = []
+    self.downstream = asyncio.Event()
+
+    async def process_tensor(shard, tensor, request_id, inference_state, origin_node_id=None):
+      self.received.append((request_id, tensor.tolist(), inference_state))
+      self.origins.append(origin_node_id)
+      # downstream work the sender should not wait on
+      await self.downstream.wait()
+
+    self.node = mock.AsyncMock(spec=Node)
+    self.node.process_tensor.side_effect = process_tensor
+    self.node.batch_scheduler = BatchScheduler(lambda: None, max_batch_size=2)
+    self.server = GRPCServer(self.node, "localhost", 50061)
+    await self.server.start()
+    self.peer = GRPCPeerHandle("server", "localhost:50061", "test", UNKNOWN_DEVICE_CAPABILITIES)
+    await self.peer.connect()
+
+  async def asyncTearDown(self):
+    self.downstream.set()
+    await self.peer.disconnect()
+    await self.server.stop()
+
+  async def wait_received(self, n: int):
+    for _ in range(100):
+      if len(self.received) >= n: return
+      await asyncio.sleep(0.01)
+
+  async def test_frames_share_one_stream(self):
+    shard = Shard("test", 0, 1, 2)
+    for token in range(3):
+      await asyncio.wait_for(self.peer.send_tensor(shard, np.array([[token]]), {"curr_pos": token}, request_id="r", origin_node_id="origin"), timeout=1)
+    await self.wait_received(3)
+
+    self.assertEqual(self.received, [("r", [[t]], {"curr_pos": t}) for t in range(3)])
+    self.assertEqual(self.origins, ["origin"]*3)
+
+  async def test_acks_hand_out_scheduler_credits(self):
+    self.downstream.set()
+    self.node.batch_scheduler.pending_steps.extend([None]*3)
+    await self.peer.send_tensor(Shard("test", 0, 1, 2), np.array([[1]]), request_id="r")
+    for _ in range(100):
+      if self.peer.credit_window.credits is not None: break
+      await asyncio.sleep(0.01)
+
+    self.assertEqual(self.peer.credit_window.credits, 1)
+    self.assertEqual(self.peer.credit_window.in_flight, 0)
+    self.assertEqual(list(self.peer.tensor_streams), ["test"])
+
+  async def test_unacked_frames_resent_when_stream_unsupported(self):
+    await self.server.stop()
+    self.server = LegacyGRPCServer(self.node, "localhost", 50061)
+    await self.server.start()
+    self.downstream.set()
+
+    await self.peer.send_tensor(Shard("test", 0, 1, 2), np.array([[7]]), request_id="r")
+    await self.wait_received(1)
+    self.assertEqual(self.received, [("r", [[7]], {})])
+    self.assertFalse(self.peer.use_tensor_streams)
+
+    await self.peer.send_tensor(Shard("test", 0, 1, 2), np.array([[8]]), request_id="r")
+    self.assertEqual(self.received[-1], ("r", [[8]], {}))
+
+  async def test_frames_dispatched_before_a_lost_ack_are_not_run_twice(self):
+    await self.server.stop()
+    self.server = AckLosingGRPCServer(self.node, "localhost", 50061)
+    await self.server.start()
+    self.downstream.set()
+
+    await self.peer.send_tensor(Shard("test", 0, 1, 2), np.array([[7]]), {"curr_pos": 3}, request_id="r")
+    # the unacked frame is resent over SendTensor once the stream closes
+    await asyncio.wait_for(self.peer.tensor_streams["test"].ack_task, timeout=1)
+    self.assertEqual(self.received, [("r", [[7]], {"curr_pos": 3})])
+
+    await self.peer.send_tensor(Shard("test", 0, 1, 2), np.array([[8]]), {"curr_pos": 4}, request_id="r")
+    await self.wait_received(2)
+    self.assertEqual(self.received[-1], ("r", [[8]], {"curr_pos": 4}))
+
+  async def test_one_failed_resend_does_not_drop_the_rest(self):
+    await self.server.stop()
+    self.server = FailingGRPCServer(self.node, "localhost", 50061)
+    await self.server.start()
+    self.downstream.set()
+
+    shard = node_service_pb2.Shard(model_id="test", start_layer=0, end_layer=1, n_layers=2)
+    pending = [
+      node_service_pb2.TensorRequest(shard=shard, tensor=self.peer.serialize_tensor(np.array([[token]])), request_id=request_id, frame_id=token)
+      for token, request_id in [(1, "bad"), (2, "good")]
+    ]
+    await self.peer._on_stream_closed(grpc.StatusCode.UNAVAILABLE, pending)
+
+    self.assertEqual(self.received, [("good", [[2]], {})])
+    # the ack of the resent frame was handled like any other
+    self.assertIsNotNone(self.peer.credit_window.credits)
+
+  async def test_activation_format_negotiated_with_peer(self):
+    self.downstream.set()
+    self.peer.activation_format = "bf16"
+    self.assertTrue(await self.peer.health_check())
+    hidden_state = np.random.default_rng(0).standard_normal((1, 4, 8)).astype(np.float32)
+    await self.peer.send_tensor(Shard("test", 0, 1, 2), hidden_state, request_id="r")
+    await self.wait_received(1)
+
+    self.assertEqual(self.peer.peer_wire_formats, ["none", "bf16", "fp16", "int8"])
+    np.testing.assert_allclose(self.received[0][1], hidden_state, rtol=1e-2)
+    self.assertFalse(np.array_equal(self.received[0][1], hidden_state))
+
+  async def test_full_precision_to_peers_without_wire_formats(self):
+    await self.server.stop()
+    self.server = LegacyGRPCServer(self.node, "localhost", 50061)
+    await self.server.start()
+    self.downstream.set()
+    self.peer.activation_format = "int8"
+    self.assertTrue(await self.peer.health_check())
+
+    hidden_state = np.random.default_rng(0).standard_normal((1, 4, 8)).astype(np.float32)
+    await self.peer.send_tensor(Shard("test", 0, 1, 2), hidden_state, request_id="r")
+    await self.wait_received(1)
+    np.testing.assert_array_equal(self.received[0][1], hidden_state)
+
+  async def test_hidden_states_never_wait_on_a_health_check(self):
+    self.downstream.set()
+    self.peer.activation_format = "int8"
+    health_check = mock.AsyncMock(return_value=True)
+    self.peer.health_check = health_check
+    hidden_state = np.random.default_rng(0).standard_normal((1, 4, 8)).astype(np.float32)
+    await self.peer.send_tensor(Shard("test", 0, 1, 2), hidden_state, request_id="r")
+    await self.wait_received(1)
+
+    health_check.assert_not_awaited()
+    np.testing.assert_array_equal(self.received[0][1], hidden_state)
+
+  async def test_failed_health_check_falls_back_to_full_precision(self):
+    self.peer.activation_format = "int8"
+    self.assertTrue(await self.peer.health_check())
+    self.assertEqual(self.peer.wire_format_for(np.zeros((1, 4, 8), dtype=np.float32)), "int8")
+
+    self.peer.stub.HealthCheck = mock.AsyncMock(side_effect=ConnectionError("peer went away"))
+    self.assertFalse(await self.peer.health_check())
+    self.assertEqual(self.peer.wire_format_for(np.zeros((1, 4, 8), dtype=np.float32)), "none")
+    self.assertEqual(self.peer.compression.peer_codecs, [])
+
+
+class TestCreditWindow(unittest.IsolatedAsyncioTestCase):
+  async def test_waits_for_credits(self):
+    window = CreditWindow(max_wait=1.0)
+    await window.acquire()
+    window.update(1)
+    await window.acquire()
+
+    blocked = asyncio.create_task(window.acquire())
+    await asyncio.sleep(0.01)
+    self.assertFalse(blocked.done())
+    window.update(1)
+    await asyncio.wait_for(blocked, timeout=1)
+    self.assertEqual(window.in_flight, 1)
+
+  async def test_keeps_one_frame_in_flight_without_credits(self):
+    window = CreditWindow(max_wait=10.0)
+    await window.acquire()
+    window.update(0)
+    # nothing is in flight, so the next frame goes out to fetch fresh credits
+    await asyncio.wait_for(window.acquire(), timeout=0.1)
+
+    blocked = asyncio.create_task(window.acquire())
+    await asyncio.sleep(0.01)
+    self.assertFalse(blocked.done())
+    window.update(0)
+    await asyncio.wait_for(blocked, timeout=0.1)
+    self.assertEqual(window.in_flight, 1)
+
+  async def test_sends_anyway_when_acks_are_lost(self):
+    window = CreditWindow(max_wait=0.01)
+    await window.acquire()
+    window.update(1)
+    await window.acquire()
+    await asyncio.wait_for(window.acquire(), timeout=1)
+    self.assertEqual(window.in_flight, 2)
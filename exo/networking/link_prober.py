@@ -0,0 +1,120 @@
+"""
+Active measurement of the links to peers
+"""
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from exo.helpers import DEBUG
+from exo.networking.peer_handle import PeerHandle
+
+
+@dataclass
+class LinkState:
+  # smoothed measurements
+  latency: Optional[float] = None  # seconds
+  bandwidth: Optional[float] = None  # bytes/s
+  # what was last put on the topology edge
+  published: Tuple[Optional[float], Optional[float]] = (None, None)
+  payload_bytes: int = 0
+  interval: float = 0.0
+  next_probe: float = 0.0
+
+
+class LinkProber:
+  """
+  Measures round trip time and throughput to each peer over its gRPC channel.
+
+  A probe takes the best of a few empty requests as the RTT, then sends a payload
+  and takes its size over the time beyond the RTT as the throughput. The payload
+  grows until it takes at least target_seconds/2 on the wire and is remembered per
+  peer, so a probe costs about target_seconds of link time on any link. A peer is
+  probed again after interval seconds, doubling up to max_interval while its link
+  stays the same, and nothing is probed while the node has inference work queued.
+  New values are only published once they move by more than publish_change, so
+  noise does not churn the topology and the routing plans derived from it.
+  """
+  def __init__(
+    self,
+    interval: float = 30.0,
+    max_interval: float = 600.0,
+    target_seconds: float = 0.05,
+    min_payload: int = 64*1024,
+    max_payload: int = 16*1024*1024,
+    pings: int = 3,
+    publish_change: float = 0.25,
+  ):
+    self.interval = interval
+    self.max_interval = max_interval
+    self.target_seconds = target_seconds
+    self.min_payload = min_payload
+    self.max_payload = max_payload
+    self.pings = pings
+    self.publish_change = publish_change
+    self.links: Dict[str, LinkState] = {}
+
+  def link(self, peer_id: str) -> Tuple[Optional[float], Optional[float]]:
+    """Published (latency, bandwidth) of the link to peer_id, None where not measured yet."""
+    state = self.links.get(peer_id)
+    return state.published if state is not None else (None, None)
+
+  def due(self, peers: List[PeerHandle], now: Optional[float] = None) -> List[PeerHandle]:
+    now = time.monotonic() if now is None else now
+    return [peer for peer in peers if peer.id() not in self.links or self.links[peer.id()].next_probe <= now]
+
+  async def probe_due(self, peers: List[PeerHandle], busy: bool = False) -> bool:
+    """Probe the peers that are due, one at a time. Returns whether any published link changed."""
+    peer_ids = {peer.id() for peer in peers}
+    for peer_id in [peer_id for peer_id in self.links if peer_id not in peer_ids]:
+      del self.links[peer_id]
+    if busy: return False
+    changed = False
+    for peer in self.due(peers):
+      changed |= await self.probe(peer)
+    return changed
+
+  async def probe(self, peer: PeerHandle) -> bool:
+    state = self.links.setdefault(peer.id(), LinkState(payload_bytes=self.min_payload, interval=self.interval))
+    state.next_probe = time.monotonic() + state.interval
+    try:
+      rtt = min([await peer.probe_link(0) for _ in range(self.pings)])
+      while True:
+        transfer = max(await peer.probe_link(state.payload_bytes) - rtt, 1e-6)
+        if transfer >= self.target_seconds/2 or state.payload_bytes >= self.max_payload: break
+        state.payload_bytes = min(state.payload_bytes*4, self.max_payload)
+      nbytes = state.payload_bytes
+      if transfer > 2*self.target_seconds:
+        state.payload_bytes = max(state.payload_bytes//2, self.min_payload)
+    except NotImplementedError:
+      if DEBUG >= 2: print(f"Peer {peer.id()} cannot be probed")
+      state.next_probe = float("inf")
+      return False
+    except Exception as e:
+      if DEBUG >= 2: print(f"Error probing link to {peer.id()}: {e}")
+      return False
+
+    bandwidth = nbytes/transfer
+    compression = getattr(peer, "compression", None)
+    if compression is not None:
+      compression.observe_bandwidth(nbytes, transfer)
+    if state.latency is None:
+      state.latency, state.bandwidth = rtt, bandwidth
+    else:
+      state.latency = 0.8*state.latency + 0.2*rtt
+      state.bandwidth = 0.8*state.bandwidth + 0.2*bandwidth
+    if DEBUG >= 3: print(f"Link to {peer.id()}: {rtt*1000:.2f}ms rtt, {bandwidth*8/1e6:.1f}Mbit/s with {nbytes} bytes")
+
+    changed = self._publish(state)
+    state.interval = self.interval if changed else min(state.interval*2, self.max_interval)
+    state.next_probe = time.monotonic() + state.interval
+    return changed
+
+  def _publish(self, state: LinkState) -> bool:
+    latency, bandwidth = state.published
+    if latency is not None and abs(state.latency/latency - 1) <= self.publish_change and abs(state.bandwidth/bandwidth - 1) <= self.publish_change:
+      return False
+    state.published = (float(f"{state.latency:.3g}"), float(f"{state.bandwidth:.3g}"))
+    return True
+
+  def stats(self) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    return {peer_id: state.published for peer_id, state in self.links.items() if state.published[0] is not None}
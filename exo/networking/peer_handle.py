@@ -1,9 +1,10 @@
 from abc import ABC, abstractmethod
-from typing import Optional, Tuple, List
+from typing import AsyncIterator, Dict, Optional, Tuple, List
 import numpy as np
 from exo.inference.shard import Shard
 from exo.topology.device_capabilities import DeviceCapabilities
 from exo.topology.topology import Topology
+from exo.topology.gossip import NodeRecord
 
 
 class PeerHandle(ABC):
@@ -40,11 +41,11 @@ class PeerHandle(ABC):
     pass
 
   @abstractmethod
-  async def send_prompt(self, shard: Shard, prompt: str, request_id: Optional[str] = None) -> Optional[np.array]:
+  async def send_prompt(self, shard: Shard, prompt: str, request_id: Optional[str] = None, origin_node_id: str = "") -> Optional[np.array]:
     pass
 
   @abstractmethod
-  async def send_tensor(self, shard: Shard, tensor: np.array, request_id: Optional[str] = None) -> Optional[np.array]:
+  async def send_tensor(self, shard: Shard, tensor: np.array, request_id: Optional[str] = None, origin_node_id: str = "") -> Optional[np.array]:
     pass
 
   @abstractmethod
@@ -54,3 +55,29 @@ class PeerHandle(ABC):
   @abstractmethod
   async def collect_topology(self, visited: set[str], max_depth: int) -> Topology:
     pass
+
+  async def gossip_topology(self, from_id: str, digest: Dict[str, int], records: List[NodeRecord]) -> Tuple[Dict[str, int], List[NodeRecord]]:
+    """
+    One gossip round with this peer, see exo.topology.gossip. Returns the
+    peer's digest and the records we are missing. Peers that cannot gossip
+    raise NotImplementedError and are asked for their topology instead.
+    """
+    raise NotImplementedError
+
+  async def probe_link(self, nbytes: int) -> float:
+    """
+    Seconds for one request carrying nbytes to reach this peer and be answered.
+    Peers that cannot be probed raise NotImplementedError.
+    """
+    raise NotImplementedError
+
+  async def list_repo_files(self, repo_id: str) -> Dict[str, int]:
+    """
+    Size by path of the complete, hash verified files of repo_id this peer has
+    downloaded. Peers that cannot share files raise NotImplementedError.
+    """
+    raise NotImplementedError
+
+  def read_repo_file(self, repo_id: str, path: str, offset: int = 0) -> AsyncIterator[bytes]:
+    """The bytes of one of the files from list_repo_files, starting at offset."""
+    raise NotImplementedError
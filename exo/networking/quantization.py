@@ -0,0 +1,64 @@
+"""
+Reduced precision wire formats for activations sent between nodes
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+# "none" sends the tensor as is, every node can decode all of the others
+WIRE_FORMATS = ["none", "bf16", "fp16", "int8"]
+# numpy dtype each format is carried in, bf16 as raw bit patterns
+WIRE_DTYPES = {"bf16": np.uint16, "fp16": np.float16, "int8": np.int8}
+
+
+def negotiate_wire_format(preferred: str, peer_formats: Optional[list]) -> str:
+  """
+  Format to send activations to a peer in, full precision unless the peer
+  advertised that it can decode the preferred format
+  """
+  return preferred if peer_formats and preferred in peer_formats else "none"
+
+
+def quantize(array: np.ndarray, wire_format: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+  """
+  Encode a float array in wire_format. Returns the encoded array and, for int8,
+  one float32 scale per row of the last dimension.
+  """
+  if wire_format == "none" or array.dtype.kind != "f":
+    return array, None
+
+  if wire_format == "bf16":
+    # bf16 is the top half of a float32, round to nearest even on the dropped half
+    bits = np.ascontiguousarray(array, dtype=np.float32).view(np.uint32)
+    rounding = ((bits >> 16) & 1) + 0x7FFF
+    return ((bits + rounding) >> 16).astype(np.uint16), None
+
+  if wire_format == "fp16":
+    return array.astype(np.float16), None
+
+  if wire_format == "int8":
+    array = array.astype(np.float32)
+    scales = np.abs(array).max(axis=-1, keepdims=True)/127
+    scales[scales == 0] = 1
+    return np.clip(np.rint(array/scales), -127, 127).astype(np.int8), scales.astype(np.float32)
+
+  raise ValueError(f"Unknown wire format {wire_format}, expected one of {WIRE_FORMATS}")
+
+
+def dequantize(array: np.ndarray, wire_format: str, dtype: np.dtype, scales: Optional[np.ndarray] = None) -> np.ndarray:
+  """
+  Decode an array sent in wire_format back to dtype
+  """
+  if wire_format == "none" or not wire_format:
+    return array
+
+  if wire_format == "bf16":
+    return (array.astype(np.uint32) << 16).view(np.float32).astype(dtype, copy=False)
+
+  if wire_format == "fp16":
+    return array.astype(dtype)
+
+  if wire_format == "int8":
+    return (array.astype(np.float32)*scales).astype(dtype, copy=False)
+
+  raise ValueError(f"Unknown wire format {wire_format}, expected one of {WIRE_FORMATS}")
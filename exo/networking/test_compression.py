@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+
+from exo.networking import compression
+from exo.networking.compression import CompressionPolicy
+from exo.networking.grpc import grpc_server
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.networking.grpc.test_grpc_tensor_stream import LegacyGRPCServer
+
+TEN_GBE = 10e9/8
+WIFI = 20e6/8
+
+
+def negotiated(policy: CompressionPolicy) -> CompressionPolicy:
+  # as after a health check with a peer that decodes everything this node does
+  policy.peer_codecs = list(compression.SUPPORTED_CODECS)
+  return policy
+
+
+def over_the_wire(policy: CompressionPolicy, array: np.ndarray):
+  proto = GRPCPeerHandle("peer", "localhost:0", "test", None, policy).serialize_tensor(array)
+  return GRPCServer(None, "localhost", 0).deserialize_tensor(proto), proto
+
+
+def test_activations_on_fast_link_are_not_compressed():
+  policy = CompressionPolicy(link_bandwidth=TEN_GBE, probe_every=1000)
+  hidden = np.random.default_rng(0).standard_normal((1, 64, 512)).astype(np.float32)
+  received, proto = over_the_wire(policy, hidden)
+
+  assert proto.compression == ""
+  np.testing.assert_array_equal(received, hidden)
+  assert policy.stats()["compress_seconds"] == 0
+
+
+def test_tokens_on_slow_link_are_compressed():
+  policy = negotiated(CompressionPolicy(link_bandwidth=WIFI))
+  tokens = np.zeros((1, 4096), dtype=np.int64)
+  received, proto = over_the_wire(policy, tokens)
+
+  assert proto.compression != ""
+  np.testing.assert_array_equal(received, tokens)
+  stats = policy.stats()
+  assert stats["bytes_saved"] == tokens.nbytes - len(proto.tensor_data)
+  assert stats["compress_seconds"] > 0
+
+
+def test_small_messages_skip_compression():
+  policy = negotiated(CompressionPolicy("gzip"))
+  _, proto = over_the_wire(policy, np.array([[42]]))
+  assert proto.compression == ""
+
+
+@pytest.mark.parametrize("mode", ["fast", "gzip"])
+def test_fixed_modes_round_trip(mode):
+  policy = negotiated(CompressionPolicy(mode))
+  mask = np.tril(np.ones((64, 64), dtype=np.float32))
+  received, proto = over_the_wire(policy, mask)
+
+  assert proto.compression != ""
+  np.testing.assert_array_equal(received, mask)
+
+
+def test_bandwidth_estimate_follows_measurements():
+  policy = CompressionPolicy()
+  policy.observe_bandwidth(1_000_000, 0.01)
+  assert policy.link_bandwidth == pytest.approx(1e8)
+  policy.observe_bandwidth(1_000_000, 0.1)
+  assert 1e7 < policy.link_bandwidth < 1e8
+
+
+def test_lz4_only_once_the_peer_can_decode_it(monkeypatch):
+  monkeypatch.setattr(compression, "SUPPORTED_CODECS", ["lz4", "zlib", "gzip"])
+  policy = CompressionPolicy("fast")
+  policy.peer_codecs = ["zlib", "gzip"]
+  assert policy.choose(1 << 20, np.dtype(np.float32)) == "zlib"
+  policy.peer_codecs = ["lz4", "zlib", "gzip"]
+  assert policy.choose(1 << 20, np.dtype(np.float32)) == "lz4"
+
+
+@pytest.mark.asyncio
+async def test_receiver_without_lz4_gets_zlib(monkeypatch):
+  # the sender has lz4, the receiver advertises that it does not
+  monkeypatch.setattr(compression, "SUPPORTED_CODECS", ["lz4", "zlib", "gzip"])
+  monkeypatch.setattr(grpc_server, "SUPPORTED_CODECS", ["zlib", "gzip"])
+  server = GRPCServer(None, "localhost", 50063)
+  await server.start()
+  policy = CompressionPolicy("fast")
+  peer = GRPCPeerHandle("server", "localhost:50063", "test", None, policy)
+  try:
+    assert await peer.health_check()
+  finally:
+    await peer.disconnect()
+    await server.stop()
+  assert policy.peer_codecs == ["zlib", "gzip"]
+
+  tokens = np.zeros((1, 4096), dtype=np.int64)
+  received, proto = over_the_wire(policy, tokens)
+  assert proto.compression == "zlib"
+  np.testing.assert_array_equal(received, tokens)
+
+
+@pytest.mark.parametrize("mode", ["auto", "fast", "gzip"])
+def test_nothing_is_compressed_before_the_peer_lists_codecs(mode):
+  policy = CompressionPolicy(mode, link_bandwidth=WIFI)
+  tokens = np.zeros((1, 4096), dtype=np.int64)
+  for peer_codecs in (None, []):
+    policy.peer_codecs = peer_codecs
+    _, proto = over_the_wire(policy, tokens)
+    assert proto.compression == ""
+    assert proto.tensor_data == tokens.tobytes()
+
+
+@pytest.mark.asyncio
+async def test_legacy_receiver_gets_uncompressed_tensors():
+  server = LegacyGRPCServer(None, "localhost", 50064)
+  await server.start()
+  policy = CompressionPolicy("gzip")
+  peer = GRPCPeerHandle("server", "localhost:50064", "test", None, policy)
+  try:
+    assert await peer.health_check()
+  finally:
+    await peer.disconnect()
+    await server.stop()
+  assert policy.peer_codecs == []
+
+  mask = np.tril(np.ones((64, 64), dtype=np.float32))
+  _, proto = over_the_wire(policy, mask)
+  # what a receiver that ignores the compression field would decode
+  np.testing.assert_array_equal(np.frombuffer(proto.tensor_data, dtype=np.float32).reshape(mask.shape), mask)
@@ -0,0 +1,98 @@
+import pytest
+
+from exo.networking.compression import CompressionPolicy
+from exo.networking.link_prober import LinkProber
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+from exo.topology.gossip import Edge, TopologyGossip
+
+
+class SimulatedPeer:
+  """A peer on a link with fixed latency and bandwidth that answers probes instantly."""
+  def __init__(self, peer_id: str, latency: float, bandwidth: float, probe: bool = True):
+    self._id = peer_id
+    self.latency = latency
+    self.bandwidth = bandwidth
+    self.can_probe = probe
+    self.compression = CompressionPolicy()
+    self.probes = []
+
+  def id(self) -> str:
+    return self._id
+
+  async def probe_link(self, nbytes: int) -> float:
+    if not self.can_probe: raise NotImplementedError
+    self.probes.append(nbytes)
+    return self.latency + nbytes/self.bandwidth
+
+
+@pytest.mark.asyncio
+async def test_measures_latency_and_bandwidth():
+  peer = SimulatedPeer("b", latency=0.002, bandwidth=100e6)
+  prober = LinkProber(target_seconds=0.05)
+  assert await prober.probe_due([peer])
+
+  latency, bandwidth = prober.link("b")
+  assert latency == pytest.approx(0.002)
+  assert bandwidth == pytest.approx(100e6)
+  # the payload grew until the transfer was long enough to measure
+  assert peer.probes[-1]/peer.bandwidth >= 0.025
+  assert peer.compression.link_bandwidth == pytest.approx(100e6)
+
+
+@pytest.mark.asyncio
+async def test_small_changes_are_not_published_and_back_off():
+  peer = SimulatedPeer("b", latency=0.002, bandwidth=100e6)
+  prober = LinkProber(interval=10.0, max_interval=40.0)
+  await prober.probe(peer)
+  published = prober.link("b")
+
+  peer.bandwidth = 110e6
+  assert not await prober.probe(peer)
+  assert prober.link("b") == published
+  assert prober.links["b"].interval == 20.0
+  await prober.probe(peer)
+  await prober.probe(peer)
+  assert prober.links["b"].interval == 40.0
+
+  peer.bandwidth = 10e6
+  for _ in range(3):
+    await prober.probe(peer)
+  assert prober.link("b")[1] < 0.75*published[1]
+  assert prober.links["b"].interval < 40.0
+
+
+@pytest.mark.asyncio
+async def test_skips_busy_nodes_and_unprobeable_peers():
+  legacy = SimulatedPeer("legacy", latency=0.001, bandwidth=1e9, probe=False)
+  peer = SimulatedPeer("b", latency=0.001, bandwidth=1e9)
+  prober = LinkProber()
+
+  assert not await prober.probe_due([legacy, peer], busy=True)
+  assert peer.probes == []
+
+  await prober.probe_due([legacy, peer])
+  assert prober.link("legacy") == (None, None)
+  assert prober.due([legacy, peer], now=float("1e12")) == [peer]
+
+  await prober.probe_due([legacy])
+  assert "b" not in prober.links
+
+
+def test_measured_links_reach_the_topology():
+  capabilities = DeviceCapabilities(model="test", chip="test", memory=1000, flops=DeviceFlops(fp32=1, fp16=1, int8=1))
+  gossip = TopologyGossip("a")
+  gossip.update_self(capabilities, [Edge("b", "Ethernet")])
+  unmeasured = gossip.topology({})
+  assert gossip.update_self(capabilities, [Edge("b", "Ethernet", 0.002, 100e6)])
+
+  topology = gossip.topology({})
+  link = topology.get_link("a", "b")
+  assert (link.latency, link.bandwidth) == (0.002, 100e6)
+  assert topology.to_json()["peer_graph"]["a"][0]["latency"] == 0.002
+  # a new measurement is a new layout, so routing plans are rebuilt from it
+  assert not topology.same_layout(unmeasured)
+  version = topology.version
+  topology.add_edge("a", "b", "Ethernet", 0.004, 100e6)
+  assert topology.version == version + 1
+  topology.add_edge("a", "b", "Ethernet")
+  assert topology.version == version + 1
@@ -0,0 +1,118 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, List, Optional, Tuple, Union
+import numpy as np
+from exo.inference.inference_engine import InferenceEngine
+from exo.inference.shard import Shard
+from exo import DEBUG
+from exo.metrics import SHARD_FORWARD_SECONDS
+
+
+@dataclass
+class PendingStep:
+  request_id: str
+  shard: Shard
+  input_data: Union[str, np.ndarray]
+  inference_state: Optional[dict]
+  future: asyncio.Future = field(default=None, repr=False)
+
+
+class BatchScheduler:
+  """
+  Continuous batching for a single node.
+
+  Every inference step on this node goes through the scheduler. Decode steps that are waiting
+  for the same shard are coalesced into one batched engine call, and new prompts are admitted
+  between steps so a long prefill never holds up the running batch for more than one step.
+  Results are split back out per request_id through each step's future.
+  """
+  def __init__(self, get_inference_engine: Callable[[], InferenceEngine], max_batch_size: int = 8, max_prefills_per_step: int = 1, node_id: str = ""):
+    self.get_inference_engine = get_inference_engine
+    self.node_id = node_id
+    self.max_batch_size = max(1, max_batch_size)
+    self.max_prefills_per_step = max(1, max_prefills_per_step)
+    self.pending_prompts: Deque[PendingStep] = deque()
+    self.pending_steps: Deque[PendingStep] = deque()
+    self.loop_task: Optional[asyncio.Task] = None
+
+  @property
+  def queue_depth(self) -> int:
+    return len(self.pending_prompts) + len(self.pending_steps)
+
+  @property
+  def credits(self) -> int:
+    """
+    How many more steps upstream nodes should send right now. Two batches
+    worth of queued steps keeps the engine busy without piling up work.
+    """
+    return max(0, 2*self.max_batch_size - self.queue_depth)
+
+  async def submit_prompt(self, request_id: str, shard: Shard, prompt: str, inference_state: Optional[dict] = None) -> Tuple[np.ndarray, Optional[dict]]:
+    return await self._submit(self.pending_prompts, PendingStep(request_id, shard, prompt, inference_state))
+
+  async def submit_tensor(self, request_id: str, shard: Shard, tensor: np.ndarray, inference_state: Optional[dict] = None) -> Tuple[np.ndarray, Optional[dict]]:
+    return await self._submit(self.pending_steps, PendingStep(request_id, shard, tensor, inference_state))
+
+  async def _submit(self, queue: Deque[PendingStep], step: PendingStep) -> Tuple[np.ndarray, Optional[dict]]:
+    step.future = asyncio.get_running_loop().create_future()
+    queue.append(step)
+    if self.loop_task is None or self.loop_task.done():
+      self.loop_task = asyncio.create_task(self._run())
+    return await step.future
+
+  async def _run(self) -> None:
+    while self.pending_prompts or self.pending_steps:
+      # Yield once so requests that just finished a step can enqueue their next one and join this batch.
+      await asyncio.sleep(0)
+      for _ in range(min(self.max_prefills_per_step, len(self.pending_prompts))):
+        await self._run_prompt(self.pending_prompts.popleft())
+      if self.pending_steps:
+        await self._run_batch(self._take_batch())
+
+  def _take_batch(self) -> List[PendingStep]:
+    shard = self.pending_steps[0].shard
+    batch: List[PendingStep] = []
+    remaining: Deque[PendingStep] = deque()
+    request_ids = set()
+    while self.pending_steps:
+      step = self.pending_steps.popleft()
+      if step.shard == shard and step.request_id not in request_ids and len(batch) < self.max_batch_size:
+        batch.append(step)
+        request_ids.add(step.request_id)
+      else:
+        remaining.append(step)
+    self.pending_steps = remaining
+    return batch
+
+  async def _run_prompt(self, step: PendingStep) -> None:
+    if step.future.done(): return
+    try:
+      start = time.perf_counter()
+      result = await self.get_inference_engine().infer_prompt(step.request_id, step.shard, step.input_data, step.inference_state)
+      SHARD_FORWARD_SECONDS.labels(model=step.shard.model_id, node=self.node_id, kind="prompt").observe(time.perf_counter() - start)
+      if not step.future.done(): step.future.set_result(result)
+    except Exception as e:
+      if DEBUG >= 2: traceback.print_exc()
+      if not step.future.done(): step.future.set_exception(e)
+
+  async def _run_batch(self, batch: List[PendingStep]) -> None:
+    batch = [step for step in batch if not step.future.done()]
+    if not batch: return
+    if DEBUG >= 2: print(f"[BatchScheduler] running {len(batch)} step(s) for {batch[0].shard} ({self.queue_depth} queued)")
+    try:
+      start = time.perf_counter()
+      results = await self.get_inference_engine().infer_tensor_batch(batch[0].shard, [(step.request_id, step.input_data, step.inference_state) for step in batch])
+      SHARD_FORWARD_SECONDS.labels(model=batch[0].shard.model_id, node=self.node_id, kind="tensor").observe(time.perf_counter() - start)
+    except Exception as e:
+      if DEBUG >= 2: traceback.print_exc()
+      for step in batch:
+        if not step.future.done(): step.future.set_exception(e)
+      return
+    for step, result in zip(batch, results):
+      if step.future.done(): continue
+      # a request can fail on its own without failing the batch
+      if isinstance(result, Exception): step.future.set_exception(result)
+      else: step.future.set_result(result)
@@ -5,18 +5,41 @@ import asyncio
 import uuid
 import time
 import traceback
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from typing import List, Dict, Optional, Tuple, Union, Set
 from exo.networking import Discovery, PeerHandle, Server
 from exo.inference.inference_engine import InferenceEngine, Shard
 from exo.topology.topology import Topology
+from exo.topology.gossip import Edge, TopologyGossip
+from exo.networking.link_prober import LinkProber
 from exo.topology.device_capabilities import device_capabilities, UNKNOWN_DEVICE_CAPABILITIES
 from exo.topology.partitioning_strategy import Partition, PartitioningStrategy, map_partitions_to_shards
 from exo import DEBUG
-from exo.helpers import AsyncCallbackSystem
+from exo.helpers import AsyncCallbackSystem, TokenRouter
 from exo.viz.topology_viz import TopologyViz
 from exo.download.download_progress import RepoProgressEvent
 from exo.inference.inference_engine import get_inference_engine, InferenceEngine
 from exo.download.shard_download import ShardDownloader
+from exo.orchestration.batch_scheduler import BatchScheduler
+from exo.orchestration.result_batcher import ResultBatcher
+from exo.metrics import DOWNLOADED_BYTES, DOWNLOAD_SPEED, GENERATED_TOKENS
+
+MAX_TRACKED_ORIGINS = 4096
+
+
+@dataclass
+class RoutingPlan:
+  """
+  Partitions of one topology version and what follows from them: this node's
+  position in the ring and the shards of each model. Rebuilt only when the
+  topology changes.
+  """
+  topology: Topology
+  version: int
+  partitions: List[Partition]
+  index: Optional[int]
+  shards: Dict[Tuple[str, int], List[Shard]] = field(default_factory=dict)
 
 
 class Node:
@@ -31,6 +54,8 @@ class Node:
     max_generate_tokens: int = 1024,
     default_sample_temperature: float = 0.0,
     topology_viz: Optional[TopologyViz] = None,
+    max_batch_size: int = 8,
+    gossip_fanout: int = 3,
   ):
     self.id = _id
     self.inference_engine = inference_engine
@@ -39,7 +64,11 @@ class Node:
     self.shard_downloader = shard_downloader
     self.partitioning_strategy = partitioning_strategy
     self.peers: List[PeerHandle] = {}
+    self.peer_index: Tuple[List[PeerHandle], Dict[str, PeerHandle]] = (self.peers, {})
+    self.routing_plan: Optional[RoutingPlan] = None
     self.topology: Topology = Topology()
+    self.gossip = TopologyGossip(_id, fanout=gossip_fanout)
+    self.link_prober = LinkProber()
     self.device_capabilities = UNKNOWN_DEVICE_CAPABILITIES
     self.buffered_token_output: Dict[str, Tuple[List[int], bool]] = {}
     self.buffered_logits: Dict[str, List[np.ndarray]] = {}
@@ -51,20 +80,27 @@ class Node:
     self.topology_viz = topology_viz
     self.default_sample_temperature = default_sample_temperature
     self._on_token = AsyncCallbackSystem[str, Tuple[str, List[int], bool]]()
+    self.token_router = TokenRouter()
     self._on_opaque_status = AsyncCallbackSystem[str, Tuple[str, str]]()
     self._on_opaque_status.register("node_status").on_next(self.on_node_status)
     self.node_download_progress: Dict[str, RepoProgressEvent] = {}
     self.topology_inference_engines_pool: List[List[str]] = []
     self.outstanding_requests = {}
+    self.batch_scheduler = BatchScheduler(lambda: self.inference_engine, max_batch_size=max_batch_size, node_id=self.id)
+    # node each request came in on, "" if the peer that forwarded it did not say
+    self.request_origins: OrderedDict[str, str] = OrderedDict()
+    self.result_batcher = ResultBatcher(self.send_result_to_origin)
 
   async def start(self, wait_for_peers: int = 0) -> None:
     self.device_capabilities = await device_capabilities()
     await self.server.start()
     await self.discovery.start()
     await self.update_peers(wait_for_peers)
-    await self.collect_topology(set())
+    # the first round goes to every peer so a new node learns the cluster right away
+    await self.gossip_topology(fanout=len(self.peers))
     if DEBUG >= 2: print(f"Collected topology: {self.topology}")
     asyncio.create_task(self.periodic_topology_collection(2.0))
+    asyncio.create_task(self.periodic_link_probing(5.0))
 
   async def stop(self) -> None:
     await self.discovery.stop()
@@ -84,15 +120,19 @@ class Node:
         elif status_data.get("status", "").startswith("end_"):
           if status_data.get("node_id") == self.current_topology.active_node_id:
             self.current_topology.active_node_id = None
+      elif status_type == "request_finished":
+        asyncio.create_task(self.release_request(request_id))
 
       download_progress = None
       if status_type == "download_progress":
         if DEBUG >= 8: print(f"Download progress from {status_data.get('node_id')}: {status_data.get('progress')}")
         download_progress = RepoProgressEvent.from_dict(status_data.get('progress'))
         self.node_download_progress[status_data.get('node_id')] = download_progress
+        DOWNLOADED_BYTES.labels(model=download_progress.shard.model_id, node=status_data.get('node_id')).set(download_progress.downloaded_bytes)
+        DOWNLOAD_SPEED.labels(model=download_progress.shard.model_id, node=status_data.get('node_id')).set(download_progress.overall_speed)
 
       if self.topology_viz:
-        self.topology_viz.update_visualization(self.topology, self.partitioning_strategy.partition(self.topology), self.id, self.node_download_progress)
+        self.topology_viz.update_visualization(self.topology, self.get_partitions(), self.id, self.node_download_progress)
     except Exception as e:
       if DEBUG >= 1: print(f"Error on_node_status: {e}")
       if DEBUG >= 1: traceback.print_exc()
@@ -131,6 +171,7 @@ class Node:
         token = await self.inference_engine.sample(result, temp=self.default_sample_temperature)
         await self.inference_engine.ensure_shard(shard)
         self.buffered_token_output[request_id][0].append(token.item())
+        GENERATED_TOKENS.labels(model=shard.model_id, node=self.id).inc()
         is_finished = token.item() == self.inference_engine.tokenizer.eos_token_id or is_finished or len(self.buffered_token_output[request_id][0]) >= self.max_generate_tokens
         if DEBUG >= 2: print(f"[{request_id}] result size: {result.size}, is finished: {is_finished}, buffered tokens: {len(self.buffered_token_output[request_id][0])}")
         forward = token.reshape(1, -1)
@@ -144,25 +185,38 @@ class Node:
       forward = result
     if shard.is_last_layer():
       self.trigger_on_token_callbacks(request_id, intermediate_result, is_finished)
-      asyncio.create_task(self.broadcast_result(request_id, intermediate_result, is_finished))
+      self.deliver_result(request_id, intermediate_result, is_finished)
 
     if is_finished:
       if shard.model_id != 'stable-diffusion-2-1-base':
         self.buffered_token_output[request_id] = (self.buffered_token_output[request_id][0], True)
       self.outstanding_requests.pop(request_id)
+      # only the last shard sees a request finish, the others free its cache when told
+      if shard.is_last_layer():
+        asyncio.create_task(self.broadcast_opaque_status(request_id, json.dumps({"type": "request_finished", "node_id": self.id})))
     else:
       self.outstanding_requests[request_id] = "waiting"
       asyncio.create_task(self.forward_tensor(shard, forward, request_id, self.get_partition_index(offset=1), inference_state))
 
     return np.array(self.buffered_token_output[request_id][0]) if shard.model_id != 'stable-diffusion-2-1-base' else intermediate_result
 
+  async def release_request(self, request_id: str) -> None:
+    try:
+      await self.inference_engine.release_request(request_id)
+    except Exception as e:
+      if DEBUG >= 1: print(f"[{request_id}] failed to release request: {e}")
+
   async def process_prompt(
     self,
     base_shard: Shard,
     prompt: str,
     request_id: Optional[str] = None,
     inference_state: Optional[dict] = {},
+    origin_node_id: Optional[str] = None,
   ) -> Optional[np.ndarray]:
+    if request_id is None:
+      request_id = str(uuid.uuid4())
+    self.track_origin(request_id, origin_node_id)
     shard = self.get_current_shard(base_shard)
     start_time = time.perf_counter_ns()
     asyncio.create_task(
@@ -213,7 +267,7 @@ class Node:
       return None
     else:
       self.outstanding_requests[request_id] = "processing"
-      result, inference_state = await self.inference_engine.infer_prompt(request_id, shard, prompt, inference_state)
+      result, inference_state = await self.batch_scheduler.submit_prompt(request_id, shard, prompt, inference_state)
       ret = await self.process_inference_result(shard, result, request_id, inference_state)
       return result
 
@@ -360,7 +414,9 @@ class Node:
     tensor: np.ndarray,
     request_id: Optional[str] = None,
     inference_state: Optional[dict] = None,
+    origin_node_id: Optional[str] = None,
   ) -> Optional[np.ndarray]:
+    if request_id is not None: self.track_origin(request_id, origin_node_id)
     shard = self.get_current_shard(base_shard)
     start_time = time.perf_counter_ns()
     resp = await self._process_tensor(shard, tensor, request_id, inference_state)
@@ -381,7 +437,7 @@ class Node:
 
     try:
       self.outstanding_requests[request_id] = "processing"
-      result, inference_state = await self.inference_engine.infer_tensor(request_id, shard, tensor, inference_state)
+      result, inference_state = await self.batch_scheduler.submit_tensor(request_id, shard, tensor, inference_state)
       ret = await self.process_inference_result(shard, result, request_id, inference_state)
       return ret
     except Exception as e:
@@ -400,10 +456,10 @@ class Node:
     target_index: int,
   ) -> None:
     if DEBUG >= 1: print(f"target partition index: {target_index}")
-    target_id = self.partitioning_strategy.partition(self.topology)[target_index].node_id
+    target_id = self.get_partitions()[target_index].node_id
     target_shard = self.get_current_shard(base_shard, target_index)
     if DEBUG >= 2: print(f"computed target from: {base_shard} {target_index}, {self.topology}. target shard: {target_shard}")
-    target_peer = next((p for p in self.peers if p.id() == target_id), None)
+    target_peer = self.get_peer(target_id)
     if not target_peer:
       raise ValueError(f"peer for {target_index} not found")
     if DEBUG >= 1: print(f"sending example to {target_peer.id()}: {step} => {target} ({length})")
@@ -419,17 +475,17 @@ class Node:
     inference_state: Optional[dict] = None,
   ) -> None:
     if DEBUG >= 1: print(f"target partition index: {target_index}")
-    target_id = self.partitioning_strategy.partition(self.topology)[target_index].node_id
+    target_id = self.get_partitions()[target_index].node_id
     next_shard = self.get_current_shard(base_shard, target_index)
     if DEBUG >= 2: print(f"Computed target from: {base_shard} {target_index}, {self.topology}. next shard: {next_shard}")
     if target_id == self.id:
       await self.process_prompt(next_shard, prompt, request_id, inference_state)
     else:
-      target_peer = next((p for p in self.peers if p.id() == target_id), None)
+      target_peer = self.get_peer(target_id)
       if not target_peer:
         raise ValueError(f"Peer for {target_index} not found")
       if DEBUG >= 1: print(f"Sending prompt to {target_peer.id()}: {prompt}")
-      await target_peer.send_prompt(next_shard, prompt, request_id=request_id, inference_state=inference_state)
+      await target_peer.send_prompt(next_shard, prompt, request_id=request_id, inference_state=inference_state, origin_node_id=self.request_origins.get(request_id, ""))
 
   async def forward_tensor(
     self,
@@ -440,34 +496,54 @@ class Node:
     inference_state: Optional[dict] = None,
   ) -> None:
     if DEBUG >= 1: print(f"target partition index: {target_index}")
-    target_id = self.partitioning_strategy.partition(self.topology)[target_index].node_id
+    target_id = self.get_partitions()[target_index].node_id
     next_shard = self.get_current_shard(base_shard, target_index)
     if DEBUG >= 2: print(f"Computed target from: {base_shard} {target_index}, {self.topology}. target shard: {next_shard}")
     if target_id == self.id:
       await self.process_tensor(next_shard, tensor, request_id, inference_state)
     else:
-      target_peer = next((p for p in self.peers if p.id() == target_id), None)
+      target_peer = self.get_peer(target_id)
       if not target_peer:
         raise ValueError(f"Peer for {target_index} not found")
       if DEBUG >= 1: print(f"Sending tensor to {target_peer.id()}: {tensor}")
-      await target_peer.send_tensor(next_shard, tensor, request_id=request_id, inference_state=inference_state)
+      await target_peer.send_tensor(next_shard, tensor, request_id=request_id, inference_state=inference_state, origin_node_id=self.request_origins.get(request_id, ""))
+
+  def get_routing_plan(self) -> RoutingPlan:
+    plan = self.routing_plan
+    if plan is None or plan.topology is not self.topology or plan.version != self.topology.version:
+      partitions = self.partitioning_strategy.partition(self.topology)
+      index = next((i for i, p in enumerate(partitions) if p.node_id == self.id), None)
+      plan = self.routing_plan = RoutingPlan(self.topology, self.topology.version, partitions, index)
+      if DEBUG >= 2: print(f"New routing plan for topology version {plan.version}: {partitions}")
+    return plan
+
+  def get_partitions(self) -> List[Partition]:
+    return self.get_routing_plan().partitions
 
   def get_partition_index(self, offset: int = 0):
     if not self.partitioning_strategy:
       if DEBUG >= 1: print("No partitioning strategy found. Skipping forward.")
       return None
-    partitions = self.partitioning_strategy.partition(self.topology)
-    current_partition_index = next((i for i, p in enumerate(partitions) if p.node_id == self.id), None)
-    if current_partition_index is None:
+    plan = self.get_routing_plan()
+    if plan.index is None:
       raise ValueError(f"No current partition found for node: {self.id}")
-    return (current_partition_index+offset) % len(partitions)
+    return (plan.index + offset) % len(plan.partitions)
 
   def get_current_shard(self, base_shard: Shard, index: Optional[int] = None) -> Shard:
     if index is None:
       index = self.get_partition_index()
-    partitions = self.partitioning_strategy.partition(self.topology)
-    shards = map_partitions_to_shards(partitions, base_shard.n_layers, base_shard.model_id)
-    return shards[index]
+    plan = self.get_routing_plan()
+    key = (base_shard.model_id, base_shard.n_layers)
+    if key not in plan.shards:
+      plan.shards[key] = map_partitions_to_shards(plan.partitions, base_shard.n_layers, base_shard.model_id)
+    return plan.shards[key][index]
+
+  def get_peer(self, node_id: str) -> Optional[PeerHandle]:
+    peers, index = self.peer_index
+    if peers is not self.peers or len(index) != len(peers):
+      index = {peer.id(): peer for peer in self.peers}
+      self.peer_index = (self.peers, index)
+    return index.get(node_id)
 
   async def update_peers(self, wait_for_peers: int = 0) -> bool:
     next_peers = await self.discovery.discover_peers(wait_for_peers)
@@ -533,13 +609,27 @@ class Node:
       try:
         did_peers_change = await self.update_peers()
         if DEBUG >= 2: print(f"{did_peers_change=}")
-        await self.collect_topology(set())
+        await self.gossip_topology()
         if did_peers_change:
           await self.select_best_inference_engine()
       except Exception as e:
         print(f"Error collecting topology: {e}")
         traceback.print_exc()
 
+  async def periodic_link_probing(self, interval: float):
+    while True:
+      await asyncio.sleep(interval)
+      try:
+        # measurements are left out while inference traffic is on the links
+        if await self.link_prober.probe_due(self.peers, busy=self.batch_scheduler.queue_depth > 0):
+          self.apply_gossip()
+      except Exception as e:
+        print(f"Error probing links: {e}")
+        traceback.print_exc()
+
+  def peer_edge(self, peer: PeerHandle) -> Edge:
+    return Edge(peer.id(), peer.description(), *self.link_prober.link(peer.id()))
+
   async def collect_topology(self, visited: set[str], max_depth: int = 4) -> Topology:
     next_topology = Topology()
     next_topology.update_node(self.id, self.device_capabilities)
@@ -552,7 +642,7 @@ class Node:
 
     for peer in self.peers:
       next_topology.update_node(peer.id(), peer.device_capabilities())
-      next_topology.add_edge(self.id, peer.id(), peer.description())
+      next_topology.add_edge(self.id, *self.peer_edge(peer))
 
       if peer.id() in prev_visited:
         continue
@@ -569,10 +659,43 @@ class Node:
         print(f"Error collecting topology from {peer.id()}: {e}")
         traceback.print_exc()
 
+    return self.set_topology(next_topology)
+
+  async def gossip_topology(self, fanout: Optional[int] = None) -> Topology:
+    """
+    One round of topology gossip with up to fanout random peers (the node's
+    default if None), then rebuild the topology from what is known.
+    """
+    self.gossip.update_self(self.device_capabilities, [self.peer_edge(peer) for peer in self.peers])
+    peers = {peer.id(): peer for peer in self.peers}
+
+    async def exchange(peer: PeerHandle):
+      try:
+        digest, records = await peer.gossip_topology(self.id, self.gossip.digest(), self.gossip.outgoing(peer.id()))
+        changed = self.gossip.exchanged(peer.id(), digest, records)
+        if DEBUG >= 4: print(f"Gossiped topology with {peer.id()}: {len(records)} records received, {changed} newer")
+      except NotImplementedError:
+        # older peers only answer CollectTopology, they still show up as direct peers
+        if DEBUG >= 4: print(f"Peer {peer.id()} does not gossip topology")
+      except Exception as e:
+        print(f"Error gossiping topology with {peer.id()}: {e}")
+        if DEBUG >= 2: traceback.print_exc()
+
+    await asyncio.gather(*(exchange(peers[peer_id]) for peer_id in self.gossip.choose_peers(list(peers), fanout)))
+    return self.apply_gossip()
+
+  def apply_gossip(self) -> Topology:
+    self.gossip.update_self(self.device_capabilities, [self.peer_edge(peer) for peer in self.peers])
+    return self.set_topology(self.gossip.topology({peer.id(): peer.device_capabilities() for peer in self.peers}))
+
+  def set_topology(self, next_topology: Topology) -> Topology:
     next_topology.active_node_id = self.topology.active_node_id
-    self.topology = next_topology
+    # an unchanged topology keeps its version so the routing plan stays cached
+    if not next_topology.same_layout(self.topology):
+      next_topology.version = self.topology.version + 1
+      self.topology = next_topology
     if self.topology_viz:
-      self.topology_viz.update_visualization(self.topology, self.partitioning_strategy.partition(self.topology), self.id)
+      self.topology_viz.update_visualization(self.topology, self.get_partitions(), self.id)
     return self.topology
 
   @property
@@ -585,7 +708,45 @@ class Node:
 
   def trigger_on_token_callbacks(self, request_id: str, tokens: List[int], is_finished: bool) -> None:
     if DEBUG >= 2: print(f"Triggering all on_token callbacks with {request_id=} {tokens=} {is_finished=}")
-    self.on_token.trigger_all(request_id, tokens, is_finished)
+    self.token_router.publish(request_id, tokens, is_finished)
+    # on_token callbacks are kept for external listeners, everything in exo subscribes through token_router
+    if self.on_token.callbacks: self.on_token.trigger_all(request_id, tokens, is_finished)
+
+  def track_origin(self, request_id: str, origin_node_id: Optional[str] = None) -> None:
+    """
+    Remember where request_id came in. origin_node_id is None for requests
+    started on this node and "" when a peer forwarded it without saying.
+    """
+    if request_id in self.request_origins: return
+    self.request_origins[request_id] = self.id if origin_node_id is None else origin_node_id
+    # only the last shard sees a request finish, so the others forget old ones
+    while len(self.request_origins) > MAX_TRACKED_ORIGINS:
+      self.request_origins.popitem(last=False)
+
+  def deliver_result(self, request_id: str, result, is_finished: bool) -> None:
+    """
+    Get a result of the last shard to the node that is waiting for it. Tokens
+    are coalesced on the way, other results go out as they are. Requests of
+    unknown origin are broadcast to every peer.
+    """
+    origin = self.request_origins.get(request_id, "")
+    if origin == self.id or not origin:
+      if is_finished: self.request_origins.pop(request_id, None)
+      if not origin: asyncio.create_task(self.broadcast_result(request_id, result, is_finished))
+    elif isinstance(result, list) and all(isinstance(token, int) for token in result):
+      self.result_batcher.add(request_id, result, is_finished)
+    else:
+      asyncio.create_task(self.send_result_to_origin(request_id, result, is_finished))
+
+  async def send_result_to_origin(self, request_id: str, result, is_finished: bool) -> None:
+    origin = self.request_origins.pop(request_id, None) if is_finished else self.request_origins.get(request_id)
+    peer = self.get_peer(origin)
+    if peer is None:
+      if DEBUG >= 1: print(f"[{request_id}] origin node {origin} is not a peer, broadcasting result")
+      await self.broadcast_result(request_id, result, is_finished)
+      return
+    if DEBUG >= 2: print(f"[{request_id}] sending result to origin {origin}: {result=} {is_finished=}")
+    await asyncio.wait_for(peer.send_result(request_id, result, is_finished), timeout=15.0)
 
   async def broadcast_result(self, request_id: str, result: List[int], is_finished: bool) -> None:
     if DEBUG >= 2: print(f"Broadcasting result: {request_id=} {result=} {is_finished=}")
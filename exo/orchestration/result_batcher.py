@@ -0,0 +1,61 @@
+import asyncio
+import traceback
+from dataclasses import dataclass, field
+from typing import Callable, Coroutine, Dict, List, Optional
+from exo import DEBUG
+
+
+@dataclass
+class PendingResult:
+  tokens: List[int] = field(default_factory=list)
+  is_finished: bool = False
+  timer: Optional[asyncio.TimerHandle] = None
+  sender: Optional[asyncio.Task] = None
+
+
+class ResultBatcher:
+  """
+  Coalesces the tokens of each request before they are sent to its origin node.
+
+  Tokens are held until max_tokens have built up, max_delay seconds have passed
+  since the first of them, or the request finishes. Sends of one request go out
+  one at a time and in order; tokens sampled while a send is in flight join the
+  next one, so a slow link gets fewer, larger messages.
+  """
+  def __init__(self, send: Callable[[str, List[int], bool], Coroutine], max_tokens: int = 8, max_delay: float = 0.02):
+    self.send = send
+    self.max_tokens = max(1, max_tokens)
+    self.max_delay = max_delay
+    self.pending: Dict[str, PendingResult] = {}
+
+  def add(self, request_id: str, tokens: List[int], is_finished: bool) -> None:
+    pending = self.pending.setdefault(request_id, PendingResult())
+    pending.tokens.extend(tokens)
+    pending.is_finished = pending.is_finished or is_finished
+    if pending.sender is not None: return
+    if pending.is_finished or len(pending.tokens) >= self.max_tokens:
+      self._flush(request_id)
+    elif pending.timer is None:
+      pending.timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush, request_id)
+
+  def _flush(self, request_id: str) -> None:
+    pending = self.pending.get(request_id)
+    if pending is None or pending.sender is not None: return
+    if pending.timer is not None:
+      pending.timer.cancel()
+      pending.timer = None
+    pending.sender = asyncio.create_task(self._send(request_id, pending))
+
+  async def _send(self, request_id: str, pending: PendingResult) -> None:
+    while pending.tokens or pending.is_finished:
+      tokens, pending.tokens = pending.tokens, []
+      is_finished = pending.is_finished
+      try:
+        await self.send(request_id, tokens, is_finished)
+      except Exception as e:
+        print(f"Error sending {len(tokens)} tokens of {request_id}: {e}")
+        if DEBUG >= 2: traceback.print_exc()
+      if is_finished:
+        self.pending.pop(request_id, None)
+        return
+    pending.sender = None
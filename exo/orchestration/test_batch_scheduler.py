@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+import numpy as np
+
+from exo.inference.dummy_inference_engine import DummyInferenceEngine
+from exo.inference.shard import Shard
+from exo.orchestration.batch_scheduler import BatchScheduler
+
+
+class RecordingInferenceEngine(DummyInferenceEngine):
+  def __init__(self):
+    super().__init__()
+    self.calls = []
+
+  async def infer_prompt(self, request_id, shard, prompt, inference_state=None):
+    self.calls.append(("prompt", request_id))
+    return await super().infer_prompt(request_id, shard, prompt, inference_state)
+
+  async def infer_tensor(self, request_id, shard, input_data, inference_state=None):
+    self.calls.append(("tensor", request_id))
+    return await super().infer_tensor(request_id, shard, input_data, inference_state)
+
+
+class TestBatchScheduler(unittest.IsolatedAsyncioTestCase):
+  def setUp(self):
+    self.engine = RecordingInferenceEngine()
+    self.shard = Shard("dummy", 0, 7, 8)
+    self.scheduler = BatchScheduler(lambda: self.engine, max_batch_size=2)
+
+  async def test_results_are_split_per_request(self):
+    results = await asyncio.gather(*[self.scheduler.submit_tensor(f"r{i}", self.shard, np.array([[i]])) for i in range(5)])
+    for i, (output, _) in enumerate(results):
+      np.testing.assert_array_equal(output, np.array([[i + 1]]))
+    self.assertEqual(len(self.engine.calls), 5)
+
+  async def test_batches_respect_max_batch_size(self):
+    batches = []
+    original = self.engine.infer_tensor_batch
+
+    async def recording_infer_tensor_batch(shard, requests):
+      batches.append([request_id for request_id, _, _ in requests])
+      return await original(shard, requests)
+
+    self.engine.infer_tensor_batch = recording_infer_tensor_batch
+    await asyncio.gather(*[self.scheduler.submit_tensor(f"r{i}", self.shard, np.array([[i]])) for i in range(5)])
+    self.assertEqual(batches, [["r0", "r1"], ["r2", "r3"], ["r4"]])
+
+  async def test_prompts_are_admitted_between_steps(self):
+    await asyncio.gather(
+      self.scheduler.submit_tensor("decode", self.shard, np.array([[1]])),
+      self.scheduler.submit_prompt("prefill", self.shard, "hello"),
+    )
+    self.assertLess(self.engine.calls.index(("prompt", "prefill")), self.engine.calls.index(("tensor", "decode")))
+
+  async def test_engine_errors_propagate_to_every_step_in_batch(self):
+    async def failing_infer_tensor(*args, **kwargs):
+      raise RuntimeError("boom")
+
+    self.engine.infer_tensor = failing_infer_tensor
+    results = await asyncio.gather(*[self.scheduler.submit_tensor(f"r{i}", self.shard, np.array([[i]])) for i in range(2)], return_exceptions=True)
+    self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+
+  async def test_request_errors_fail_only_that_step(self):
+    original = self.engine.infer_tensor_batch
+
+    async def one_failing_infer_tensor_batch(shard, requests):
+      results = await original(shard, requests)
+      return [RuntimeError("evicted") if request_id == "r0" else result for (request_id, _, _), result in zip(requests, results)]
+
+    self.engine.infer_tensor_batch = one_failing_infer_tensor_batch
+    results = await asyncio.gather(*[self.scheduler.submit_tensor(f"r{i}", self.shard, np.array([[i]])) for i in range(2)], return_exceptions=True)
+    self.assertIsInstance(results[0], RuntimeError)
+    np.testing.assert_array_equal(results[1][0], np.array([[2]]))
+
+  async def test_default_batch_fails_only_the_failing_request(self):
+    infer_tensor = self.engine.infer_tensor
+
+    async def one_failing_infer_tensor(request_id, *args, **kwargs):
+      if request_id == "r0": raise RuntimeError("boom")
+      return await infer_tensor(request_id, *args, **kwargs)
+
+    self.engine.infer_tensor = one_failing_infer_tensor
+    results = await asyncio.gather(*[self.scheduler.submit_tensor(f"r{i}", self.shard, np.array([[i]])) for i in range(2)], return_exceptions=True)
+    self.assertIsInstance(results[0], RuntimeError)
+    np.testing.assert_array_equal(results[1][0], np.array([[2]]))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,49 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from exo.inference.dummy_inference_engine import DummyInferenceEngine
+from exo.inference.shard import Shard
+from exo.orchestration.node import Node
+
+
+class ReleasingInferenceEngine(DummyInferenceEngine):
+  def __init__(self):
+    super().__init__()
+    self.released = []
+
+  async def release_request(self, request_id: str) -> None:
+    self.released.append(request_id)
+
+
+class TestRequestRelease(unittest.IsolatedAsyncioTestCase):
+  def make_node(self, node_id: str) -> Node:
+    return Node(node_id, mock.AsyncMock(), ReleasingInferenceEngine(), mock.AsyncMock(), mock.AsyncMock(), max_generate_tokens=2)
+
+  async def test_finished_requests_are_released_on_every_node(self):
+    last, first = self.make_node("last"), self.make_node("first")
+    peer = mock.AsyncMock()
+    peer.id = mock.Mock(return_value="first")
+    # what the first node's server does with the status it receives
+    peer.send_opaque_status.side_effect = lambda request_id, status: first.on_opaque_status.trigger_all(request_id, status)
+    last.peers = [peer]
+    last.track_origin("r")
+    shard = Shard("dummy", 4, 7, 8)
+
+    await last.process_inference_result(shard, np.array([5]), "r")
+    await asyncio.sleep(0.01)
+    self.assertEqual(last.inference_engine.released, [])
+
+    await last.process_inference_result(shard, np.array([6]), "r")
+    await asyncio.sleep(0.01)
+    self.assertEqual(last.inference_engine.released, ["r"])
+    self.assertEqual(first.inference_engine.released, ["r"])
+    status = json.loads(peer.send_opaque_status.await_args.args[1])
+    self.assertEqual(status, {"type": "request_finished", "node_id": "last"})
+
+
+if __name__ == "__main__":
+  unittest.main()
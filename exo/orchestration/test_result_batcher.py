@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from exo.inference.dummy_inference_engine import DummyInferenceEngine
+from exo.networking.peer_handle import PeerHandle
+from exo.orchestration.node import Node
+from exo.orchestration.result_batcher import ResultBatcher
+
+
+class TestResultBatcher(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.sent = []
+    self.send_delay = 0
+
+    async def send(request_id, tokens, is_finished):
+      await asyncio.sleep(self.send_delay)
+      self.sent.append((request_id, tokens, is_finished))
+
+    self.batcher = ResultBatcher(send, max_tokens=4, max_delay=0.01)
+
+  async def test_flushes_at_max_tokens(self):
+    for token in range(4):
+      self.batcher.add("r", [token], False)
+    await asyncio.sleep(0.001)
+    self.assertEqual(self.sent, [("r", [0, 1, 2, 3], False)])
+
+  async def test_flushes_after_max_delay(self):
+    self.batcher.add("r", [1], False)
+    self.batcher.add("r", [2], False)
+    await asyncio.sleep(0)
+    self.assertEqual(self.sent, [])
+    await asyncio.sleep(0.02)
+    self.assertEqual(self.sent, [("r", [1, 2], False)])
+
+  async def test_finish_flushes_and_forgets_request(self):
+    self.batcher.add("r", [1], False)
+    self.batcher.add("r", [2], True)
+    await asyncio.sleep(0.001)
+    self.assertEqual(self.sent, [("r", [1, 2], True)])
+    self.assertEqual(self.batcher.pending, {})
+
+  async def test_tokens_during_a_send_join_the_next_in_order(self):
+    self.send_delay = 0.01
+    for token in range(4):
+      self.batcher.add("r", [token], False)
+    await asyncio.sleep(0)
+    for token in range(4, 7):
+      self.batcher.add("r", [token], token == 6)
+    await asyncio.sleep(0.05)
+    self.assertEqual(self.sent, [("r", [0, 1, 2, 3], False), ("r", [4, 5, 6], True)])
+
+
+class TestOriginRouting(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.node = Node("last", mock.AsyncMock(), DummyInferenceEngine(), mock.AsyncMock(), mock.AsyncMock())
+    self.peers = {}
+    for peer_id in ["origin", "other"]:
+      peer = mock.AsyncMock(spec=PeerHandle)
+      peer.id.return_value = peer_id
+      self.peers[peer_id] = peer
+    self.node.peers = list(self.peers.values())
+
+  async def test_tokens_go_only_to_origin(self):
+    self.node.track_origin("r", "origin")
+    for token in range(3):
+      self.node.deliver_result("r", [token], token == 2)
+    await asyncio.sleep(0.05)
+
+    self.peers["origin"].send_result.assert_awaited_once_with("r", [0, 1, 2], True)
+    self.peers["other"].send_result.assert_not_awaited()
+    self.assertNotIn("r", self.node.request_origins)
+
+  async def test_local_requests_are_not_sent(self):
+    self.node.track_origin("r")
+    self.node.deliver_result("r", [1], True)
+    await asyncio.sleep(0.05)
+
+    for peer in self.peers.values():
+      peer.send_result.assert_not_awaited()
+
+  async def test_unknown_origin_is_broadcast(self):
+    self.node.track_origin("r", "")
+    self.node.deliver_result("r", [1], True)
+    await asyncio.sleep(0.05)
+
+    for peer in self.peers.values():
+      peer.send_result.assert_awaited_once_with("r", [1], True)
@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+
+from exo.inference.dummy_inference_engine import DummyInferenceEngine
+from exo.inference.shard import Shard
+from exo.networking.peer_handle import PeerHandle
+from exo.orchestration.node import Node
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
+from exo.topology.topology import Topology
+
+
+def capabilities(memory: int) -> DeviceCapabilities:
+  return DeviceCapabilities(model="test", chip="test", memory=memory, flops=DeviceFlops(fp32=1, fp16=2, int8=4))
+
+
+def peer(peer_id: str, memory: int):
+  handle = mock.AsyncMock(spec=PeerHandle)
+  handle.id.return_value = peer_id
+  handle.description.return_value = ""
+  handle.device_capabilities.return_value = capabilities(memory)
+  handle.collect_topology.return_value = Topology()
+  return handle
+
+
+class TestRoutingPlan(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.strategy = RingMemoryWeightedPartitioningStrategy()
+    self.node = Node("a", mock.AsyncMock(), DummyInferenceEngine(), mock.AsyncMock(), mock.AsyncMock(), partitioning_strategy=self.strategy)
+    self.node.device_capabilities = capabilities(2000)
+    self.node.peers = [peer("b", 1000)]
+    await self.node.collect_topology(set())
+
+  def test_topology_version_only_moves_on_change(self):
+    topology = Topology()
+    topology.update_node("a", capabilities(1000))
+    topology.add_edge("a", "b")
+    version = topology.version
+    topology.update_node("a", capabilities(1000))
+    topology.add_edge("a", "b")
+    self.assertEqual(topology.version, version)
+    topology.update_node("a", capabilities(2000))
+    self.assertEqual(topology.version, version + 1)
+
+  async def test_plan_is_reused_until_topology_changes(self):
+    with mock.patch.object(self.strategy, "partition", wraps=self.strategy.partition) as partition:
+      base_shard = Shard("model", 0, 0, 30)
+      for _ in range(10):
+        self.assertEqual(self.node.get_current_shard(base_shard), Shard("model", 0, 19, 30))
+        self.assertEqual(self.node.get_current_shard(base_shard, self.node.get_partition_index(offset=1)), Shard("model", 20, 29, 30))
+      await self.node.collect_topology(set())
+      self.node.get_current_shard(base_shard)
+      self.assertEqual(partition.call_count, 1)
+
+      self.node.peers = [peer("b", 1000), peer("c", 1000)]
+      await self.node.collect_topology(set())
+      self.assertEqual(self.node.get_current_shard(base_shard), Shard("model", 0, 14, 30))
+      self.assertEqual(partition.call_count, 2)
+
+  async def test_peer_lookup_follows_peer_list(self):
+    self.assertEqual(self.node.get_peer("b").id(), "b")
+    self.node.peers = [peer("c", 1000)]
+    self.assertIsNone(self.node.get_peer("b"))
+    self.assertEqual(self.node.get_peer("c").id(), "c")
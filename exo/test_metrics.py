@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+from prometheus_client import CollectorRegistry
+
+from exo.api.admission import AdmissionController
+from exo.inference.dummy_inference_engine import DummyInferenceEngine
+from exo.inference.shard import Shard
+from exo.metrics import REGISTRY, NodeCollector, TokenTimer, render
+from exo.networking.link_prober import LinkProber
+from exo.orchestration.batch_scheduler import BatchScheduler
+from exo.topology.gossip import TopologyGossip
+from exo.topology.topology import Topology
+
+
+class KVCacheEngine(DummyInferenceEngine):
+  def stats(self) -> dict:
+    return {"used_bytes": 1024, "total_bytes": 4096, "blocks": 4}
+
+
+class MetricsNode:
+  def __init__(self, engine):
+    self.id = "node-a"
+    self.inference_engine = engine
+    self.batch_scheduler = BatchScheduler(lambda: engine, node_id=self.id)
+    self.topology = Topology()
+    self.gossip = TopologyGossip(self.id)
+    self.link_prober = LinkProber()
+
+
+def sample(name: str, **labels) -> float:
+  return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_token_timer_records_first_token_then_gaps():
+  labels = {"model": "timer-model", "node": "node-a"}
+  timer = TokenTimer("timer-model", "node-a", started_at=time.perf_counter() - 0.5)
+  timer.tokens(1)
+  timer.tokens(3)
+  timer.tokens(0)
+
+  assert sample("exo_time_to_first_token_seconds_count", **labels) == 1
+  assert sample("exo_time_to_first_token_seconds_sum", **labels) >= 0.5
+  assert sample("exo_inter_token_latency_seconds_count", **labels) == 3
+
+
+@pytest.mark.asyncio
+async def test_scheduler_records_forward_time():
+  engine = KVCacheEngine()
+  scheduler = BatchScheduler(lambda: engine, node_id="node-a")
+  shard = Shard("forward-model", 0, 7, 8)
+  await asyncio.gather(*[scheduler.submit_tensor(f"r{i}", shard, np.array([[i]])) for i in range(3)])
+
+  assert sample("exo_shard_forward_seconds_count", model="forward-model", node="node-a", kind="tensor") >= 1
+
+
+@pytest.mark.asyncio
+async def test_node_collector_reads_queues_and_kv_cache():
+  engine = KVCacheEngine()
+  await engine.ensure_shard(Shard("dummy", 0, 7, 8))
+  admission = AdmissionController(max_in_flight=1)
+  await admission.acquire()
+  registry = CollectorRegistry()
+  registry.register(NodeCollector(MetricsNode(engine), admission))
+
+  assert registry.get_sample_value("exo_requests_in_flight", {"node": "node-a"}) == 1
+  assert registry.get_sample_value("exo_queue_depth", {"node": "node-a", "queue": "admission"}) == 0
+  assert registry.get_sample_value("exo_kv_cache_used_bytes", {"model": "dummy", "node": "node-a"}) == 1024
+  assert registry.get_sample_value("exo_kv_cache_total_bytes", {"model": "dummy", "node": "node-a"}) == 4096
+  assert registry.get_sample_value("exo_gossip_converged_peers", {"node": "node-a"}) == 1.0
+  assert registry.get_sample_value("exo_gossip_rounds_total", {"node": "node-a"}) == 0
+
+  text = render(registry).decode()
+  assert "exo_time_to_first_token_seconds" in text and "exo_kv_cache_used_bytes" in text
@@ -0,0 +1,72 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from exo.helpers import TokenRouter
+
+
+@pytest.mark.asyncio
+async def test_results_reach_only_their_subscriber():
+  router = TokenRouter()
+  a, b = router.subscribe("a"), router.subscribe("b")
+  router.publish("a", [1], False)
+  router.publish("c", [9], False)
+
+  assert await a.get(timeout=1) == ([1], False)
+  assert not b.pending
+  assert "c" not in router.subscriptions
+
+
+@pytest.mark.asyncio
+async def test_tokens_are_batched_until_read():
+  router = TokenRouter()
+  subscription = router.subscribe("a")
+  for token in range(5):
+    router.publish("a", [token], False)
+  router.publish("a", [5], True)
+  router.publish("a", [6], False)
+
+  assert await subscription.get(timeout=1) == ([0, 1, 2, 3, 4, 5], True)
+  assert await subscription.get(timeout=1) == ([6], False)
+  with pytest.raises(asyncio.TimeoutError):
+    await subscription.get(timeout=0.01)
+
+
+@pytest.mark.asyncio
+async def test_waiting_subscriber_is_woken():
+  router = TokenRouter()
+  subscription = router.subscribe("a")
+  waiter = asyncio.create_task(subscription.get(timeout=1))
+  await asyncio.sleep(0)
+  router.publish("a", [1, 2], True)
+
+  assert await waiter == ([1, 2], True)
+
+
+@pytest.mark.asyncio
+async def test_unbatched_results_are_kept_apart():
+  router = TokenRouter()
+  subscription = router.subscribe("a", batch=False)
+  image = np.zeros((2, 2))
+  router.publish("a", [1, 10], False)
+  router.publish("a", [2, 10], False)
+  router.publish("a", image, True)
+
+  assert await subscription.get() == ([1, 10], False)
+  assert await subscription.get() == ([2, 10], False)
+  result, is_finished = await subscription.get()
+  assert result is image and is_finished
+
+
+def test_observers_see_every_request():
+  router = TokenRouter()
+  seen = []
+  router.observe(lambda request_id, tokens, is_finished: seen.append(request_id))
+  router.subscribe("a")
+  router.publish("a", [1], False)
+  router.publish("b", [1], True)
+  router.unsubscribe("a")
+
+  assert seen == ["a", "b"]
+  assert router.subscriptions == {}
@@ -0,0 +1,148 @@
+"""
+Anti-entropy gossip of the cluster topology
+
+Every node owns one versioned record: its device capabilities and its edges to
+the peers it is connected to. In each round a node talks to a few random peers.
+It sends its digest (node_id -> version of every record it holds) along with
+the records the peer has not seen as of their last exchange, and gets back the
+records that are newer than its digest. A round therefore moves only what
+changed, and the number of RPCs per round is bounded by the fanout.
+"""
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from exo import DEBUG
+from exo.topology.device_capabilities import DeviceCapabilities
+from exo.topology.topology import Topology
+
+Digest = Dict[str, int]
+
+
+class Edge(NamedTuple):
+  to_id: str
+  description: Optional[str] = None
+  latency: Optional[float] = None  # seconds
+  bandwidth: Optional[float] = None  # bytes/s
+
+
+@dataclass
+class NodeRecord:
+  node_id: str
+  version: int
+  device_capabilities: DeviceCapabilities
+  edges: List[Edge] = field(default_factory=list)
+
+
+class TopologyGossip:
+  def __init__(self, node_id: str, fanout: int = 3):
+    self.node_id = node_id
+    self.fanout = max(1, fanout)
+    self.records: Dict[str, NodeRecord] = {}
+    # what each peer had as of our last exchange with it
+    self.peer_digests: Dict[str, Digest] = {}
+
+    # stats
+    self.rounds = 0
+    self.records_sent = 0
+    self.records_received = 0
+    self.last_change = time.time()
+
+  def update_self(self, device_capabilities: DeviceCapabilities, edges: Iterable[Tuple]) -> bool:
+    """
+    Refresh this node's own record, bumping its version if anything changed.
+    Versions start at the wall clock in ms so they keep increasing across restarts.
+    """
+    edges = sorted((Edge(*edge) for edge in edges), key=lambda edge: edge.to_id)
+    record = self.records.get(self.node_id)
+    if record is not None and record.device_capabilities == device_capabilities and record.edges == edges:
+      return False
+    version = max(record.version + 1 if record is not None else 0, int(time.time()*1000))
+    self.records[self.node_id] = NodeRecord(self.node_id, version, device_capabilities, edges)
+    self.last_change = time.time()
+    return True
+
+  def digest(self) -> Digest:
+    return {node_id: record.version for node_id, record in self.records.items()}
+
+  def delta(self, digest: Digest) -> List[NodeRecord]:
+    """Records newer than the ones in digest."""
+    return [record for node_id, record in self.records.items() if record.version > digest.get(node_id, -1)]
+
+  def merge(self, records: Iterable[NodeRecord]) -> int:
+    """Keep the records that are newer than ours. Returns how many were."""
+    changed = 0
+    for record in records:
+      # nobody else gets to say what this node looks like
+      if record.node_id == self.node_id: continue
+      current = self.records.get(record.node_id)
+      if current is None or record.version > current.version:
+        self.records[record.node_id] = record
+        changed += 1
+    self.records_received += changed
+    if changed:
+      self.last_change = time.time()
+    return changed
+
+  def outgoing(self, peer_id: str) -> List[NodeRecord]:
+    """Records to push to peer_id when starting a round with it."""
+    records = self.delta(self.peer_digests.get(peer_id, {}))
+    self.records_sent += len(records)
+    return records
+
+  def exchanged(self, peer_id: str, peer_digest: Digest, records: Iterable[NodeRecord]) -> int:
+    """Take in the peer's answer to a round we started."""
+    self.rounds += 1
+    self.peer_digests[peer_id] = dict(peer_digest)
+    return self.merge(records)
+
+  def handle(self, peer_id: str, peer_digest: Digest, records: Iterable[NodeRecord]) -> Tuple[Digest, List[NodeRecord]]:
+    """Answer a round started by peer_id: merge what it pushed and return our digest and what it is missing."""
+    self.merge(records)
+    reply = self.delta(peer_digest)
+    self.records_sent += len(reply)
+    self.peer_digests[peer_id] = {**peer_digest, **{record.node_id: record.version for record in reply}}
+    if DEBUG >= 5: print(f"[TopologyGossip] round from {peer_id}: sending {len(reply)} records")
+    return self.digest(), reply
+
+  def choose_peers(self, peer_ids: List[str], fanout: Optional[int] = None) -> List[str]:
+    return random.sample(peer_ids, min(self.fanout if fanout is None else fanout, len(peer_ids)))
+
+  def topology(self, direct_peers: Dict[str, DeviceCapabilities]) -> Topology:
+    """
+    Topology of the nodes reachable from this one over the edges in the
+    records. Records of nodes that dropped out of the graph stay in the
+    gossip state but do not show up here. Direct peers that do not gossip
+    are still included with the capabilities from their peer handle.
+    """
+    topology = Topology()
+    reachable, frontier = {self.node_id}, [self.node_id]
+    while frontier:
+      record = self.records.get(frontier.pop())
+      if record is None: continue
+      for edge in record.edges:
+        if edge.to_id not in reachable:
+          reachable.add(edge.to_id)
+          frontier.append(edge.to_id)
+    for node_id in sorted(reachable):
+      record = self.records.get(node_id)
+      if record is not None:
+        topology.update_node(node_id, record.device_capabilities)
+        for edge in record.edges:
+          topology.add_edge(node_id, *edge)
+      elif node_id in direct_peers:
+        topology.update_node(node_id, direct_peers[node_id])
+    return topology
+
+  def stats(self) -> dict:
+    digest = self.digest()
+    return {
+      "records": len(self.records),
+      "rounds": self.rounds,
+      "records_sent": self.records_sent,
+      "records_received": self.records_received,
+      # share of peers that had every record we have at our last exchange with them
+      "converged_peers": sum(1 for peer_digest in self.peer_digests.values() if peer_digest == digest)/len(self.peer_digests) if self.peer_digests else 1.0,
+      "seconds_since_change": time.time() - self.last_change,
+    }
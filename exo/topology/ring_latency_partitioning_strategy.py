@@ -0,0 +1,96 @@
+from typing import Dict, List, Optional
+
+from .partitioning_strategy import Partition, PartitioningStrategy
+from .ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
+from .ring_ordering import hop_seconds, ring_order
+from .topology import Topology
+
+
+class RingLatencyPartitioningStrategy(PartitioningStrategy):
+  """
+  Splits layers to minimize the estimated time for one token to go around the ring.
+
+  A token costs each node its share of the model's compute at the node's fp16
+  throughput, plus one hop to the next node: the link latency and the activation
+  over the link bandwidth. Compute is linear in the shares, so the fastest nodes
+  are filled first, each up to what fits in its memory after KV cache headroom,
+  while every node keeps min_share so it stays in the ring. The ring starts at the
+  fastest node and goes around the cheapest cycle of links, see ring_ordering.
+  The default min_share keeps at least one layer on each node for models of
+  20 layers or more.
+
+  Link latency and bandwidth come from the topology edges, which every node sees
+  the same, so every node computes the same plan. Links that have not been
+  measured yet are guessed from their interface type, or use default_latency and
+  default_bandwidth.
+  If the model does not fit with the headroom, or no node reports its flops, the
+  split is memory weighted.
+  """
+  def __init__(
+    self,
+    model_bytes: float = 16e9,
+    model_tflops_per_token: float = 0.016,
+    activation_bytes: int = 8192,
+    kv_headroom: float = 0.2,
+    min_share: float = 0.05,
+    default_latency: float = 0.001,
+    default_bandwidth: float = 125e6,
+  ):
+    self.model_bytes = model_bytes
+    self.model_tflops_per_token = model_tflops_per_token
+    self.activation_bytes = activation_bytes
+    self.kv_headroom = kv_headroom
+    self.min_share = min_share
+    self.default_link = (default_latency, default_bandwidth)
+    self.fallback = RingMemoryWeightedPartitioningStrategy()
+
+  def hop_seconds(self, topology: Topology, from_id: str, to_id: str) -> float:
+    return hop_seconds(topology, from_id, to_id, self.activation_bytes, self.default_link)
+
+  def throughput(self, topology: Topology) -> Optional[Dict[str, float]]:
+    """TFLOPS of each node, nodes that report none get the slowest known. None if no node reports any."""
+    flops = {node_id: caps.flops.fp16 or caps.flops.fp32 for node_id, caps in topology.all_nodes()}
+    known = [f for f in flops.values() if f > 0]
+    if not known: return None
+    return {node_id: f if f > 0 else min(known) for node_id, f in flops.items()}
+
+  def estimate(self, topology: Topology, partitions: List[Partition]) -> float:
+    """Estimated seconds for one token to go through every partition in order and back to the first."""
+    flops = self.throughput(topology)
+    if flops is None or not partitions: return float("inf")
+    seconds = 0.0
+    for i, partition in enumerate(partitions):
+      seconds += (partition.end - partition.start)*self.model_tflops_per_token/flops[partition.node_id]
+      if len(partitions) > 1:
+        seconds += self.hop_seconds(topology, partition.node_id, partitions[(i + 1) % len(partitions)].node_id)
+    return seconds
+
+  def ring_order(self, topology: Topology, node_ids: List[str], flops: Dict[str, float]) -> List[str]:
+    fastest_first = sorted(node_ids, key=lambda node_id: (-flops[node_id], node_id))
+    return ring_order(topology, fastest_first, self.activation_bytes, self.default_link)
+
+  def partition(self, topology: Topology) -> List[Partition]:
+    nodes = dict(topology.all_nodes())
+    flops = self.throughput(topology)
+    if flops is None: return self.fallback.partition(topology)
+
+    floor = min(self.min_share, 1/len(nodes))
+    # share of the model's weights each node can hold with room left for the KV cache
+    caps = {node_id: max(floor, caps.memory*1024*1024*(1 - self.kv_headroom)/self.model_bytes) for node_id, caps in nodes.items()}
+    if sum(caps.values()) < 1: return self.fallback.partition(topology)
+
+    shares = {node_id: floor for node_id in nodes}
+    left = 1 - floor*len(nodes)
+    for node_id in sorted(nodes, key=lambda node_id: (-flops[node_id], node_id)):
+      extra = min(left, caps[node_id] - shares[node_id])
+      shares[node_id] += extra
+      left -= extra
+
+    partitions = []
+    start = 0
+    order = self.ring_order(topology, list(nodes), flops)
+    for i, node_id in enumerate(order):
+      end = 1.0 if i == len(order) - 1 else round(start + shares[node_id], 5)
+      partitions.append(Partition(node_id, start, end))
+      start = end
+    return partitions
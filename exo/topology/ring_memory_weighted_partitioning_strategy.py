@@ -2,12 +2,16 @@ from typing import List
 from .partitioning_strategy import PartitioningStrategy
 from .topology import Topology
 from .partitioning_strategy import Partition
+from .ring_ordering import ring_order
 
 
 class RingMemoryWeightedPartitioningStrategy(PartitioningStrategy):
   def partition(self, topology: Topology) -> List[Partition]:
     nodes = list(topology.all_nodes())
     nodes.sort(key=lambda x: (x[1].memory, x[0]), reverse=True)
+    # biggest node first, then around the cheapest ring of links
+    order = ring_order(topology, [node[0] for node in nodes])
+    nodes.sort(key=lambda x: order.index(x[0]))
     total_memory = sum(node[1].memory for node in nodes)
     partitions = []
     start = 0
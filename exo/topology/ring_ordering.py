@@ -0,0 +1,116 @@
+"""
+Order of the nodes around the ring
+
+Every token goes once around the whole ring, so each hop's cost is paid on every
+token. order_ring finds the cheapest cycle through all nodes for a matrix of hop
+costs. It is exact (Held-Karp) up to EXACT_MAX_NODES nodes. Beyond that it
+improves a nearest neighbour tour with 2-opt moves.
+"""
+from typing import List, Optional, Sequence, Tuple
+
+from .topology import Topology
+
+EXACT_MAX_NODES = 10
+# bytes of hidden state sent per token on each hop
+ACTIVATION_BYTES = 8192
+# (latency in seconds, bandwidth in bytes/s) of links that have not been measured yet
+DEFAULT_LINK = (0.001, 125e6)
+# by the interface type discovery puts in the edge description
+INTERFACE_LINKS = {
+  "Thunderbolt": (0.0002, 2.5e9),
+  "Ethernet": (0.0005, 125e6),
+  "WiFi": (0.003, 25e6),
+  "External Virtual": (0.02, 12.5e6),
+}
+
+
+def link_estimate(topology: Topology, from_id: str, to_id: str, default: Tuple[float, float] = DEFAULT_LINK) -> Tuple[float, float]:
+  """(latency, bandwidth) of the link between two nodes as measured from either end, else guessed from its description."""
+  links = [conn for conn in (topology.get_link(from_id, to_id), topology.get_link(to_id, from_id)) if conn is not None]
+  for conn in links:
+    if conn.latency is not None:
+      return conn.latency, conn.bandwidth or default[1]
+  for conn in links:
+    for interface, estimate in INTERFACE_LINKS.items():
+      if conn.description and interface in conn.description:
+        return estimate
+  return default
+
+
+def hop_seconds(topology: Topology, from_id: str, to_id: str, activation_bytes: int = ACTIVATION_BYTES, default: Tuple[float, float] = DEFAULT_LINK) -> float:
+  latency, bandwidth = link_estimate(topology, from_id, to_id, default)
+  return latency + activation_bytes/bandwidth
+
+
+def cost_matrix(topology: Topology, node_ids: Sequence[str], activation_bytes: int = ACTIVATION_BYTES, default: Tuple[float, float] = DEFAULT_LINK) -> List[List[float]]:
+  return [[0.0 if a == b else hop_seconds(topology, a, b, activation_bytes, default) for b in node_ids] for a in node_ids]
+
+
+def cycle_cost(cost: List[List[float]], order: Sequence[int]) -> float:
+  return sum(cost[order[i]][order[(i + 1) % len(order)]] for i in range(len(order))) if len(order) > 1 else 0.0
+
+
+def order_ring(cost: List[List[float]]) -> List[int]:
+  """
+  Indices of the cheapest cycle found, starting at index 0. The given order
+  is kept unless a strictly cheaper cycle exists, so equal costs change nothing.
+  """
+  n = len(cost)
+  given = list(range(n))
+  if n <= 2: return given
+  best = _held_karp(cost) if n <= EXACT_MAX_NODES else _two_opt(cost, min(given, _nearest_neighbour(cost), key=lambda order: cycle_cost(cost, order)))
+  return best if cycle_cost(cost, best) < cycle_cost(cost, given) - 1e-12 else given
+
+
+def ring_order(topology: Topology, node_ids: Sequence[str], activation_bytes: int = ACTIVATION_BYTES, default: Tuple[float, float] = DEFAULT_LINK) -> List[str]:
+  """node_ids reordered around the cheapest ring, keeping the first node first."""
+  return [node_ids[i] for i in order_ring(cost_matrix(topology, node_ids, activation_bytes, default))]
+
+
+def _held_karp(cost: List[List[float]]) -> List[int]:
+  n = len(cost)
+  full = (1 << n) - 1
+  # best[mask][j]: cheapest path from 0 through the nodes in mask ending at j, and the node before j
+  best: List[List[Optional[Tuple[float, int]]]] = [[None]*n for _ in range(1 << n)]
+  best[1][0] = (0.0, -1)
+  for mask in range(1, 1 << n, 2):
+    for j in range(n):
+      if best[mask][j] is None: continue
+      path_cost = best[mask][j][0]
+      for k in range(1, n):
+        if mask & (1 << k): continue
+        next_cost = path_cost + cost[j][k]
+        entry = best[mask | (1 << k)][k]
+        if entry is None or next_cost < entry[0]:
+          best[mask | (1 << k)][k] = (next_cost, j)
+
+  last = min(range(1, n), key=lambda j: (best[full][j][0] + cost[j][0], j))
+  order, mask = [], full
+  while last != -1:
+    order.append(last)
+    last, mask = best[mask][last][1], mask & ~(1 << last)
+  return order[::-1]
+
+
+def _nearest_neighbour(cost: List[List[float]]) -> List[int]:
+  order, remaining = [0], list(range(1, len(cost)))
+  while remaining:
+    nearest = min(remaining, key=lambda k: cost[order[-1]][k])
+    remaining.remove(nearest)
+    order.append(nearest)
+  return order
+
+
+def _two_opt(cost: List[List[float]], order: List[int]) -> List[int]:
+  # whole cycle costs are compared so links that are faster one way are handled too
+  best_cost = cycle_cost(cost, order)
+  improved = True
+  while improved:
+    improved = False
+    for i in range(1, len(order) - 1):
+      for j in range(i + 1, len(order)):
+        candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+        candidate_cost = cycle_cost(cost, candidate)
+        if candidate_cost < best_cost - 1e-12:
+          order, best_cost, improved = candidate, candidate_cost, True
+  return order
@@ -0,0 +1,107 @@
+import unittest
+
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+from exo.topology.gossip import NodeRecord, TopologyGossip
+
+
+def capabilities(memory: int) -> DeviceCapabilities:
+  return DeviceCapabilities(model="test", chip="test", memory=memory, flops=DeviceFlops(fp32=1, fp16=2, int8=4))
+
+
+class Cluster:
+  """Gossip instances wired to each other in memory along the given edges."""
+  def __init__(self, edges, fanout=1):
+    self.neighbours = {}
+    for a, b in edges:
+      self.neighbours.setdefault(a, set()).add(b)
+      self.neighbours.setdefault(b, set()).add(a)
+    self.nodes = {node_id: TopologyGossip(node_id, fanout=fanout) for node_id in self.neighbours}
+    for node_id, gossip in self.nodes.items():
+      gossip.update_self(capabilities(1000), [(peer_id, "") for peer_id in self.neighbours[node_id]])
+
+  def exchange(self, a: str, b: str) -> int:
+    """One round started by a with b. Returns the records that went over the wire."""
+    records = self.nodes[a].outgoing(b)
+    digest, reply = self.nodes[b].handle(a, self.nodes[a].digest(), records)
+    self.nodes[a].exchanged(b, digest, reply)
+    return len(records) + len(reply)
+
+  def round(self) -> int:
+    sent = 0
+    for node_id, gossip in self.nodes.items():
+      for peer_id in gossip.choose_peers(sorted(self.neighbours[node_id])):
+        sent += self.exchange(node_id, peer_id)
+    return sent
+
+  def converged(self) -> bool:
+    digests = [gossip.digest() for gossip in self.nodes.values()]
+    return all(digest == digests[0] and len(digest) == len(self.nodes) for digest in digests)
+
+
+class TestTopologyGossip(unittest.TestCase):
+  def test_line_converges(self):
+    cluster = Cluster([(f"n{i}", f"n{i + 1}") for i in range(7)])
+    rounds = 0
+    while not cluster.converged():
+      cluster.round()
+      rounds += 1
+      self.assertLess(rounds, 20)
+
+    topology = cluster.nodes["n0"].topology({})
+    self.assertEqual(set(topology.nodes), set(cluster.nodes))
+    self.assertEqual({conn.to_id for conn in topology.peer_graph["n3"]}, {"n2", "n4"})
+
+  def test_rounds_after_convergence_only_send_changes(self):
+    cluster = Cluster([("a", "b"), ("b", "c"), ("c", "a")], fanout=2)
+    while not cluster.converged():
+      cluster.round()
+    cluster.round()
+    self.assertEqual(cluster.round(), 0)
+
+    self.assertTrue(cluster.nodes["b"].update_self(capabilities(2000), [("a", ""), ("c", "")]))
+    self.assertFalse(cluster.nodes["b"].update_self(capabilities(2000), [("c", ""), ("a", "")]))
+    # only b's new record moves: one copy per neighbour, plus at most one relayed duplicate
+    self.assertIn(cluster.round(), (2, 3))
+    self.assertEqual(cluster.nodes["a"].records["b"].device_capabilities.memory, 2000)
+    self.assertEqual(cluster.nodes["c"].records["b"].device_capabilities.memory, 2000)
+    self.assertEqual(cluster.nodes["a"].stats()["converged_peers"], 1.0)
+    cluster.round()
+    self.assertEqual(cluster.round(), 0)
+
+  def test_stale_records_are_ignored(self):
+    gossip = TopologyGossip("a")
+    gossip.update_self(capabilities(1000), [])
+    other = TopologyGossip("b")
+    other.update_self(capabilities(1000), [("a", "")])
+    old = other.records["b"]
+    other.update_self(capabilities(2000), [("a", "")])
+    self.assertEqual(gossip.merge([other.records["b"]]), 1)
+    self.assertEqual(gossip.merge([old]), 0)
+    self.assertEqual(gossip.records["b"].device_capabilities.memory, 2000)
+    # a node's own record only changes through update_self
+    self.assertEqual(gossip.merge([NodeRecord("a", 2**62, capabilities(1), [])]), 0)
+
+  def test_dropped_nodes_leave_the_topology(self):
+    cluster = Cluster([("a", "b"), ("b", "c")], fanout=1)
+    while not cluster.converged():
+      cluster.round()
+    cluster.nodes["b"].update_self(capabilities(1000), [("a", "")])
+    cluster.exchange("a", "b")
+    self.assertEqual(set(cluster.nodes["a"].topology({}).nodes), {"a", "b"})
+
+  def test_direct_peers_without_records_are_kept(self):
+    gossip = TopologyGossip("a")
+    gossip.update_self(capabilities(1000), [("legacy", "")])
+    topology = gossip.topology({"legacy": capabilities(500)})
+    self.assertEqual(topology.nodes["legacy"].memory, 500)
+
+  def test_fanout_bounds_peers_per_round(self):
+    gossip = TopologyGossip("a", fanout=2)
+    peers = [f"p{i}" for i in range(10)]
+    self.assertEqual(len(set(gossip.choose_peers(peers))), 2)
+    self.assertEqual(len(gossip.choose_peers(peers[:1])), 1)
+    self.assertEqual(len(gossip.choose_peers(peers, fanout=len(peers))), 10)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,94 @@
+import random
+import unittest
+
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+from exo.topology.partitioning_strategy import map_partitions_to_shards
+from exo.topology.ring_latency_partitioning_strategy import RingLatencyPartitioningStrategy
+from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
+from exo.topology.topology import Topology
+
+
+def synthetic_topology(nodes) -> Topology:
+  """nodes: (node_id, memory in MB, fp16 TFLOPS)"""
+  topology = Topology()
+  for node_id, memory, fp16 in nodes:
+    topology.update_node(node_id, DeviceCapabilities(model="test", chip="test", memory=memory, flops=DeviceFlops(fp32=fp16/2, fp16=fp16, int8=fp16*2)))
+  for node_id, _, _ in nodes:
+    for to_id, _, _ in nodes:
+      if node_id != to_id: topology.add_edge(node_id, to_id)
+  return topology
+
+
+def shares(partitions):
+  return {p.node_id: p.end - p.start for p in partitions}
+
+
+class TestRingLatencyPartitioningStrategy(unittest.TestCase):
+  def setUp(self):
+    self.strategy = RingLatencyPartitioningStrategy(model_bytes=16e9)
+    self.memory_weighted = RingMemoryWeightedPartitioningStrategy()
+
+  def compare(self, topology: Topology):
+    ours = self.strategy.partition(topology)
+    theirs = self.memory_weighted.partition(topology)
+    return self.strategy.estimate(topology, ours), self.strategy.estimate(topology, theirs), ours
+
+  def assert_valid(self, topology: Topology, partitions):
+    self.assertEqual({p.node_id for p in partitions}, set(topology.nodes))
+    self.assertEqual(partitions[0].start, 0)
+    self.assertEqual(partitions[-1].end, 1.0)
+    for a, b in zip(partitions, partitions[1:]):
+      self.assertEqual(a.end, b.start)
+    self.assertEqual(len(map_partitions_to_shards(partitions, 32, "model")), len(partitions))
+
+  def test_big_slow_box_does_not_get_most_layers(self):
+    topology = synthetic_topology([("slow", 64*1024, 2.0), ("fast", 24*1024, 80.0)])
+    ours, theirs, partitions = self.compare(topology)
+    self.assert_valid(topology, partitions)
+    self.assertLess(ours, theirs*0.5)
+    self.assertGreater(shares(partitions)["fast"], 0.5)
+    # the fast node holds no more than fits next to its KV cache headroom
+    self.assertLessEqual(shares(partitions)["fast"]*16e9, 24*1024*1024*1024*0.8 + 1)
+
+  def test_identical_nodes_match_memory_weighted(self):
+    topology = synthetic_topology([(f"n{i}", 16*1024, 10.0) for i in range(4)])
+    ours, theirs, partitions = self.compare(topology)
+    self.assert_valid(topology, partitions)
+    self.assertLessEqual(ours, theirs + 1e-9)
+
+  def test_model_too_big_falls_back_to_memory_weighted(self):
+    topology = synthetic_topology([("a", 8*1024, 10.0), ("b", 4*1024, 40.0)])
+    self.assertEqual(self.strategy.partition(topology), self.memory_weighted.partition(topology))
+
+  def test_unknown_flops_fall_back_to_memory_weighted(self):
+    topology = synthetic_topology([("a", 32*1024, 0.0), ("b", 16*1024, 0.0)])
+    self.assertEqual(self.strategy.partition(topology), self.memory_weighted.partition(topology))
+
+  def test_ring_avoids_slow_links(self):
+    topology = synthetic_topology([("a", 32*1024, 40.0), ("b", 32*1024, 30.0), ("c", 32*1024, 20.0), ("d", 32*1024, 10.0)])
+    # a-c and b-d are slow links, a ring a-b-c-d-a would cross none of them but a-c-... would
+    for from_id, to_id in [("a", "c"), ("b", "d")]:
+      topology.add_edge(from_id, to_id, latency=0.05, bandwidth=1e6)
+    partitions = self.strategy.partition(topology)
+    self.assert_valid(topology, partitions)
+    order = [p.node_id for p in partitions]
+    for i, node_id in enumerate(order):
+      self.assertNotIn({node_id, order[(i + 1) % len(order)]}, [{"a", "c"}, {"b", "d"}])
+
+  def test_never_worse_than_memory_weighted_on_random_topologies(self):
+    rng = random.Random(0)
+    wins = 0
+    for _ in range(200):
+      nodes = [(f"n{i}", rng.choice([8, 16, 24, 32, 64, 128])*1024, rng.uniform(1.0, 100.0)) for i in range(rng.randint(1, 6))]
+      topology = synthetic_topology(nodes)
+      ours, theirs, partitions = self.compare(topology)
+      self.assert_valid(topology, partitions)
+      # below min_share the memory weighted plan can leave a node without layers, which is cheaper but not valid
+      if min(shares(self.memory_weighted.partition(topology)).values()) >= self.strategy.min_share:
+        self.assertLessEqual(ours, theirs + 1e-9)
+      wins += ours < theirs*0.99
+    self.assertGreater(wins, 100)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,83 @@
+import itertools
+import random
+import unittest
+
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
+from exo.topology.ring_ordering import EXACT_MAX_NODES, cycle_cost, order_ring, ring_order
+from exo.topology.topology import Topology
+
+
+def brute_force(cost):
+  return min(([0] + list(rest) for rest in itertools.permutations(range(1, len(cost)))), key=lambda order: cycle_cost(cost, order))
+
+
+def random_costs(rng: random.Random, n: int, symmetric: bool = True):
+  cost = [[0.0]*n for _ in range(n)]
+  for i in range(n):
+    for j in range(n):
+      if i != j: cost[i][j] = cost[j][i] if symmetric and j < i else rng.uniform(0.1, 10.0)
+  return cost
+
+
+def clusters(n: int, groups: int):
+  """Nodes in groups, cheap links inside a group and expensive ones across. The best ring crosses groups-1 times plus once to close."""
+  return [[0.0 if i == j else 0.1 if i % groups == j % groups else 10.0 for j in range(n)] for i in range(n)]
+
+
+class TestRingOrdering(unittest.TestCase):
+  def test_exact_for_small_rings(self):
+    rng = random.Random(0)
+    for n in range(3, 8):
+      for symmetric in (True, False):
+        cost = random_costs(rng, n, symmetric)
+        order = order_ring(cost)
+        self.assertEqual(sorted(order), list(range(n)))
+        self.assertEqual(order[0], 0)
+        self.assertAlmostEqual(cycle_cost(cost, order), cycle_cost(cost, brute_force(cost)))
+
+  def test_heuristic_for_large_rings(self):
+    n = EXACT_MAX_NODES + 6
+    cost = clusters(n, 4)
+    order = order_ring(cost)
+    self.assertEqual(sorted(order), list(range(n)))
+    self.assertAlmostEqual(cycle_cost(cost, order), 4*10.0 + (n - 4)*0.1)
+
+    rng = random.Random(1)
+    cost = random_costs(rng, n)
+    self.assertLess(cycle_cost(cost, order_ring(cost)), cycle_cost(cost, list(range(n))))
+
+  def test_equal_costs_keep_the_given_order(self):
+    cost = [[0.0 if i == j else 1.0 for j in range(5)] for i in range(5)]
+    self.assertEqual(order_ring(cost), [0, 1, 2, 3, 4])
+
+  def test_slow_links_are_not_adjacent(self):
+    # two machines on Thunderbolt and two on WiFi: the ring should cross WiFi only twice
+    topology = Topology()
+    links = {("a", "c"): "Thunderbolt", ("b", "d"): "Thunderbolt"}
+    for a, b in itertools.permutations("abcd", 2):
+      topology.add_edge(a, b, links.get((a, b)) or links.get((b, a)) or "WiFi")
+    order = ring_order(topology, ["a", "b", "c", "d"])
+    self.assertEqual(order[0], "a")
+    hops = [{node_id, order[(i + 1) % 4]} for i, node_id in enumerate(order)]
+    self.assertIn({"a", "c"}, hops)
+    self.assertIn({"b", "d"}, hops)
+
+  def test_memory_weighted_uses_measured_links(self):
+    topology = Topology()
+    for node_id, memory in [("a", 4000), ("b", 3000), ("c", 2000), ("d", 1000)]:
+      topology.update_node(node_id, DeviceCapabilities(model="test", chip="test", memory=memory, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+    for a, b in itertools.permutations("abcd", 2):
+      topology.add_edge(a, b, "Ethernet", latency=0.05 if {a, b} in ({"a", "b"}, {"c", "d"}) else 0.001, bandwidth=125e6)
+    partitions = RingMemoryWeightedPartitioningStrategy().partition(topology)
+    order = [p.node_id for p in partitions]
+    self.assertEqual(order[0], "a")
+    self.assertEqual(set(order), {"a", "b", "c", "d"})
+    for i, node_id in enumerate(order):
+      self.assertNotIn({node_id, order[(i + 1) % 4]}, ({"a", "b"}, {"c", "d"}))
+    shares = {p.node_id: round(p.end - p.start, 4) for p in partitions}
+    self.assertEqual(shares, {"a": 0.4, "b": 0.3, "c": 0.2, "d": 0.1})
+
+
+if __name__ == "__main__":
+  unittest.main()
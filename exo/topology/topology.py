@@ -1,5 +1,5 @@
 from .device_capabilities import DeviceCapabilities
-from typing import Dict, Set, Optional
+from typing import Dict, Set, Optional, Tuple
 from dataclasses import dataclass
 
 @dataclass
@@ -7,6 +7,9 @@ class PeerConnection:
   from_id: str
   to_id: str
   description: Optional[str] = None
+  # measured by the link prober, None until then
+  latency: Optional[float] = None  # seconds
+  bandwidth: Optional[float] = None  # bytes/s
 
   def __hash__(self):
     # Use both from_id and to_id for uniqueness in sets
@@ -23,9 +26,13 @@ class Topology:
     self.nodes: Dict[str, DeviceCapabilities] = {}
     self.peer_graph: Dict[str, Set[PeerConnection]] = {}
     self.active_node_id: Optional[str] = None
+    # bumped whenever nodes or edges change, so anything derived from the topology can be cached against it
+    self.version = 0
 
   def update_node(self, node_id: str, device_capabilities: DeviceCapabilities):
+    if self.nodes.get(node_id) == device_capabilities: return
     self.nodes[node_id] = device_capabilities
+    self.version += 1
 
   def get_node(self, node_id: str) -> DeviceCapabilities:
     return self.nodes.get(node_id)
@@ -33,11 +40,22 @@ class Topology:
   def all_nodes(self):
     return self.nodes.items()
 
-  def add_edge(self, from_id: str, to_id: str, description: Optional[str] = None):
+  def add_edge(self, from_id: str, to_id: str, description: Optional[str] = None, latency: Optional[float] = None, bandwidth: Optional[float] = None):
     if from_id not in self.peer_graph:
       self.peer_graph[from_id] = set()
-    conn = PeerConnection(from_id, to_id, description)
-    self.peer_graph[from_id].add(conn)
+    existing = self.get_link(from_id, to_id)
+    if existing is not None:
+      if (latency, bandwidth) == (None, None) or (existing.latency, existing.bandwidth) == (latency, bandwidth): return
+      existing.latency, existing.bandwidth = latency, bandwidth
+    else:
+      self.peer_graph[from_id].add(PeerConnection(from_id, to_id, description, latency, bandwidth))
+    self.version += 1
+
+  def get_link(self, from_id: str, to_id: str) -> Optional[PeerConnection]:
+    return next((conn for conn in self.peer_graph.get(from_id, ()) if conn.to_id == to_id), None)
+
+  def link_metrics(self) -> Dict[Tuple[str, str], Tuple[Optional[float], Optional[float]]]:
+    return {(conn.from_id, conn.to_id): (conn.latency, conn.bandwidth) for connections in self.peer_graph.values() for conn in connections}
 
   def merge(self, peer_node_id: str, other: "Topology"):
     for node_id, capabilities in other.nodes.items():
@@ -46,7 +64,10 @@ class Topology:
     for node_id, connections in other.peer_graph.items():
       for conn in connections:
         if conn.from_id != peer_node_id: continue
-        self.add_edge(conn.from_id, conn.to_id, conn.description)
+        self.add_edge(conn.from_id, conn.to_id, conn.description, conn.latency, conn.bandwidth)
+
+  def same_layout(self, other: "Topology") -> bool:
+    return self.nodes == other.nodes and self.peer_graph == other.peer_graph and self.link_metrics() == other.link_metrics()
 
   def __str__(self):
     nodes_str = ", ".join(f"{node_id}: {cap}" for node_id, cap in self.nodes.items())
@@ -65,7 +86,9 @@ class Topology:
           {
             "from_id": conn.from_id,
             "to_id": conn.to_id,
-            "description": conn.description
+            "description": conn.description,
+            "latency": conn.latency,
+            "bandwidth": conn.bandwidth,
           }
           for conn in connections
         ]
@@ -0,0 +1,70 @@
+"""
+Micro-benchmark of the receive side of one hop: parse a TensorRequest off the
+wire, deserialize it in GRPCServer and hand it to the torch engine as a tensor.
+Counts how many times the activation buffer is copied after the message is
+parsed and compares against copying at every step.
+
+  python extra/bench_tensor_copies.py --seq-len 2048 --dim 4096
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from exo.inference.torch.models.llm_utils import tensor_from_numpy
+from exo.networking.compression import CompressionPolicy
+from exo.networking.grpc import node_service_pb2
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+
+
+def copying_path(request: node_service_pb2.TensorRequest):
+  tensor = np.frombuffer(request.tensor.tensor_data, dtype=np.dtype(request.tensor.dtype)).reshape(request.tensor.shape)
+  steps = [tensor, np.array(tensor)]
+  steps.append(torch.tensor(steps[-1]).to(dtype=torch.float32))
+  return steps
+
+
+def zero_copy_path(server: GRPCServer, request: node_service_pb2.TensorRequest):
+  _, tensor, _, _ = server.deserialize_tensor_request(request)
+  return [tensor, tensor_from_numpy(tensor).to(dtype=torch.float32)]
+
+
+def data_ptr(x) -> int:
+  return x.data_ptr() if isinstance(x, torch.Tensor) else x.ctypes.data
+
+
+def count_copies(steps) -> int:
+  return sum(data_ptr(a) != data_ptr(b) for a, b in zip(steps, steps[1:]))
+
+
+def bench(name: str, fn, wire: bytes, iters: int):
+  times = []
+  for _ in range(iters):
+    start = time.perf_counter()
+    steps = fn(node_service_pb2.TensorRequest.FromString(wire))
+    times.append(time.perf_counter() - start)
+  print(f"{name:>10}: {count_copies(steps)} copies after parse, {1000*np.median(times):.2f} ms/hop (median of {iters})")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--seq-len", type=int, default=2048)
+  parser.add_argument("--dim", type=int, default=4096)
+  parser.add_argument("--iters", type=int, default=20)
+  args = parser.parse_args()
+
+  hidden_state = np.random.default_rng(0).standard_normal((1, args.seq_len, args.dim)).astype(np.float32)
+  peer = GRPCPeerHandle("peer", "localhost:0", "bench", None, CompressionPolicy("none"))
+  server = GRPCServer(None, "localhost", 0)
+  request = node_service_pb2.TensorRequest(
+    shard=node_service_pb2.Shard(model_id="bench", start_layer=0, end_layer=0, n_layers=2),
+    tensor=peer.serialize_tensor(hidden_state),
+    request_id="bench",
+  )
+  wire = request.SerializeToString()
+  print(f"hidden state {hidden_state.shape} {hidden_state.nbytes/1e6:.1f} MB")
+
+  bench("copying", copying_path, wire, args.iters)
+  bench("zero-copy", lambda request: zero_copy_path(server, request), wire, args.iters)
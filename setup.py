@@ -48,6 +48,7 @@ extras_require = {
   "nvidia-gpu": ["nvidia-ml-py==12.560.30",],
   "amd-gpu": ["pyrsmi==0.2.0"],
   "other-os": ["uvloop==0.21.0"],
+  "fast-compression": ["lz4==4.3.3"],
 }
 
 USE_APPLE = False